@@ -0,0 +1,122 @@
+"""
+Async facade over VideoDownloader.
+
+VideoDownloader's downloads are blocking (yt-dlp, requests). The bot handlers
+await the methods here instead, which run them on a bounded thread pool so
+the event loop keeps serving updates for other chats. ffmpeg work is already
+async and is bounded by the shared ffmpeg_runner instead.
+"""
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import url_canonicalizer
+from config import DOWNLOAD_WORKERS, TELEGRAM_UPLOAD_LIMIT
+from video_downloader import VideoDownloader
+from ffmpeg_runner import runner as ffmpeg_runner
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncVideoDownloader:
+    """Run VideoDownloader jobs on a download pool and ffmpeg work on the shared runner."""
+
+    def __init__(self, downloader: VideoDownloader | None = None,
+                 download_workers: int = DOWNLOAD_WORKERS):
+        self.downloader = downloader or VideoDownloader()
+
+        # Network downloads spend most of their time waiting on sockets, so
+        # this pool can be much larger than the CPU-bound ffmpeg limit.
+        self.download_pool = ThreadPoolExecutor(
+            max_workers=download_workers, thread_name_prefix="download"
+        )
+        logger.info(
+            f"Async downloader ready: {download_workers} download workers, "
+            f"{ffmpeg_runner.max_concurrent} concurrent ffmpeg jobs"
+        )
+
+    async def _run(self, pool: ThreadPoolExecutor, func, *args, **kwargs):
+        """Run a blocking callable on `pool` and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+
+    @property
+    def session(self):
+        """Pooled HTTP session of the wrapped downloader."""
+        return self.downloader.session
+
+    def is_supported_platform(self, url: str) -> bool:
+        """Check if the URL is from a supported platform (non-blocking)."""
+        return self.downloader.is_supported_platform(url)
+
+    async def media_key(self, url: str) -> str:
+        """Canonical cache/dedup key for a URL; short links are resolved on the download pool."""
+        if url_canonicalizer.needs_resolution(url):
+            return await self._run(self.download_pool, url_canonicalizer.media_key, url)
+        return url_canonicalizer.media_key(url)
+
+    async def _prepared(self, result: tuple[str | None, str]) -> tuple[str | None, str]:
+        """Remux/transcode a finished download for Telegram."""
+        file_path, info = result
+        if file_path:
+            file_path = await self.downloader.prepare_output(file_path)
+        return file_path, info
+
+    async def download_video(self, url: str, resolve_direct: bool = True) -> tuple[str | None, str]:
+        """Download a TikTok/Instagram/Facebook video on the download pool."""
+        return await self._prepared(
+            await self._run(self.download_pool, self.downloader.download_video, url, resolve_direct)
+        )
+
+    async def resolve_direct_url(self, url: str) -> tuple[str, str] | None:
+        """Resolve a TikTok link to a direct video URL on the download pool."""
+        return await self._run(self.download_pool, self.downloader.resolve_direct_url, url)
+
+    async def download_direct_url(self, video_url: str, title: str) -> tuple[str | None, str]:
+        """Download an already resolved direct URL on the download pool."""
+        return await self._prepared(
+            await self._run(self.download_pool, self.downloader.download_direct_url, video_url, title)
+        )
+
+    async def download_youtube(self, url: str, format_type: str,
+                               size_limit: int | None = TELEGRAM_UPLOAD_LIMIT) -> tuple[str | None, str]:
+        """
+        Download a YouTube video or audio file on the download pool; audio is converted to MP3.
+
+        `size_limit` None skips fitting the format to the upload limit (split mode).
+        """
+        result = await self._run(self.download_pool, self.downloader.download_youtube, url, format_type,
+                                 size_limit)
+        if format_type == 'video':
+            return await self._prepared(result)
+        file_path, info = result
+        if not file_path:
+            return result
+        mp3_path = await self.downloader.convert_to_mp3(file_path)
+        if not mp3_path:
+            self.downloader.cleanup_file(file_path)
+            return None, "Failed to convert audio to MP3"
+        return mp3_path, info
+
+    async def compress_video(self, input_path: str,
+                             target_size_mb: float = TELEGRAM_UPLOAD_LIMIT / (1024 * 1024)) -> str | None:
+        """Compress a video with ffmpeg (waits for a free ffmpeg slot)."""
+        return await self.downloader.compress_video(input_path, target_size_mb)
+
+    async def choose_shrink_mode(self, input_path: str) -> str:
+        """'compress' or 'split' for a file over the upload limit."""
+        return await self.downloader.choose_shrink_mode(input_path)
+
+    async def split_video(self, input_path: str) -> list[str] | None:
+        """Split a file into stream-copied parts under the upload limit."""
+        return await self.downloader.split_video(input_path)
+
+    def cleanup_file(self, file_path: str):
+        """Remove a specific file after use."""
+        self.downloader.cleanup_file(file_path)
+
+    def shutdown(self, wait: bool = True):
+        """Stop the download pool and close the pooled YoutubeDL instances."""
+        self.download_pool.shutdown(wait=wait)
+        self.downloader.ydl_pool.close()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Benchmark single-process vs segment-parallel transcoding by input length.
+
+Usage: python benchmark_transcode.py [duration_seconds ...]   (default: 60 180 600)
+
+Synthetic 720p clips with a sine tone are generated once per duration, then
+encoded to a size target (the compress_video path) and to MP3 (the YouTube
+audio path), first with one ffmpeg process and then in parallel segments.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from parallel_transcoder import segment_runner
+from media_encoder import encode_to_size, encode_mp3
+
+DURATIONS = [int(arg) for arg in sys.argv[1:]] or [60, 180, 600]
+TARGET_KBPS = 1500  # size target for the video encode
+
+
+async def make_clip(path: str, duration: int):
+    proc = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-c:a', 'aac', '-shortest', path,
+    )
+    await proc.wait()
+
+
+async def timed(coro):
+    started = time.monotonic()
+    path, report = await coro
+    return time.monotonic() - started, path, report
+
+
+async def main():
+    print(f"Segment encoders: {segment_runner.max_concurrent}")
+    print(f"{'input':>8} {'job':>6} {'single s':>9} {'parallel s':>11} {'segments':>9} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for duration in DURATIONS:
+            clip = os.path.join(tmp, f'clip_{duration}.mp4')
+            await make_clip(clip, duration)
+            target = duration * TARGET_KBPS * 1000 // 8
+
+            jobs = {
+                'video': lambda name, parallel: encode_to_size(
+                    clip, os.path.join(tmp, f'{name}.mp4'), target, parallel=parallel),
+                'mp3': lambda name, parallel: encode_mp3(
+                    clip, os.path.join(tmp, f'{name}.mp3'), parallel=parallel),
+            }
+            for job, run in jobs.items():
+                single, single_path, _ = await timed(run(f'{job}_{duration}_single', False))
+                parallel, parallel_path, report = await timed(run(f'{job}_{duration}_parallel', True))
+                if not single_path or not parallel_path:
+                    print(f"{duration:>7}s {job:>6} failed: {report}")
+                    continue
+                print(f"{duration:>7}s {job:>6} {single:>9.1f} {parallel:>11.1f} "
+                      f"{report['segments']:>9} {single / parallel:>7.2f}x")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -3,19 +3,35 @@ Telegram bot handlers for video downloading functionality.
 """
 
 import os
+import asyncio
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.error import TelegramError
-from video_downloader import VideoDownloader
-from config import MESSAGES
+from async_downloader import AsyncVideoDownloader
+from file_id_cache import FileIdCache
+from url_canonicalizer import detect_platform, canonicalize, YOUTUBE_ID
+from single_flight import SingleFlight
+from stream_uploader import stream_video_to_chat
+from job_queue import JobQueue
+from retry_policy import TELEGRAM_RETRY
+from config import (MESSAGES, STREAM_UPLOAD_ENABLED, TELEGRAM_UPLOAD_LIMIT, SHRINK_MODE,
+                    JOB_QUEUE_MODE, JOB_WAIT_TIMEOUT, TELEGRAM_UPLOAD_TIMEOUT)
 import re
-from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
-# Initialize video downloader
-downloader = VideoDownloader()
+# Initialize video downloader (blocking work runs on background worker pools)
+downloader = AsyncVideoDownloader()
+
+# Telegram file_ids of media we already uploaded, so repeat links skip the download
+file_id_cache = FileIdCache()
+
+# Downloads currently running, keyed by media key + format, so duplicates can join them
+inflight = SingleFlight()
+
+# In "queue" mode downloads run in download_worker.py processes; opened on first use
+job_queue = None
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /start command."""
@@ -25,17 +41,264 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Error sending start message: {e}")
 
-def _is_youtube_url(url: str) -> bool:
-    """Check if URL is from YouTube."""
+async def _remember_upload(media_key: str, format_type: str, message) -> str | None:
+    """Store the file_id Telegram assigned to media we just sent and return it."""
+    if not message:
+        return None
+    media = message.video or message.audio or message.document
+    if not media:
+        return None
+    await asyncio.to_thread(file_id_cache.put, media_key, format_type, media.file_id)
+    return media.file_id
+
+async def _send_media(bot, chat_id: int, format_type: str, media, caption: str):
+    """
+    Send a video or audio file (open file object or file_id) to a chat.
+
+    Flood control and connect errors are retried with backoff. Timeouts are
+    not: Telegram may have received the file and posted it anyway.
+    """
+    def rewind(error):
+        # The failed attempt read the file to its end
+        if hasattr(media, 'seek'):
+            media.seek(0)
+
+    return await TELEGRAM_RETRY.call_async(_send_media_once, bot, chat_id, format_type, media, caption,
+                                           label=f"Sending {format_type} to chat {chat_id}", on_retry=rewind)
+
+async def _send_media_once(bot, chat_id: int, format_type: str, media, caption: str):
+    if format_type == 'audio':
+        return await bot.send_audio(
+            chat_id=chat_id,
+            audio=media,
+            caption=caption,
+            write_timeout=TELEGRAM_UPLOAD_TIMEOUT,
+            read_timeout=TELEGRAM_UPLOAD_TIMEOUT
+        )
+    return await bot.send_video(
+        chat_id=chat_id,
+        video=media,
+        caption=caption,
+        supports_streaming=True,
+        write_timeout=TELEGRAM_UPLOAD_TIMEOUT,
+        read_timeout=TELEGRAM_UPLOAD_TIMEOUT
+    )
+
+def _part_caption(caption: str, index: int, total: int) -> str:
+    return caption if total == 1 else f"{caption} ({index}/{total})"
+
+async def _resend_media(bot, chat_id: int, format_type: str, file_id: str, caption: str):
+    """Send already uploaded media by file_id; split uploads are stored as comma-joined ids."""
+    file_ids = file_id.split(',')
+    for index, part_id in enumerate(file_ids, 1):
+        await _send_media(bot, chat_id, format_type, part_id, _part_caption(caption, index, len(file_ids)))
+
+async def _send_cached(bot, chat_id: int, media_key: str, format_type: str, caption: str,
+                       cache_format: str | None = None) -> bool:
+    """Re-send media from Telegram's servers if it was uploaded before."""
+    cache_format = cache_format or format_type
+    # SQLite calls block, so the cache is used from a thread like the job queue
+    cached_file_id = await asyncio.to_thread(file_id_cache.get, media_key, cache_format)
+    if not cached_file_id:
+        return False
     try:
-        parsed_url = urlparse(url.lower())
-        domain = parsed_url.netloc
-        if domain.startswith('www.'):
-            domain = domain[4:]
-        return domain in ['youtube.com', 'youtu.be', 'm.youtube.com']
-    except Exception:
+        await _resend_media(bot, chat_id, format_type, cached_file_id, caption)
+        logger.info(f"{cache_format} for {media_key} sent from file_id cache to chat {chat_id}")
+        return True
+    except TelegramError as e:
+        logger.warning(f"Cached file_id rejected, downloading again: {e}")
+        await asyncio.to_thread(file_id_cache.invalidate, media_key, cache_format)
         return False
 
+async def _deliver_parts(bot, chat_id: int, media_key: str, format_type: str, cache_format: str,
+                         file_path: str, caption: str) -> tuple[str | None, str]:
+    """
+    Split an oversized file into stream-copied parts and send them in order.
+
+    Returns:
+        tuple: (comma-joined file_ids, "sent") on success, (None, error_code) on failure
+    """
+    split_msg = await bot.send_message(chat_id, MESSAGES["splitting"])
+    parts = await downloader.split_video(file_path)
+    try:
+        if not parts:
+            return None, "file_too_large"
+        file_ids = []
+        for index, part in enumerate(parts, 1):
+            with open(part, 'rb') as media_file:
+                sent_message = await _send_media(bot, chat_id, format_type, media_file,
+                                                 _part_caption(caption, index, len(parts)))
+            media = sent_message.video or sent_message.audio or sent_message.document
+            file_ids.append(media.file_id)
+        logger.info(f"{format_type} for {media_key} sent to chat {chat_id} in {len(parts)} parts")
+        file_id = ','.join(file_ids)
+        await asyncio.to_thread(file_id_cache.put, media_key, cache_format, file_id)
+        return file_id, "sent"
+    finally:
+        for part in parts or []:
+            downloader.cleanup_file(part)
+        try:
+            await split_msg.delete()
+        except:
+            pass
+
+async def _deliver_file(bot, chat_id: int, media_key: str, format_type: str,
+                        file_path: str, caption: str, shrink_mode: str = SHRINK_MODE,
+                        cache_format: str | None = None) -> tuple[str | None, str]:
+    """
+    Upload a downloaded file, shrinking it first if it exceeds the upload limit.
+
+    The size is checked before uploading, so an oversized file never costs a
+    full upload that Telegram then rejects. Oversized files are compressed or
+    split into parts according to `shrink_mode` ('compress', 'split' or
+    'auto'). The downloaded (and compressed/split) files are always cleaned up.
+
+    Returns:
+        tuple: (file_id, "sent") on success, (None, error_code) on failure
+    """
+    cache_format = cache_format or format_type
+    upload_path = file_path
+    compress_msg = None
+    try:
+        file_size = os.path.getsize(file_path)
+        if file_size > TELEGRAM_UPLOAD_LIMIT:
+            if shrink_mode == 'auto':
+                shrink_mode = await downloader.choose_shrink_mode(file_path)
+            logger.info(f"{format_type} for {media_key} is {file_size / (1024 * 1024):.1f}MB, "
+                        f"over the {TELEGRAM_UPLOAD_LIMIT / (1024 * 1024):.0f}MB upload limit; {shrink_mode} first")
+            if shrink_mode == 'split':
+                return await _deliver_parts(bot, chat_id, media_key, format_type, cache_format,
+                                            file_path, caption)
+            compress_msg = await bot.send_message(chat_id, MESSAGES["compressing"])
+            upload_path = await downloader.compress_video(file_path)
+            if not upload_path:
+                return None, "file_too_large"
+
+        with open(upload_path, 'rb') as media_file:
+            sent_message = await _send_media(bot, chat_id, format_type, media_file, caption)
+        logger.info(f"{format_type} for {media_key} sent successfully to chat {chat_id}")
+        return await _remember_upload(media_key, cache_format, sent_message), "sent"
+
+    except TelegramError as e:
+        logger.error(f"Telegram error sending {format_type}: {e}")
+        if "file is too big" in str(e).lower():
+            return None, "file_too_large"
+        return None, "upload_failed"
+
+    except Exception as e:
+        logger.error(f"Error sending {format_type}: {e}")
+        return None, "upload_failed"
+
+    finally:
+        # Clean up the downloaded file and any compressed copy
+        downloader.cleanup_file(file_path)
+        if upload_path and upload_path != file_path:
+            downloader.cleanup_file(upload_path)
+        if compress_msg:
+            try:
+                await compress_msg.delete()
+            except:
+                pass
+
+async def _download_and_deliver_video(bot, chat_id: int, url: str, media_key: str) -> tuple[str | None, str]:
+    """Download a TikTok/Instagram/Facebook video and upload it to the chat."""
+    resolve_direct = True
+    if STREAM_UPLOAD_ENABLED and detect_platform(url) == 'tiktok':
+        resolved = await downloader.resolve_direct_url(url)
+        if resolved:
+            video_url, title = resolved
+            # Pipe the CDN response straight into the upload, no disk round-trip
+            file_id, result = await stream_video_to_chat(
+                bot, downloader.session, downloader.download_pool, chat_id,
+                video_url, MESSAGES["completed"], "tiktok_video.mp4"
+            )
+            if file_id:
+                await asyncio.to_thread(file_id_cache.put, media_key, 'video', file_id)
+                return file_id, "sent"
+            if result in ("sent", "upload_unknown"):
+                # Telegram may have posted it; a second upload could duplicate the video
+                return None, result
+            logger.info(f"Streaming upload not possible ({result}), falling back to disk")
+            file_path, result = await downloader.download_direct_url(video_url, title)
+            if not file_path:
+                return None, result
+            return await _deliver_file(bot, chat_id, media_key, 'video', file_path, MESSAGES["completed"])
+        # The no-watermark APIs just failed; asking them again would only add their timeouts
+        resolve_direct = False
+
+    file_path, result = await downloader.download_video(url, resolve_direct)
+    if not file_path:
+        return None, result
+    return await _deliver_file(bot, chat_id, media_key, 'video', file_path, MESSAGES["completed"])
+
+async def _download_and_deliver_youtube(bot, chat_id: int, url: str, format_type: str,
+                                        media_key: str, caption: str, shrink_mode: str = SHRINK_MODE,
+                                        cache_format: str | None = None) -> tuple[str | None, str]:
+    """Download a YouTube video/audio and upload it to the chat."""
+    # Split mode wants full quality; anything else picks a format that fits the upload limit
+    size_limit = None if shrink_mode == 'split' else TELEGRAM_UPLOAD_LIMIT
+    file_path, result = await downloader.download_youtube(url, format_type, size_limit)
+    if not file_path:
+        return None, result
+    return await _deliver_file(bot, chat_id, media_key, format_type, file_path, caption,
+                               shrink_mode=shrink_mode, cache_format=cache_format)
+
+async def run_job(bot, kind: str, payload: dict) -> dict:
+    """
+    Download a job's media and upload it to the job's chat.
+    
+    Runs in the bot process ("inline" mode) or in a download worker ("queue" mode).
+    
+    Args:
+        bot: telegram.Bot used for the upload
+        kind (str): 'video' (TikTok/Instagram/Facebook) or 'youtube'
+        payload (dict): chat_id, url, media_key, format_type, caption,
+            shrink_mode and cache_format
+        
+    Returns:
+        dict: {'file_id': str or None, 'result': str}
+    """
+    if kind == 'video':
+        file_id, result = await _download_and_deliver_video(bot, payload['chat_id'], payload['url'],
+                                                            payload['media_key'])
+    elif kind == 'youtube':
+        file_id, result = await _download_and_deliver_youtube(
+            bot, payload['chat_id'], payload['url'], payload['format_type'], payload['media_key'],
+            payload['caption'], shrink_mode=payload['shrink_mode'], cache_format=payload['cache_format']
+        )
+    else:
+        raise ValueError(f"Unknown job kind: {kind}")
+    return {'file_id': file_id, 'result': result}
+
+async def _run_download(bot, kind: str, payload: dict, dedup_key: str) -> tuple[str | None, str]:
+    """Run a download job here, or in queue mode hand it to the workers and wait for its result."""
+    global job_queue
+    if JOB_QUEUE_MODE != 'queue':
+        result = await run_job(bot, kind, payload)
+        return result['file_id'], result['result']
+
+    # SQLite calls block, so they run off the event loop
+    job_queue = job_queue or await asyncio.to_thread(JobQueue)
+    job_id, created = await asyncio.to_thread(job_queue.enqueue, kind, payload, dedup_key)
+    job = await job_queue.wait(job_id, JOB_WAIT_TIMEOUT)
+    if job['status'] == 'timeout':
+        # Stop the worker so it cannot upload after the user got the error
+        if not await asyncio.to_thread(job_queue.cancel, job_id):
+            # Finished between the last poll and the cancel
+            job = await asyncio.to_thread(job_queue.get, job_id)
+    if job['status'] != 'done':
+        logger.error(f"Job {job_id} {job['status']}: {job['error']}")
+        return None, "timeout" if job['status'] == 'timeout' else "download_failed"
+
+    file_id, result = job['result']['file_id'], job['result']['result']
+    if file_id:
+        # The worker may run on another node with its own cache
+        await asyncio.to_thread(file_id_cache.put, payload['media_key'], payload['cache_format'], file_id)
+        if job['payload']['chat_id'] != payload['chat_id']:
+            # Joined a job another chat queued first; the worker uploaded to that chat
+            await _resend_media(bot, payload['chat_id'], payload['format_type'], file_id, payload['caption'])
+    return file_id, result
+
 async def handle_video_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle video links sent by users."""
     try:
@@ -45,6 +308,7 @@ async def handle_video_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
         user_message = update.message.text.strip()
         user_id = update.effective_user.id
+        chat_id = update.message.chat_id
         
         logger.info(f"Received message from user {user_id}: {user_message}")
         logger.info(f"Update object: {update}")
@@ -61,75 +325,44 @@ async def handle_video_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         # Special handling for YouTube URLs - show format options
-        if _is_youtube_url(user_message):
+        if detect_platform(user_message) == 'youtube':
+            # The buttons carry the link, so no per-process state is needed
+            ref = _youtube_ref(user_message)
+            if not ref:
+                await update.message.reply_text(MESSAGES["error_unsupported"])
+                return
             keyboard = [
-                [InlineKeyboardButton(MESSAGES["youtube_video_1080"], callback_data=f"yt_video_{user_id}")],
-                [InlineKeyboardButton(MESSAGES["youtube_audio_mp3"], callback_data=f"yt_audio_{user_id}")]
+                [InlineKeyboardButton(MESSAGES["youtube_video_1080"], callback_data=f"yt_video_{ref}")],
+                [InlineKeyboardButton(MESSAGES["youtube_video_parts"], callback_data=f"yt_parts_{ref}")],
+                [InlineKeyboardButton(MESSAGES["youtube_audio_mp3"], callback_data=f"yt_audio_{ref}")]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            # Store the URL in context for later use
-            context.user_data[f'youtube_url_{user_id}'] = user_message
-            
             await update.message.reply_text(MESSAGES["youtube_options"], reply_markup=reply_markup)
             return
         
-        # For non-YouTube platforms, proceed with normal download
-        processing_message = await update.message.reply_text(MESSAGES["processing"])
-        file_path, result = downloader.download_video(user_message)
+        # Re-send straight from Telegram's servers if this media was uploaded before
+        media_key = await downloader.media_key(user_message)
+        if await _send_cached(context.bot, chat_id, media_key, 'video', MESSAGES["completed"]):
+            return
         
-        if file_path:
-            try:
-                # Send the video file
-                with open(file_path, 'rb') as video_file:
-                    await update.message.reply_video(
-                        video=video_file,
-                        caption=MESSAGES["completed"],
-                        supports_streaming=True
-                    )
-                
-                logger.info(f"Video sent successfully to user {user_id}")
-                
-            except TelegramError as e:
-                if "file is too big" in str(e).lower():
-                    # Try to compress the video
-                    compress_msg = await update.message.reply_text(MESSAGES["compressing"])
-                    compressed_path = downloader.compress_video(file_path)
-                    
-                    if compressed_path:
-                        try:
-                            with open(compressed_path, 'rb') as compressed_file:
-                                await update.message.reply_video(
-                                    video=compressed_file,
-                                    caption=MESSAGES["completed"],
-                                    supports_streaming=True
-                                )
-                            logger.info(f"Compressed video sent successfully to user {user_id}")
-                            # Clean up compressed file
-                            downloader.cleanup_file(compressed_path)
-                        except Exception as comp_e:
-                            await update.message.reply_text(MESSAGES["error_download_failed"])
-                            logger.error(f"Error sending compressed video: {comp_e}")
-                    else:
-                        await update.message.reply_text(MESSAGES["error_file_too_large"])
-                    
-                    try:
-                        await compress_msg.delete()
-                    except:
-                        pass
-                else:
-                    await update.message.reply_text(MESSAGES["error_download_failed"])
-                logger.error(f"Telegram error sending video: {e}")
-            
-            except Exception as e:
-                await update.message.reply_text(MESSAGES["error_download_failed"])
-                logger.error(f"Error sending video: {e}")
-            
-            finally:
-                # Clean up the downloaded file
-                downloader.cleanup_file(file_path)
+        # For non-YouTube platforms, proceed with normal download. Concurrent
+        # requests for the same media wait for the first one instead of downloading again.
+        processing_message = await update.message.reply_text(MESSAGES["processing"])
+        payload = {'chat_id': chat_id, 'url': user_message, 'media_key': media_key, 'format_type': 'video',
+                   'caption': MESSAGES["completed"], 'shrink_mode': SHRINK_MODE, 'cache_format': 'video'}
+        (file_id, result), shared = await inflight.do(
+            f"{media_key}|video",
+            lambda: _run_download(context.bot, 'video', payload, f"{media_key}|video")
+        )
         
-        else:
+        if file_id and shared:
+            await _resend_media(context.bot, chat_id, 'video', file_id, MESSAGES["completed"])
+            logger.info(f"Video sent to user {user_id} from coalesced download")
+        elif result in ("sent", "upload_unknown"):
+            # Posted without a file_id to remember, or possibly posted; no error message
+            logger.warning(f"Video for user {user_id} sent without a file_id: {result}")
+        elif not file_id:
             # Handle different error types
             if result == "unsupported_platform":
                 await update.message.reply_text(MESSAGES["error_unsupported"])
@@ -165,18 +398,23 @@ async def handle_youtube_callback(update: Update, context: ContextTypes.DEFAULT_
     try:
         callback_data = query.data
         user_id = update.effective_user.id
+        chat_id = query.message.chat_id
         
-        # Get the stored YouTube URL
-        youtube_url = context.user_data.get(f'youtube_url_{user_id}')
-        if not youtube_url:
-            await query.edit_message_text("خەپە! ناتوانم URL بدۆزمەوە، تکایە دووبارە تاقی بکەوە")
-            return
+        # The button carries the link (see _youtube_ref)
+        youtube_url = _youtube_url(callback_data[len('yt_video_'):])
         
         # Determine format based on callback
+        shrink_mode = SHRINK_MODE
         if callback_data.startswith('yt_video_'):
             format_type = 'video'
             processing_msg = MESSAGES["processing_video"]
             completed_msg = MESSAGES["completed_video"]
+        elif callback_data.startswith('yt_parts_'):
+            # Full quality, split into parts instead of re-encoded if over the limit
+            format_type = 'video'
+            shrink_mode = 'split'
+            processing_msg = MESSAGES["processing_video"]
+            completed_msg = MESSAGES["completed_video"]
         elif callback_data.startswith('yt_audio_'):
             format_type = 'audio'
             processing_msg = MESSAGES["processing_audio"]
@@ -185,87 +423,43 @@ async def handle_youtube_callback(update: Update, context: ContextTypes.DEFAULT_
             await query.edit_message_text(MESSAGES["error_download_failed"])
             return
         
+        # Re-send straight from Telegram's servers if this format was uploaded before
+        media_key = await downloader.media_key(youtube_url)
+        cache_format = format_type if shrink_mode == SHRINK_MODE else f"{format_type}_{shrink_mode}"
+        if await _send_cached(context.bot, chat_id, media_key, format_type, completed_msg, cache_format):
+            try:
+                await query.delete_message()
+            except:
+                pass
+            return
+        
         # Update message to show processing
         await query.edit_message_text(processing_msg)
         
-        # Download with specified format
-        file_path, result = downloader.download_youtube(youtube_url, format_type)
+        # Download with specified format, sharing the job with concurrent requests
+        payload = {'chat_id': chat_id, 'url': youtube_url, 'media_key': media_key, 'format_type': format_type,
+                   'caption': completed_msg, 'shrink_mode': shrink_mode, 'cache_format': cache_format}
+        (file_id, result), shared = await inflight.do(
+            f"{media_key}|{cache_format}",
+            lambda: _run_download(context.bot, 'youtube', payload, f"{media_key}|{cache_format}")
+        )
         
-        if file_path:
+        if file_id:
+            if shared:
+                await _resend_media(context.bot, chat_id, format_type, file_id, completed_msg)
+                logger.info(f"YouTube {format_type} sent to user {user_id} from coalesced download")
+            # Delete the options message
             try:
-                # Send the file
-                if format_type == 'audio':
-                    with open(file_path, 'rb') as audio_file:
-                        await context.bot.send_audio(
-                            chat_id=query.message.chat_id,
-                            audio=audio_file,
-                            caption=completed_msg
-                        )
-                else:
-                    with open(file_path, 'rb') as video_file:
-                        await context.bot.send_video(
-                            chat_id=query.message.chat_id,
-                            video=video_file,
-                            caption=completed_msg,
-                            supports_streaming=True
-                        )
-                
-                logger.info(f"YouTube {format_type} sent successfully to user {user_id}")
-                
-            except TelegramError as e:
-                if "file is too big" in str(e).lower():
-                    # Try to compress the video/audio
-                    await context.bot.send_message(query.message.chat_id, MESSAGES["compressing"])
-                    compressed_path = downloader.compress_video(file_path)
-                    
-                    if compressed_path:
-                        try:
-                            if format_type == 'audio':
-                                with open(compressed_path, 'rb') as compressed_file:
-                                    await context.bot.send_audio(
-                                        chat_id=query.message.chat_id,
-                                        audio=compressed_file,
-                                        caption=completed_msg
-                                    )
-                            else:
-                                with open(compressed_path, 'rb') as compressed_file:
-                                    await context.bot.send_video(
-                                        chat_id=query.message.chat_id,
-                                        video=compressed_file,
-                                        caption=completed_msg,
-                                        supports_streaming=True
-                                    )
-                            logger.info(f"Compressed YouTube {format_type} sent successfully to user {user_id}")
-                            # Clean up compressed file
-                            downloader.cleanup_file(compressed_path)
-                        except Exception as comp_e:
-                            await context.bot.send_message(query.message.chat_id, MESSAGES["error_download_failed"])
-                            logger.error(f"Error sending compressed YouTube {format_type}: {comp_e}")
-                    else:
-                        await context.bot.send_message(query.message.chat_id, MESSAGES["error_file_too_large"])
-                else:
-                    await context.bot.send_message(query.message.chat_id, MESSAGES["error_download_failed"])
-                logger.error(f"Telegram error sending YouTube {format_type}: {e}")
-            
-            except Exception as e:
-                await context.bot.send_message(query.message.chat_id, MESSAGES["error_download_failed"])
-                logger.error(f"Error sending YouTube {format_type}: {e}")
-            
-            finally:
-                # Clean up the downloaded file
-                downloader.cleanup_file(file_path)
-                # Delete the options message
-                try:
-                    await query.delete_message()
-                except:
-                    pass
+                await query.delete_message()
+            except:
+                pass
+        elif result == "file_too_large":
+            await query.edit_message_text(MESSAGES["error_file_too_large"])
+            logger.error(f"YouTube {format_type} too large for user {user_id}")
         else:
             await query.edit_message_text(MESSAGES["error_download_failed"])
             logger.error(f"YouTube {format_type} download failed for user {user_id}: {result}")
         
-        # Clean up stored URL
-        context.user_data.pop(f'youtube_url_{user_id}', None)
-        
     except Exception as e:
         logger.error(f"Unexpected error in handle_youtube_callback: {e}")
         try:
@@ -273,6 +467,31 @@ async def handle_youtube_callback(update: Update, context: ContextTypes.DEFAULT_
         except:
             pass
 
+# Telegram caps callback data at 64 bytes; every YouTube button prefix is 9 characters
+_CALLBACK_REF_MAX = 64 - len('yt_video_')
+
+def _youtube_ref(url: str) -> str | None:
+    """
+    Short reference to a YouTube link that fits into callback data.
+
+    The link travels with the format buttons instead of living in one
+    process's memory, so any webhook replica can answer the button press.
+
+    Returns:
+        str: The video ID, or the normalized link if it has none and is
+        short enough; None otherwise
+    """
+    _, media_id = canonicalize(url, resolve=False)
+    if re.fullmatch(YOUTUBE_ID, media_id) or len(media_id.encode()) <= _CALLBACK_REF_MAX:
+        return media_id
+    return None
+
+def _youtube_url(ref: str) -> str:
+    """Link for a reference made by _youtube_ref."""
+    if re.fullmatch(YOUTUBE_ID, ref):
+        return f"https://www.youtube.com/watch?v={ref}"
+    return f"https://{ref}"
+
 def _is_valid_url(text: str) -> bool:
     """Check if the text contains a valid URL."""
     url_pattern = re.compile(
@@ -3,6 +3,7 @@ Configuration file for the Telegram bot.
 """
 
 import os
+import logging
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -11,6 +12,19 @@ load_dotenv()
 # Telegram Bot Token - get from environment variables
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# Bot API endpoint; empty uses api.telegram.org (set for a local Bot API server or the offline stand-in)
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "").rstrip("/")
+
+# Update ingestion: "polling" (getUpdates, one process) or "webhook" (embedded aiohttp server, any number of replicas)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")  # public base URL of the load balancer, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "5000")))  # Railway provides PORT
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")  # empty derives one from the bot token, identical on every replica
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # parallel deliveries Telegram may open (1-100)
+WEBHOOK_SET_ON_START = os.getenv("WEBHOOK_SET_ON_START", "true").lower() == "true"  # register the webhook at startup
+
 # Supported platforms
 SUPPORTED_PLATFORMS = [
     "tiktok.com",
@@ -42,10 +56,12 @@ MESSAGES = {
     "youtube_options": "YouTube ڤیدیۆ - چ جۆرەیەکت دەوێت؟",
     "youtube_video_1080": "🎥 ڤیدیۆ 1080p",
     "youtube_audio_mp3": "🎵 دەنگ MP3",
+    "youtube_video_parts": "🎞 ڤیدیۆ 1080p بە چەند بەشێک",
     "processing_video": "ڤیدیۆ 1080p دادەبەزێت...",
     "processing_audio": "دەنگ MP3 دادەبەزێت...",
     "completed_video": "فەرموو ئەوەش ڤیدیۆکەت",
     "completed_audio": "فەرموو ئەوەش فایلی دەنگەکەت",
+    "splitting": "ڤیدیۆکە لە سنووری تلگرام گەورەترە، بە چەند بەشێک دەنێردرێت",
     "compressing": "بەهۆی ئەوەی کە تلگرام ڕیگا نادات ڤیدیۆی سەروو ٥٠ مێگابایت لەڕێگەی بۆتی تلگرام بنێردرێت ڕەنگە نەتوانین بەو کوالیتیەی دەتەوی ڤیدیۆکەت پێشکەش بکەین"
 }
 
@@ -65,3 +81,128 @@ PROXY_ROTATION_ENABLED = False
 # Download settings
 MAX_FILE_SIZE = 1000 * 1024 * 1024  # 1GB limit for downloads
 TEMP_DIR = "/tmp/telegram_bot_downloads"
+
+# Worker pools - blocking downloader work runs off the event loop
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "16"))  # network-bound yt-dlp / HTTP jobs
+_USABLE_CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 2)
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", str(max(1, _USABLE_CORES // 2))))  # concurrent ffmpeg jobs (x264 is multi-threaded)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))  # updates handled in parallel by the bot
+
+# Telegram file_id cache - repeat links are re-sent without downloading again
+CACHE_DIR = os.getenv("CACHE_DIR", "/tmp/telegram_bot_cache")
+FILE_ID_CACHE_PATH = os.getenv("FILE_ID_CACHE_PATH", os.path.join(CACHE_DIR, "file_ids.sqlite3"))
+FILE_ID_CACHE_TTL = int(os.getenv("FILE_ID_CACHE_TTL", str(30 * 24 * 3600)))  # 30 days
+FILE_ID_CACHE_MAX_ENTRIES = int(os.getenv("FILE_ID_CACHE_MAX_ENTRIES", "50000"))
+
+# Short-link resolution (vm.tiktok.com, fb.watch, ...) - redirects are cached
+SHORT_LINK_CACHE_TTL = int(os.getenv("SHORT_LINK_CACHE_TTL", str(24 * 3600)))
+SHORT_LINK_CACHE_MAX_ENTRIES = int(os.getenv("SHORT_LINK_CACHE_MAX_ENTRIES", "10000"))
+
+# TikTok no-watermark API race
+TIKTOK_HEDGE_DELAY = float(os.getenv("TIKTOK_HEDGE_DELAY", "0.5"))  # seconds before launching the next endpoint
+TIKTOK_API_TIMEOUT = float(os.getenv("TIKTOK_API_TIMEOUT", "20"))
+
+# Resolver endpoint health tracking and circuit breakers
+ENDPOINT_WINDOW_SIZE = int(os.getenv("ENDPOINT_WINDOW_SIZE", "50"))  # calls kept per endpoint
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))  # consecutive failures to open
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "60"))  # seconds before probing an open endpoint
+ENDPOINT_PROBE_INTERVAL = float(os.getenv("ENDPOINT_PROBE_INTERVAL", "10"))
+
+# Shared HTTP connection pool for direct fetches (TikTok APIs, CDN downloads)
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "32"))  # distinct hosts kept alive
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", "16"))  # max open connections per host
+
+# Multi-connection ranged downloads for direct CDN links
+RANGED_DOWNLOAD_CONNECTIONS = int(os.getenv("RANGED_DOWNLOAD_CONNECTIONS", "4"))  # 1 disables ranged mode
+RANGED_DOWNLOAD_CHUNK_SIZE = int(os.getenv("RANGED_DOWNLOAD_CHUNK_SIZE", str(4 * 1024 * 1024)))  # bytes per range request
+RANGED_DOWNLOAD_MIN_SIZE = int(os.getenv("RANGED_DOWNLOAD_MIN_SIZE", str(8 * 1024 * 1024)))  # smaller files use one stream
+RANGED_DOWNLOAD_IO_BUFFER = int(os.getenv("RANGED_DOWNLOAD_IO_BUFFER", str(256 * 1024)))  # bytes per read/write
+
+# Telegram Bot API upload limit (50MB for api.telegram.org, up to 2GB with a local Bot API server)
+TELEGRAM_UPLOAD_LIMIT = int(os.getenv("TELEGRAM_UPLOAD_LIMIT", str(50 * 1024 * 1024)))
+
+# Stream direct-URL (TikTok API) downloads straight into the Telegram upload
+STREAM_UPLOAD_ENABLED = os.getenv("STREAM_UPLOAD_ENABLED", "true").lower() == "true"
+STREAM_UPLOAD_CHUNK_SIZE = int(os.getenv("STREAM_UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+STREAM_UPLOAD_BUFFER_CHUNKS = int(os.getenv("STREAM_UPLOAD_BUFFER_CHUNKS", "32"))  # bounded in-memory buffer
+
+# yt-dlp extraction (info dict) cache
+METADATA_CACHE_DIR = os.getenv("METADATA_CACHE_DIR", os.path.join(CACHE_DIR, "metadata"))
+METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", "1800"))  # upper bound; signed URLs may expire sooner
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_ENTRIES", "256"))  # in memory
+METADATA_CACHE_MAX_DISK_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_DISK_ENTRIES", "2000"))
+METADATA_CACHE_EXPIRY_MARGIN = int(os.getenv("METADATA_CACHE_EXPIRY_MARGIN", "300"))  # seconds kept before URL expiry
+
+# Pooled YoutubeDL instances (one pool per platform profile, up to DOWNLOAD_WORKERS each)
+YDL_POOL_PREWARM = int(os.getenv("YDL_POOL_PREWARM", "1"))  # instances built per profile at startup
+YDL_POOL_CHECKOUT_TIMEOUT = int(os.getenv("YDL_POOL_CHECKOUT_TIMEOUT", "300"))  # longest wait for a free instance
+
+# Background cleanup of TEMP_DIR (least recently used artifacts are evicted first)
+TEMP_QUOTA_BYTES = int(os.getenv("TEMP_QUOTA_BYTES", str(5 * 1024 * 1024 * 1024)))  # max bytes kept in TEMP_DIR
+TEMP_MIN_FREE_BYTES = int(os.getenv("TEMP_MIN_FREE_BYTES", str(1024 * 1024 * 1024)))  # free-disk floor
+TEMP_MAX_AGE = int(os.getenv("TEMP_MAX_AGE", "3600"))  # unclaimed artifacts older than this are removed
+TEMP_JANITOR_INTERVAL = int(os.getenv("TEMP_JANITOR_INTERVAL", "60"))  # seconds between sweeps
+TEMP_CLAIM_TTL = int(os.getenv("TEMP_CLAIM_TTL", "7200"))  # in-flight claims older than this are ignored
+
+# Size-targeted compression (ffprobe duration -> exact bitrate budget)
+COMPRESS_TWO_PASS = os.getenv("COMPRESS_TWO_PASS", "true").lower() == "true"  # false = capped CRF, single pass
+COMPRESS_PRESET = os.getenv("COMPRESS_PRESET", "fast")  # x264 preset
+COMPRESS_AUDIO_KBPS = int(os.getenv("COMPRESS_AUDIO_KBPS", "128"))  # upper bound; lowered for tight budgets
+COMPRESS_SIZE_MARGIN = float(os.getenv("COMPRESS_SIZE_MARGIN", "0.03"))  # share of target kept for container overhead
+COMPRESS_TIMEOUT = int(os.getenv("COMPRESS_TIMEOUT", "600"))  # seconds per ffmpeg pass
+
+# Assumed CPU cost of a full transcode (CPU seconds per media second) until real transcodes refine it
+TRANSCODE_CPU_ESTIMATE = float(os.getenv("TRANSCODE_CPU_ESTIMATE", "2.0"))
+
+# Oversized files: re-encode to fit ("compress"), cut into stream-copied parts ("split"), or decide per file ("auto")
+SHRINK_MODE = os.getenv("SHRINK_MODE", "auto")
+SPLIT_MAX_ENCODE_SECONDS = int(os.getenv("SPLIT_MAX_ENCODE_SECONDS", "240"))  # auto: split if a re-encode would take longer
+SPLIT_MIN_VIDEO_KBPS = int(os.getenv("SPLIT_MIN_VIDEO_KBPS", "500"))  # auto: split if compressing would starve the video below this
+SPLIT_SIZE_MARGIN = float(os.getenv("SPLIT_SIZE_MARGIN", "0.05"))  # share of the limit kept free in each part
+
+# Segment-parallel transcoding of long inputs (cut at keyframes, segments encoded concurrently, joined with stream copy)
+PARALLEL_TRANSCODE_PROCESSES = int(os.getenv("PARALLEL_TRANSCODE_PROCESSES", str(_USABLE_CORES)))  # concurrent segment encodes; 1 disables
+PARALLEL_MIN_DURATION = int(os.getenv("PARALLEL_MIN_DURATION", "120"))  # shorter inputs are encoded by one ffmpeg process
+PARALLEL_MIN_SEGMENT_SECONDS = int(os.getenv("PARALLEL_MIN_SEGMENT_SECONDS", "30"))  # segments are never shorter than this
+
+# Job queue between the bot front end and download workers ("inline" runs downloads in the bot process)
+JOB_QUEUE_MODE = os.getenv("JOB_QUEUE_MODE", "inline").lower()  # "inline" or "queue" (run download_worker.py)
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join(CACHE_DIR, "jobs.sqlite3"))
+JOB_QUEUE_URL = os.getenv("JOB_QUEUE_URL", "").rstrip("/")  # workers on other nodes: the front end's queue API
+JOB_QUEUE_PORT = int(os.getenv("JOB_QUEUE_PORT", "0"))  # front end serves the queue API here; 0 = same-node workers only
+JOB_QUEUE_TOKEN = os.getenv("JOB_QUEUE_TOKEN", "")  # queue API secret; empty derives one from the bot token
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "120"))  # a claimed job reappears if not extended within this
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # deliveries before a job is marked failed
+JOB_WAIT_TIMEOUT = int(os.getenv("JOB_WAIT_TIMEOUT", "1800"))  # front end stops waiting for a result after this
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", str(24 * 3600)))  # finished jobs are purged after this
+JOB_WORKER_PROCESSES = int(os.getenv("JOB_WORKER_PROCESSES", "2"))  # processes started by download_worker.py
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))  # jobs one worker process runs at once
+
+# Supervision of download worker processes (download_worker.py)
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", "200"))  # a worker process is recycled after this many jobs; 0 = never
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", "1024"))  # recycled once its resident memory crosses this; 0 = no cap
+JOB_DEADLINE = int(os.getenv("JOB_DEADLINE", "590"))  # a job still running after this is cancelled and fails
+WORKER_HANG_TIMEOUT = int(os.getenv("WORKER_HANG_TIMEOUT", "120"))  # a worker whose event loop stops responding this long is killed
+WORKER_STOP_TIMEOUT = int(os.getenv("WORKER_STOP_TIMEOUT", "600"))  # a worker asked to stop is killed if still running after this
+WORKER_RESTART_BACKOFF = int(os.getenv("WORKER_RESTART_BACKOFF", "60"))  # longest wait before restarting a worker that keeps crashing
+
+# Every delivery of a job may run until its deadline; the front end has to outwait all of them
+if JOB_DEADLINE * JOB_MAX_ATTEMPTS >= JOB_WAIT_TIMEOUT:
+    logging.getLogger(__name__).warning(
+        f"JOB_DEADLINE ({JOB_DEADLINE}s) x JOB_MAX_ATTEMPTS ({JOB_MAX_ATTEMPTS}) is not below "
+        f"JOB_WAIT_TIMEOUT ({JOB_WAIT_TIMEOUT}s); slow jobs will be cancelled before their last attempt"
+    )
+
+# Retries (retry_policy.py): jittered exponential backoff, limited per download job
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))  # seconds before the first retry; doubles per retry
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "16"))  # longest backoff step
+DOWNLOAD_RETRY_BUDGET = int(os.getenv("DOWNLOAD_RETRY_BUDGET", "4"))  # retries one download job may spend over all its steps
+DOWNLOAD_DEADLINE = int(os.getenv("DOWNLOAD_DEADLINE", "300"))  # no retry is started once a download job has run this long
+TELEGRAM_SEND_ATTEMPTS = int(os.getenv("TELEGRAM_SEND_ATTEMPTS", "3"))  # tries per upload on flood control/connect errors
+# Write and read timeout of an upload; the default allows 512 KB/s for a file at the upload limit
+TELEGRAM_UPLOAD_TIMEOUT = int(os.getenv("TELEGRAM_UPLOAD_TIMEOUT", str(max(60, TELEGRAM_UPLOAD_LIMIT // (512 * 1024)))))
+
+# YouTube player client selection (youtube_strategy.py): clients are ranked by recent success and extraction time
+YOUTUBE_CLIENT_FAILURE_PENALTY = float(os.getenv("YOUTUBE_CLIENT_FAILURE_PENALTY", "30"))  # seconds of score a 100% failure rate costs
+YOUTUBE_HEDGE_CLIENTS = os.getenv("YOUTUBE_HEDGE_CLIENTS", "false").lower() == "true"  # race the two best clients' extractions
+YOUTUBE_HEDGE_DELAY = float(os.getenv("YOUTUBE_HEDGE_DELAY", "2"))  # seconds before the second client joins the race; 0 = at once
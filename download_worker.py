@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Download workers for queue mode (JOB_QUEUE_MODE=queue).
+
+Usage: python download_worker.py [processes]   (default: JOB_WORKER_PROCESSES)
+
+Each worker process claims jobs from the job queue, runs up to
+JOB_WORKER_CONCURRENCY at once with the same download/upload code the bot
+runs inline (bot_handlers.run_job) and uploads the result straight to the
+requesting chat. While a job runs its visibility timeout is extended, so a
+worker that dies leaves the job to be picked up by another one. A job whose
+lease is lost (cancelled by the front end, or taken over by another worker)
+is stopped, so it does not upload a second time or after the user was told
+it failed.
+
+The worker processes run under a supervisor that keeps their memory flat
+over long uptimes (yt-dlp keeps extractor state, cookie jars and info dicts
+around):
+- a worker is recycled after WORKER_MAX_JOBS jobs, or when its RSS crosses
+  WORKER_MAX_RSS_MB: it stops claiming, finishes its running jobs and exits,
+  and a fresh process takes its place,
+- a job still running after JOB_DEADLINE is cancelled and fails for good; the worker
+  is then recycled, since threads started by the job may still be running,
+- a worker whose event loop stops responding for WORKER_HANG_TIMEOUT, or
+  that does not exit within WORKER_STOP_TIMEOUT of being asked to, is killed,
+- crashed workers are restarted, with a growing delay if they keep crashing.
+
+Workers on the front end's node open the queue's SQLite file; set
+JOB_QUEUE_URL to the front end's queue API to run them on other nodes.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+import logging
+from telegram import Bot
+from telegram.request import HTTPXRequest
+from job_queue import JobQueue, RemoteJobQueue
+from retry_policy import is_retryable
+from config import (BOT_TOKEN, TELEGRAM_API_BASE_URL, JOB_QUEUE_URL, JOB_VISIBILITY_TIMEOUT,
+                    JOB_WORKER_PROCESSES, JOB_WORKER_CONCURRENCY, WORKER_MAX_JOBS, WORKER_MAX_RSS_MB,
+                    JOB_DEADLINE, WORKER_HANG_TIMEOUT, WORKER_STOP_TIMEOUT, WORKER_RESTART_BACKOFF)
+
+logging.basicConfig(
+    format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# A worker that ran at least this long before crashing is restarted without delay
+_STABLE_SECONDS = 60
+# How often a running job's lease is extended, which is also how soon a cancel is noticed
+_HEARTBEAT_INTERVAL = min(JOB_VISIBILITY_TIMEOUT / 3, 10)
+
+
+def build_queue():
+    """The queue API client when JOB_QUEUE_URL is set, else the local SQLite queue."""
+    return RemoteJobQueue(JOB_QUEUE_URL) if JOB_QUEUE_URL else JobQueue()
+
+
+def build_bot(concurrency: int = JOB_WORKER_CONCURRENCY) -> Bot:
+    """Bot for uploads, with enough pooled connections for concurrent jobs."""
+    kwargs = {}
+    if TELEGRAM_API_BASE_URL:
+        kwargs = {'base_url': f"{TELEGRAM_API_BASE_URL}/bot", 'base_file_url': f"{TELEGRAM_API_BASE_URL}/file/bot"}
+    return Bot(BOT_TOKEN, request=HTTPXRequest(connection_pool_size=concurrency * 2 + 2), **kwargs)
+
+
+def rss_mb(pid: int) -> float | None:
+    """Resident memory of a process in MB (Linux /proc), or None."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+class DownloadWorker:
+    """Claim jobs from a queue and run them, several at a time."""
+
+    def __init__(self, queue, bot, run_job, concurrency: int = JOB_WORKER_CONCURRENCY,
+                 name: str | None = None, poll_interval: float = 1.0,
+                 max_jobs: int = WORKER_MAX_JOBS, job_deadline: float = JOB_DEADLINE):
+        self.queue = queue
+        self.bot = bot
+        self.run_job = run_job
+        self.concurrency = concurrency
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.max_jobs = max_jobs
+        self.job_deadline = job_deadline
+        self.stats = {"claimed": 0, "completed": 0, "failed": 0, "lost": 0, "deadline": 0}
+        # Why this worker stopped claiming before being asked to, if it did
+        self.recycle_reason = None
+
+    def _recycle(self, reason: str):
+        if not self.recycle_reason:
+            self.recycle_reason = reason
+            logger.info(f"Worker {self.name} recycling ({reason}); finishing running jobs")
+
+    async def run(self, stop: asyncio.Event) -> str | None:
+        """
+        Claim and run jobs until `stop` is set or the worker wants recycling,
+        then let running jobs finish.
+
+        Returns:
+            str: The recycle reason ('max_jobs' or 'deadline'), or None if stopped
+        """
+        slots = asyncio.Semaphore(self.concurrency)
+        running = set()
+        logger.info(f"Worker {self.name} started ({self.concurrency} concurrent jobs)")
+        while not stop.is_set() and not self.recycle_reason:
+            await slots.acquire()
+            if self.recycle_reason:
+                slots.release()
+                break
+            try:
+                job = await asyncio.to_thread(self.queue.claim, self.name)
+            except Exception as e:
+                logger.error(f"Claiming a job failed: {e}")
+                job = None
+            if not job:
+                slots.release()
+                try:
+                    await asyncio.wait_for(stop.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.stats["claimed"] += 1
+            if self.max_jobs and self.stats["claimed"] >= self.max_jobs:
+                self._recycle('max_jobs')
+            task = asyncio.create_task(self._process(job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+        if running:
+            logger.info(f"Waiting for {len(running)} running job(s) before exiting")
+            await asyncio.gather(*running, return_exceptions=True)
+        logger.info(f"Worker {self.name} stopped: {self.stats}")
+        return self.recycle_reason
+
+    async def _heartbeat(self, job: dict, task: asyncio.Task):
+        """Keep the job invisible to other workers while it runs; cancel `task` once the lease is lost."""
+        while True:
+            await asyncio.sleep(_HEARTBEAT_INTERVAL)
+            try:
+                if not await asyncio.to_thread(self.queue.extend, job['id'], job['lease']):
+                    self.stats["lost"] += 1
+                    logger.warning(f"Lost the lease on job {job['id']} (cancelled or taken over); stopping it")
+                    task.cancel()
+                    return
+            except Exception as e:
+                logger.warning(f"Extending job {job['id']} failed: {e}")
+
+    async def _fail(self, job: dict, error: str, retry: bool = True):
+        self.stats["failed"] += 1
+        try:
+            await asyncio.to_thread(self.queue.fail, job['id'], job['lease'], error, retry)
+        except Exception as report_error:
+            # The job becomes visible again once its timeout expires
+            logger.error(f"Reporting failure of job {job['id']} failed: {report_error}")
+
+    async def _process(self, job: dict):
+        logger.info(f"Running {job['kind']} job {job['id']} (attempt {job['attempts']})")
+        run = asyncio.create_task(self.run_job(self.bot, job['kind'], job['payload']))
+        heartbeat = asyncio.create_task(self._heartbeat(job, run))
+        try:
+            result = await asyncio.wait_for(run, self.job_deadline or None)
+        except asyncio.CancelledError:
+            heartbeat.cancel()
+            if not heartbeat.done() or heartbeat.cancelled():
+                # The worker itself is being cancelled
+                run.cancel()
+                raise
+            logger.info(f"Job {job['id']} stopped after losing its lease")
+            return
+        except asyncio.TimeoutError:
+            heartbeat.cancel()
+            self.stats["deadline"] += 1
+            logger.error(f"Job {job['id']} overran its {self.job_deadline}s deadline; cancelled")
+            # A job that hung once would most likely hang again
+            await self._fail(job, "deadline_exceeded", retry=False)
+            # Cancelling does not stop yt-dlp threads the job started; a new process does
+            self._recycle('deadline')
+            return
+        except Exception as e:
+            heartbeat.cancel()
+            logger.error(f"Job {job['id']} raised: {e}")
+            # Permanent errors (e.g. the user blocked the bot) would fail the same way again
+            await self._fail(job, str(e) or type(e).__name__, retry=is_retryable(e))
+            return
+        heartbeat.cancel()
+        try:
+            if await asyncio.to_thread(self.queue.complete, job['id'], job['lease'], result):
+                self.stats["completed"] += 1
+                logger.info(f"Job {job['id']} done: {result['result']}")
+            else:
+                self.stats["lost"] += 1
+                logger.warning(f"Job {job['id']} finished after its lease was lost")
+        except Exception as e:
+            logger.error(f"Reporting result of job {job['id']} failed: {e}")
+
+
+async def _keepalive(alive):
+    """Tell the supervisor this process's event loop is still turning."""
+    while True:
+        alive.value = time.time()
+        await asyncio.sleep(1)
+
+
+async def _serve(alive=None) -> str | None:
+    # Builds this process's VideoDownloader and pools
+    from bot_handlers import run_job, downloader
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    keepalive = asyncio.create_task(_keepalive(alive)) if alive is not None else None
+    queue = build_queue()
+    bot = build_bot()
+    await bot.initialize()
+    try:
+        return await DownloadWorker(queue, bot, run_job).run(stop)
+    finally:
+        await bot.shutdown()
+        downloader.shutdown(wait=False)
+        queue.close()
+        if keepalive:
+            keepalive.cancel()
+
+
+def worker_main(alive=None):
+    """
+    Entry point of one worker process.
+
+    Args:
+        alive: Shared double the worker keeps set to the current time
+            (multiprocessing.Value), watched by the supervisor
+    """
+    asyncio.run(_serve(alive))
+    # Leftover job threads must not keep a recycled process around
+    os._exit(0)
+
+
+class WorkerSupervisor:
+    """Keep `processes` worker processes running, recycling and restarting them."""
+
+    def __init__(self, processes: int = JOB_WORKER_PROCESSES, target=worker_main,
+                 max_rss_mb: int = WORKER_MAX_RSS_MB, hang_timeout: float = WORKER_HANG_TIMEOUT,
+                 stop_timeout: float = WORKER_STOP_TIMEOUT, max_backoff: float = WORKER_RESTART_BACKOFF,
+                 check_interval: float = 1.0):
+        self.processes = max(1, processes)
+        self.target = target
+        self.max_rss_mb = max_rss_mb
+        self.hang_timeout = hang_timeout
+        self.stop_timeout = stop_timeout
+        self.max_backoff = max_backoff
+        self.check_interval = check_interval
+        # Spawned children build their own downloader instead of inheriting threads and sockets
+        self._context = multiprocessing.get_context('spawn')
+        self._slots = [{"process": None, "alive": None, "started": 0.0, "stopping_since": None,
+                        "restart_at": 0.0, "backoff": 0.0} for _ in range(self.processes)]
+        self._generation = 0
+        self._stopping = False
+        self.stats = {"started": 0, "recycled": 0, "crashed": 0, "killed": 0}
+
+    def _start(self, index: int):
+        slot = self._slots[index]
+        self._generation += 1
+        alive = self._context.Value('d', time.time(), lock=False)
+        process = self._context.Process(target=self.target, args=(alive,),
+                                        name=f"download-worker-{index}.{self._generation}")
+        process.start()
+        slot.update(process=process, alive=alive, started=time.time(), stopping_since=None)
+        self.stats["started"] += 1
+        logger.info(f"Started {process.name} (pid {process.pid})")
+
+    def _stop(self, slot: dict, reason: str):
+        """Ask a worker to finish its running jobs and exit."""
+        if slot["stopping_since"] is None:
+            slot["stopping_since"] = time.time()
+            logger.info(f"Stopping {slot['process'].name}: {reason}")
+            try:
+                os.kill(slot["process"].pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def _kill(self, slot: dict, reason: str):
+        logger.error(f"Killing {slot['process'].name}: {reason}")
+        self.stats["killed"] += 1
+        slot["process"].kill()
+        slot["process"].join(5)
+
+    def _reap(self, slot: dict):
+        """Account for a worker that exited and schedule its replacement."""
+        process = slot["process"]
+        process.join()
+        ran = time.time() - slot["started"]
+        if process.exitcode == 0 or slot["stopping_since"] is not None:
+            self.stats["recycled"] += 1
+            logger.info(f"{process.name} exited after {ran:.0f}s")
+            slot["backoff"] = 0.0
+        else:
+            self.stats["crashed"] += 1
+            # Back off only when a worker crashes soon after starting, e.g. on a bad config
+            slot["backoff"] = (0.0 if ran >= _STABLE_SECONDS
+                               else min(self.max_backoff, max(1.0, slot["backoff"] * 2)))
+            logger.error(f"{process.name} crashed with exit code {process.exitcode} after {ran:.0f}s; "
+                         f"restarting in {slot['backoff']:.0f}s")
+        slot["restart_at"] = time.time() + slot["backoff"]
+        slot["process"] = None
+        process.close()
+
+    def _check(self, slot: dict):
+        process = slot["process"]
+        now = time.time()
+        if slot["stopping_since"] is not None:
+            if now - slot["stopping_since"] > self.stop_timeout:
+                self._kill(slot, f"still running {self.stop_timeout}s after being asked to stop")
+            return
+        if now - slot["alive"].value > self.hang_timeout:
+            self._kill(slot, f"event loop unresponsive for {now - slot['alive'].value:.0f}s")
+            return
+        rss = rss_mb(process.pid)
+        if self.max_rss_mb and rss and rss > self.max_rss_mb:
+            self._stop(slot, f"RSS {rss:.0f} MB over {self.max_rss_mb} MB")
+
+    def run(self):
+        """Supervise workers until SIGINT/SIGTERM, then stop them all."""
+        def shutdown(signum, frame):
+            self._stopping = True
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+        logger.info(f"Supervising {self.processes} worker process(es)")
+
+        while True:
+            for index, slot in enumerate(self._slots):
+                process = slot["process"]
+                if process is not None and not process.is_alive():
+                    self._reap(slot)
+                    process = None
+                if process is None:
+                    if not self._stopping and time.time() >= slot["restart_at"]:
+                        self._start(index)
+                elif self._stopping:
+                    self._stop(slot, "shutting down")
+                    self._check(slot)
+                else:
+                    self._check(slot)
+
+            if self._stopping and all(slot["process"] is None for slot in self._slots):
+                break
+            time.sleep(self.check_interval)
+        logger.info(f"Supervisor stopped: {self.stats}")
+
+
+def main(processes: int = JOB_WORKER_PROCESSES):
+    WorkerSupervisor(processes).run()
+
+
+if __name__ == '__main__':
+    if not BOT_TOKEN:
+        print("Error: TELEGRAM_BOT_TOKEN environment variable is not set.")
+        sys.exit(1)
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else JOB_WORKER_PROCESSES)
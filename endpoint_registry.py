@@ -0,0 +1,180 @@
+"""
+Health-scored registry for third-party resolver endpoints.
+
+Each endpoint keeps a rolling window of call outcomes (success rate, p50/p95
+latency) and a circuit breaker. After repeated consecutive failures the
+circuit opens and the endpoint is skipped by callers; a background thread
+probes it again once the cooldown has passed and closes the circuit when the
+probe succeeds.
+"""
+
+import threading
+import time
+import logging
+from collections import deque
+from config import (ENDPOINT_WINDOW_SIZE, CIRCUIT_FAILURE_THRESHOLD,
+                    CIRCUIT_COOLDOWN, ENDPOINT_PROBE_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _percentile(values: list[float], pct: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class _Endpoint:
+    """Rolling outcome window and circuit state for one endpoint."""
+
+    FAILURE_PENALTY = 5.0  # seconds charged per unit of failure rate
+
+    def __init__(self, name: str, group: str, probe, window_size: int,
+                 failure_penalty: float = FAILURE_PENALTY):
+        self.name = name
+        self.group = group
+        self.probe = probe
+        self.window = deque(maxlen=window_size)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.failure_penalty = failure_penalty
+
+    def success_rate(self) -> float:
+        if not self.window:
+            return 1.0
+        return sum(1 for ok, _ in self.window if ok) / len(self.window)
+
+    def latencies(self) -> list[float]:
+        return [latency for _, latency in self.window]
+
+    def score(self) -> float:
+        """Lower is better: median latency plus a penalty for the failure rate."""
+        p50 = _percentile(self.latencies(), 50) or 0.0
+        return p50 + (1.0 - self.success_rate()) * self.failure_penalty
+
+
+class EndpointRegistry:
+    """Track endpoint health and gate traffic with per-endpoint circuit breakers."""
+
+    def __init__(self, window_size: int = ENDPOINT_WINDOW_SIZE,
+                 failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 cooldown: float = CIRCUIT_COOLDOWN,
+                 probe_interval: float = ENDPOINT_PROBE_INTERVAL,
+                 failure_penalty: float = _Endpoint.FAILURE_PENALTY):
+        self.window_size = window_size
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        # Seconds of score a 100% failure rate costs; higher where a failure wastes more time
+        self.failure_penalty = failure_penalty
+        self._endpoints: dict[str, _Endpoint] = {}
+        self._lock = threading.Lock()
+        self._prober = None
+        self._stop = threading.Event()
+
+    def register(self, group: str, name: str, probe=None):
+        """
+        Add an endpoint to a group.
+
+        Args:
+            group (str): Resolver family, e.g. 'tiktok'
+            name (str): Endpoint identifier, usually its URL
+            probe: Optional zero-argument callable returning True when the
+                endpoint is reachable; used to close an open circuit
+        """
+        with self._lock:
+            if name not in self._endpoints:
+                self._endpoints[name] = _Endpoint(name, group, probe, self.window_size, self.failure_penalty)
+        self._ensure_prober()
+
+    def record(self, name: str, ok: bool, latency: float):
+        """Record the outcome of a real call to an endpoint."""
+        with self._lock:
+            endpoint = self._endpoints.get(name)
+            if not endpoint:
+                return
+            endpoint.window.append((ok, latency))
+            if ok:
+                endpoint.consecutive_failures = 0
+                if endpoint.state != CLOSED:
+                    logger.info(f"Circuit for {name} closed")
+                endpoint.state = CLOSED
+            else:
+                endpoint.consecutive_failures += 1
+                if endpoint.state == CLOSED and endpoint.consecutive_failures >= self.failure_threshold:
+                    endpoint.state = OPEN
+                    endpoint.opened_at = time.monotonic()
+                    logger.warning(f"Circuit for {name} opened after {endpoint.consecutive_failures} failures")
+
+    def healthy(self, group: str) -> list[str]:
+        """Endpoints of a group whose circuit is closed, best score first."""
+        with self._lock:
+            candidates = [e for e in self._endpoints.values() if e.group == group and e.state == CLOSED]
+            # Stable sort keeps registration order for endpoints with equal scores
+            return [e.name for e in sorted(candidates, key=lambda e: e.score())]
+
+    def scores(self, group: str | None = None) -> dict[str, dict]:
+        """Snapshot of every endpoint's health for logging/monitoring."""
+        with self._lock:
+            snapshot = {}
+            for e in self._endpoints.values():
+                if group and e.group != group:
+                    continue
+                latencies = e.latencies()
+                snapshot[e.name] = {
+                    "group": e.group,
+                    "state": e.state,
+                    "calls": len(e.window),
+                    "success_rate": round(e.success_rate(), 3),
+                    "p50": _percentile(latencies, 50),
+                    "p95": _percentile(latencies, 95),
+                    "score": round(e.score(), 3),
+                }
+            return snapshot
+
+    def _ensure_prober(self):
+        if self._prober and self._prober.is_alive():
+            return
+        self._prober = threading.Thread(target=self._probe_loop, name="endpoint-prober", daemon=True)
+        self._prober.start()
+
+    def _probe_loop(self):
+        """Re-test open circuits once their cooldown has passed."""
+        while not self._stop.wait(self.probe_interval):
+            now = time.monotonic()
+            with self._lock:
+                due = [e for e in self._endpoints.values()
+                       if e.state == OPEN and now - e.opened_at >= self.cooldown]
+                for e in due:
+                    e.state = HALF_OPEN
+
+            for e in due:
+                start = time.monotonic()
+                try:
+                    ok = bool(e.probe()) if e.probe else True
+                except Exception as probe_error:
+                    logger.debug(f"Probe for {e.name} failed: {probe_error}")
+                    ok = False
+                with self._lock:
+                    if ok:
+                        e.state = CLOSED
+                        e.consecutive_failures = 0
+                        logger.info(f"Probe succeeded, circuit for {e.name} closed")
+                    else:
+                        e.state = OPEN
+                        e.opened_at = time.monotonic()
+                        e.window.append((False, time.monotonic() - start))
+
+    def stop(self):
+        self._stop.set()
+
+
+# Shared registry used by every resolver
+registry = EndpointRegistry()
@@ -0,0 +1,177 @@
+"""
+Asyncio runner for ffmpeg jobs.
+
+Every ffmpeg invocation goes through one shared runner, which
+- limits how many encodes run at once (TRANSCODE_WORKERS, derived from the
+  CPU count) so a burst of oversized files cannot oversubscribe the box,
+- parses `-progress` output for frame count, fps and speed, and keeps only
+  the tail of stderr instead of buffering all of it,
+- kills ffmpeg when the awaiting task is cancelled or the timeout expires.
+"""
+
+import asyncio
+import os
+import time
+import logging
+from collections import deque
+from config import TRANSCODE_WORKERS, COMPRESS_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def _cpu_seconds(pid: int) -> float | None:
+    """User+system CPU time of a running process (Linux /proc), or None."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Fields after the parenthesised command name; utime/stime are 14/15
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _parse_speed(value: str) -> float | None:
+    try:
+        return float(value.rstrip('x'))
+    except ValueError:
+        return None
+
+
+class FFmpegRunner:
+    """Run ffmpeg commands with a concurrency limit, progress and cancellation."""
+
+    def __init__(self, max_concurrent: int = TRANSCODE_WORKERS, timeout: float = COMPRESS_TIMEOUT,
+                 binary: str = 'ffmpeg', stderr_lines: int = 40):
+        self.max_concurrent = max(1, max_concurrent)
+        self.timeout = timeout
+        self.binary = binary
+        self.stderr_lines = stderr_lines
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.stats = {"runs": 0, "failures": 0, "timeouts": 0, "cancelled": 0,
+                      "active": 0, "queued": 0, "frames": 0,
+                      "media_seconds": 0.0, "wall_seconds": 0.0, "cpu_seconds": 0.0}
+
+    async def run(self, args: list[str], timeout: float | None = None, on_progress=None) -> dict:
+        """
+        Run `ffmpeg <args>` once a slot is free.
+
+        Args:
+            args (list): ffmpeg arguments, without the binary itself
+            timeout (float): Seconds allowed once the job has started
+            on_progress: Optional callable receiving each progress snapshot
+                ({'frame', 'fps', 'speed', 'out_time'})
+
+        Returns:
+            dict: 'ok', 'returncode', 'elapsed', 'cpu_seconds', 'frames',
+            'fps', 'speed', 'out_time' and 'stderr' (last lines only)
+
+        Raises:
+            TimeoutError: ffmpeg ran longer than the timeout (it is killed)
+            asyncio.CancelledError: the caller was cancelled (ffmpeg is killed)
+        """
+        self.stats["queued"] += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.stats["queued"] -= 1
+
+        self.stats["active"] += 1
+        try:
+            return await self._run(args, timeout or self.timeout, on_progress)
+        finally:
+            self.stats["active"] -= 1
+            self._semaphore.release()
+
+    async def _run(self, args: list[str], timeout: float, on_progress) -> dict:
+        cmd = [self.binary, '-hide_banner', '-nostats', '-progress', 'pipe:1', *args]
+        logger.info(f"Running: {' '.join(cmd)}")
+        started = time.monotonic()
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        result = {"ok": False, "returncode": None, "elapsed": 0.0, "cpu_seconds": 0.0,
+                  "frames": 0, "fps": None, "speed": None, "out_time": 0.0, "stderr": ""}
+        stderr_tail = deque(maxlen=self.stderr_lines)
+
+        async def read_progress():
+            block = {}
+            async for raw in proc.stdout:
+                key, _, value = raw.decode(errors='replace').strip().partition('=')
+                if key != 'progress':
+                    block[key] = value
+                    continue
+                if block.get('frame', '').isdigit():
+                    result["frames"] = int(block['frame'])
+                if block.get('out_time_us', '').isdigit():
+                    result["out_time"] = int(block['out_time_us']) / 1_000_000
+                result["fps"] = _parse_speed(block.get('fps', '')) or result["fps"]
+                result["speed"] = _parse_speed(block.get('speed', '')) or result["speed"]
+                # /proc disappears once the process is reaped, so sample while it runs
+                result["cpu_seconds"] = _cpu_seconds(proc.pid) or result["cpu_seconds"]
+                if on_progress:
+                    on_progress({"frame": result["frames"], "fps": result["fps"],
+                                 "speed": result["speed"], "out_time": result["out_time"]})
+                block = {}
+
+        async def read_stderr():
+            async for raw in proc.stderr:
+                stderr_tail.append(raw.decode(errors='replace').rstrip())
+
+        async def communicate():
+            await asyncio.gather(read_progress(), read_stderr())
+            await proc.wait()
+
+        try:
+            await asyncio.wait_for(communicate(), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            await self._kill(proc)
+            if isinstance(e, asyncio.CancelledError):
+                self.stats["cancelled"] += 1
+                logger.warning(f"ffmpeg cancelled after {time.monotonic() - started:.1f}s")
+                raise
+            self.stats["timeouts"] += 1
+            logger.error(f"ffmpeg timed out after {timeout}s")
+            raise TimeoutError(f"ffmpeg exceeded {timeout}s") from None
+
+        result["returncode"] = proc.returncode
+        result["ok"] = proc.returncode == 0
+        result["elapsed"] = time.monotonic() - started
+        result["stderr"] = "\n".join(stderr_tail)
+
+        self.stats["runs"] += 1
+        self.stats["frames"] += result["frames"]
+        self.stats["media_seconds"] += result["out_time"]
+        self.stats["wall_seconds"] += result["elapsed"]
+        self.stats["cpu_seconds"] += result["cpu_seconds"]
+        if not result["ok"]:
+            self.stats["failures"] += 1
+            logger.error(f"ffmpeg failed ({proc.returncode}): {result['stderr'][-2000:]}")
+        else:
+            logger.info(f"ffmpeg finished in {result['elapsed']:.1f}s: {result['frames']} frames, "
+                        f"{result['fps'] or 0:.0f} fps, {result['speed'] or 0:.2f}x")
+        return result
+
+    async def _kill(self, proc):
+        # The output of an abandoned encode is discarded, so there is nothing to flush
+        if proc.returncode is not None:
+            return
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+
+    def metrics(self) -> dict:
+        """Counters plus overall throughput (fps and speed factor across all runs)."""
+        snapshot = dict(self.stats)
+        wall = snapshot["wall_seconds"]
+        snapshot["avg_fps"] = round(snapshot["frames"] / wall, 1) if wall else None
+        snapshot["avg_speed"] = round(snapshot["media_seconds"] / wall, 2) if wall else None
+        return snapshot
+
+
+# Shared runner, so the concurrency limit covers every ffmpeg job in the process
+runner = FFmpegRunner()
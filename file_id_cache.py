@@ -0,0 +1,122 @@
+"""
+Persistent cache of Telegram file_ids for media that was already uploaded.
+
+Telegram lets a bot re-send any file it has uploaded before by passing the
+returned file_id instead of the file itself, so a cache hit costs no download
+and no upload. Entries are keyed by media key plus format ('video'/'audio'),
+expire after a TTL and are evicted least-recently-used first.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import logging
+from config import FILE_ID_CACHE_PATH, FILE_ID_CACHE_TTL, FILE_ID_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache:
+    """SQLite-backed file_id cache with TTL and LRU eviction."""
+
+    def __init__(self, path: str = FILE_ID_CACHE_PATH, ttl: float = FILE_ID_CACHE_TTL,
+                 max_entries: int = FILE_ID_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_ids (
+                media_key  TEXT NOT NULL,
+                format     TEXT NOT NULL,
+                file_id    TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used  REAL NOT NULL,
+                PRIMARY KEY (media_key, format)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_file_ids_last_used ON file_ids (last_used)")
+        self._conn.commit()
+
+    def get(self, media_key: str, format_type: str) -> str | None:
+        """Return the cached file_id for a media key, or None on miss/expiry."""
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT file_id, created_at FROM file_ids WHERE media_key = ? AND format = ?",
+                    (media_key, format_type),
+                ).fetchone()
+                if not row:
+                    return None
+
+                file_id, created_at = row
+                if now - created_at > self.ttl:
+                    self._conn.execute(
+                        "DELETE FROM file_ids WHERE media_key = ? AND format = ?",
+                        (media_key, format_type),
+                    )
+                    self._conn.commit()
+                    return None
+
+                self._conn.execute(
+                    "UPDATE file_ids SET last_used = ? WHERE media_key = ? AND format = ?",
+                    (now, media_key, format_type),
+                )
+                self._conn.commit()
+                return file_id
+        except sqlite3.Error as e:
+            logger.error(f"file_id cache lookup failed: {e}")
+            return None
+
+    def put(self, media_key: str, format_type: str, file_id: str):
+        """Store the file_id Telegram returned for an upload."""
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO file_ids (media_key, format, file_id, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (media_key, format_type, file_id, now, now),
+                )
+                self._evict(now)
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"file_id cache store failed: {e}")
+
+    def invalidate(self, media_key: str, format_type: str):
+        """Drop an entry, e.g. when Telegram rejects a stale file_id."""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "DELETE FROM file_ids WHERE media_key = ? AND format = ?",
+                    (media_key, format_type),
+                )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"file_id cache invalidate failed: {e}")
+
+    def _evict(self, now: float):
+        """Drop expired entries, then the least recently used ones over the cap."""
+        self._conn.execute("DELETE FROM file_ids WHERE created_at < ?", (now - self.ttl,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM file_ids").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM file_ids WHERE rowid IN "
+                "(SELECT rowid FROM file_ids ORDER BY last_used ASC LIMIT ?)",
+                (overflow,),
+            )
+            logger.info(f"Evicted {overflow} least recently used file_id cache entries")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
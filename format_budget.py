@@ -0,0 +1,95 @@
+"""
+Pick yt-dlp formats that fit the Telegram upload limit.
+
+Format strings like `best[filesize<45M]` only work when the extractor reports
+an exact filesize, which most sites do not. Here every format gets a size
+estimate (filesize, else filesize_approx, else tbr x duration) and the best
+format or video+audio pair whose estimate fits under the limit is chosen
+before anything is downloaded.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(fmt: dict, duration: float | None) -> float | None:
+    """Estimated bytes for a format, or None if nothing is known about its size."""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return float(size)
+    tbr = fmt.get('tbr') or ((fmt.get('vbr') or 0) + (fmt.get('abr') or 0))
+    if tbr and duration:
+        return tbr * 1000 / 8 * duration
+    return None
+
+
+def _has(fmt: dict, kind: str) -> bool:
+    codec = fmt.get(f'{kind}codec')
+    return bool(codec) and codec != 'none'
+
+
+def select_format_within(info: dict, limit: int, audio_only: bool = False,
+                         max_height: int = 1080, audio_kbps: int | None = None) -> str | None:
+    """
+    Choose the best format spec whose estimated size is under `limit`.
+
+    Args:
+        info (dict): Extracted yt-dlp info dict
+        limit (int): Maximum bytes
+        audio_only (bool): Pick an audio-only format
+        max_height (int): Ignore video taller than this
+        audio_kbps (int): Bitrate audio is re-encoded to afterwards; audio
+            formats are then sized at it instead of at their own bitrate
+
+    Returns:
+        str: A spec such as '137+140' or '18'. If nothing fits, the smallest
+        estimated candidate is returned so the later shrink step has the least
+        to do. None when no format has a usable size estimate; the profile's
+        default format string is then kept.
+    """
+    formats = [f for f in info.get('formats') or [] if f.get('format_id')]
+    duration = info.get('duration')
+    if not formats:
+        return None
+
+    audio = [f for f in formats if _has(f, 'a') and not _has(f, 'v')]
+    candidates = []  # (spec, estimated size, height, prefers H.264/AAC, total bitrate)
+
+    if audio_only:
+        for f in audio:
+            size = audio_kbps * 1000 / 8 * duration if audio_kbps and duration else estimate_size(f, duration)
+            if size:
+                candidates.append((f['format_id'], size, 0, f.get('acodec', '').startswith('mp4a'),
+                                   f.get('abr') or f.get('tbr') or 0))
+    else:
+        sized_audio = [(f, estimate_size(f, duration)) for f in audio]
+        sized_audio = [(f, s) for f, s in sized_audio if s]
+        for f in formats:
+            height = f.get('height') or 0
+            if not _has(f, 'v') or height > max_height:
+                continue
+            size = estimate_size(f, duration)
+            if not size:
+                continue
+            h264 = (f.get('vcodec') or '').startswith(('avc1', 'h264'))
+            if _has(f, 'a'):
+                candidates.append((f['format_id'], size, height, h264, f.get('tbr') or 0))
+                continue
+            for a, audio_size in sized_audio:
+                # AAC next to H.264 keeps the result stream-copyable into MP4
+                compatible = h264 and (a.get('acodec') or '').startswith('mp4a')
+                candidates.append((f"{f['format_id']}+{a['format_id']}", size + audio_size, height,
+                                   compatible, (f.get('tbr') or 0) + (a.get('tbr') or a.get('abr') or 0)))
+
+    if not candidates:
+        return None
+
+    fitting = [c for c in candidates if c[1] <= limit]
+    if fitting:
+        spec, size = max(fitting, key=lambda c: (c[2], c[3], c[4]))[:2]
+        logger.info(f"Selected format {spec} (~{size / 1048576:.1f}MB) under {limit / 1048576:.0f}MB limit")
+    else:
+        spec, size = min(candidates, key=lambda c: c[1])[:2]
+        logger.info(f"No format fits {limit / 1048576:.0f}MB; smallest is {spec} (~{size / 1048576:.1f}MB)")
+    return spec
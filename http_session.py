@@ -0,0 +1,33 @@
+"""
+Pooled HTTP session shared by all direct (non yt-dlp) fetches.
+
+A bare requests.get opens a new TCP+TLS connection every time. A Session with
+a tuned HTTPAdapter keeps connections alive per host, so repeated API and CDN
+hits reuse them.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from config import HTTP_POOL_HOSTS, HTTP_POOL_PER_HOST
+
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+
+def build_session(pool_hosts: int = HTTP_POOL_HOSTS, per_host: int = HTTP_POOL_PER_HOST) -> requests.Session:
+    """
+    Create a keep-alive session with bounded per-host connection pools.
+
+    Args:
+        pool_hosts (int): Number of per-host pools to keep
+        per_host (int): Maximum open connections per host; extra requests wait
+            for a free connection instead of opening new ones
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=per_host, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        'User-Agent': DEFAULT_USER_AGENT,
+        'Connection': 'keep-alive',
+    })
+    return session
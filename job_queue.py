@@ -0,0 +1,297 @@
+"""
+Durable job queue between the bot front end and download workers.
+
+The front end enqueues one job per download and waits for its result; worker
+processes (download_worker.py) claim jobs, run them and report back. Jobs
+live in SQLite, so they survive restarts of either side:
+
+- A claimed job is hidden for a visibility timeout. The worker extends it
+  while the job runs; if the worker dies, the job becomes visible again and
+  another worker picks it up (at-least-once delivery).
+- Every claim gets a fresh lease token. A worker whose lease was taken over
+  can no longer complete or fail the job.
+- A job is marked failed after JOB_MAX_ATTEMPTS deliveries.
+- A job the front end stopped waiting for is cancelled: it is no longer
+  claimed, and its lease is void, so the worker running it stops.
+- Identical active jobs (same dedup key) are only queued once.
+
+Workers on the same node open the SQLite file directly. Workers on other
+nodes use RemoteJobQueue against the front end's queue API
+(job_queue_api.py), which has the same claim/extend/complete/fail methods.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+import requests
+from retry_policy import RetryPolicy
+from config import (BOT_TOKEN, JOB_QUEUE_PATH, JOB_QUEUE_TOKEN, JOB_VISIBILITY_TIMEOUT,
+                    JOB_MAX_ATTEMPTS, JOB_RESULT_TTL)
+
+logger = logging.getLogger(__name__)
+
+# Delay before a failed job is handed out again, growing with its attempts
+_REDELIVERY = RetryPolicy(base_delay=5, max_delay=120)
+
+
+def queue_token() -> str:
+    """Shared secret for the queue API, identical on the front end and every worker."""
+    return JOB_QUEUE_TOKEN or hashlib.sha256(f"jobs:{BOT_TOKEN or ''}".encode()).hexdigest()
+
+
+class JobQueue:
+    """SQLite-backed queue with visibility timeouts, leases and bounded attempts."""
+
+    def __init__(self, path: str = JOB_QUEUE_PATH, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, result_ttl: float = JOB_RESULT_TTL):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Autocommit; claims take an explicit write lock so several processes can share the file
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind       TEXT NOT NULL,
+                payload    TEXT NOT NULL,
+                dedup_key  TEXT,
+                status     TEXT NOT NULL,
+                attempts   INTEGER NOT NULL DEFAULT 0,
+                visible_at REAL NOT NULL,
+                lease      TEXT,
+                worker     TEXT,
+                result     TEXT,
+                error      TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_visible ON jobs (status, visible_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs (dedup_key, status)")
+
+    def enqueue(self, kind: str, payload: dict, dedup_key: str | None = None) -> tuple[int, bool]:
+        """
+        Add a job unless an identical one is still queued or running.
+
+        Args:
+            kind (str): Job type the worker dispatches on, e.g. 'video'
+            payload (dict): JSON-serializable job arguments
+            dedup_key (str): Jobs with the same key share one execution
+
+        Returns:
+            tuple: (job_id, created); `created` is False if an active job
+            with the same dedup key was returned instead
+        """
+        now = time.time()
+        if now - self._last_purge > 3600:
+            self._last_purge = now
+            self.purge()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if dedup_key:
+                    row = self._conn.execute(
+                        "SELECT id FROM jobs WHERE dedup_key = ? AND status IN ('queued', 'running') "
+                        "ORDER BY id LIMIT 1", (dedup_key,),
+                    ).fetchone()
+                    if row:
+                        self._conn.execute("COMMIT")
+                        logger.info(f"Joining active job {row[0]} for {dedup_key}")
+                        return row[0], False
+                cursor = self._conn.execute(
+                    "INSERT INTO jobs (kind, payload, dedup_key, status, visible_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                    (kind, json.dumps(payload), dedup_key, now, now, now),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        logger.info(f"Enqueued {kind} job {cursor.lastrowid}")
+        return cursor.lastrowid, True
+
+    def claim(self, worker: str) -> dict | None:
+        """
+        Take the oldest visible job: queued, or running with an expired lease.
+
+        Returns:
+            dict: {'id', 'kind', 'payload', 'lease', 'attempts'}, or None if
+            nothing is ready
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose last delivery expired and that have no attempts left
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'visibility_timeout', lease = NULL, updated_at = ? "
+                    "WHERE status = 'running' AND visible_at <= ? AND attempts >= ?",
+                    (now, now, self.max_attempts),
+                )
+                row = self._conn.execute(
+                    "SELECT id, kind, payload, attempts, status FROM jobs "
+                    "WHERE status IN ('queued', 'running') AND visible_at <= ? ORDER BY id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if not row:
+                    self._conn.execute("COMMIT")
+                    return None
+                job_id, kind, payload, attempts, status = row
+                lease = uuid.uuid4().hex
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease = ?, worker = ?, "
+                    "visible_at = ?, updated_at = ? WHERE id = ?",
+                    (lease, worker, now + self.visibility_timeout, now, job_id),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if status == 'running':
+            logger.warning(f"Job {job_id} timed out on its previous worker; redelivering (attempt {attempts + 1})")
+        return {"id": job_id, "kind": kind, "payload": json.loads(payload),
+                "lease": lease, "attempts": attempts + 1}
+
+    def _update_leased(self, job_id: int, lease: str, sql: str, params: tuple) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET {sql}, updated_at = ? WHERE id = ? AND lease = ? AND status = 'running'",
+                (*params, time.time(), job_id, lease),
+            )
+        return cursor.rowcount == 1
+
+    def extend(self, job_id: int, lease: str) -> bool:
+        """Push the job's visibility timeout out again; False if the lease was lost."""
+        return self._update_leased(job_id, lease, "visible_at = ?",
+                                   (time.time() + self.visibility_timeout,))
+
+    def complete(self, job_id: int, lease: str, result: dict) -> bool:
+        """Store the result of a job; False if the lease was lost."""
+        return self._update_leased(job_id, lease, "status = 'done', result = ?, lease = NULL",
+                                   (json.dumps(result),))
+
+    def fail(self, job_id: int, lease: str, error: str, retry: bool = True) -> bool:
+        """
+        Give a job back after an error: it is retried with a delay, or marked
+        failed once it has used all attempts or the error is permanent
+        (`retry` False). False if the lease was lost.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not retry or (row and row[0] >= self.max_attempts):
+            return self._update_leased(job_id, lease, "status = 'failed', error = ?, lease = NULL", (error,))
+        return self._update_leased(job_id, lease, "status = 'queued', error = ?, lease = NULL, visible_at = ?",
+                                   (error, time.time() + _REDELIVERY.backoff(row[0] if row else 1)))
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        Cancel a queued or running job. Workers no longer claim it, and the
+        one running it loses its lease and stops.
+
+        Returns:
+            bool: False if the job had already finished
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', error = 'cancelled', lease = NULL, updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id),
+            )
+        if cursor.rowcount:
+            logger.info(f"Cancelled job {job_id}")
+        return cursor.rowcount == 1
+
+    def get(self, job_id: int) -> dict | None:
+        """A job's {'status', 'attempts', 'payload', 'result', 'error'}, or None if unknown."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, attempts, payload, result, error FROM jobs WHERE id = ?", (job_id,),
+            ).fetchone()
+        if not row:
+            return None
+        status, attempts, payload, result, error = row
+        return {"status": status, "attempts": attempts, "payload": json.loads(payload),
+                "result": json.loads(result) if result else None, "error": error}
+
+    async def wait(self, job_id: int, timeout: float, poll_interval: float = 0.5) -> dict:
+        """
+        Wait until a job is done, failed or cancelled.
+
+        Returns:
+            dict: As get(); status is 'timeout' if `timeout` passed first
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await asyncio.to_thread(self.get, job_id)
+            if job is None or job["status"] in ('done', 'failed', 'cancelled'):
+                return job or {"status": "failed", "attempts": 0, "payload": None,
+                               "result": None, "error": "unknown_job"}
+            if time.monotonic() >= deadline:
+                return {**job, "status": "timeout"}
+            await asyncio.sleep(poll_interval)
+
+    def purge(self) -> int:
+        """Delete finished jobs older than the result TTL; returns how many were removed."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated_at < ?",
+                (time.time() - self.result_ttl,),
+            )
+        if cursor.rowcount:
+            logger.info(f"Purged {cursor.rowcount} finished jobs")
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        """Number of jobs per status."""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RemoteJobQueue:
+    """Worker-side client for the front end's queue API (see job_queue_api.py)."""
+
+    def __init__(self, url: str, token: str | None = None, timeout: float = 30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._session.headers["Authorization"] = f"Bearer {token or queue_token()}"
+
+    def _post(self, path: str, body: dict) -> dict | None:
+        response = self._session.post(f"{self.url}{path}", json=body, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json() if response.status_code != 204 else None
+
+    def claim(self, worker: str) -> dict | None:
+        return self._post("/jobs/claim", {"worker": worker})
+
+    def extend(self, job_id: int, lease: str) -> bool:
+        return self._post(f"/jobs/{job_id}/extend", {"lease": lease})["ok"]
+
+    def complete(self, job_id: int, lease: str, result: dict) -> bool:
+        return self._post(f"/jobs/{job_id}/complete", {"lease": lease, "result": result})["ok"]
+
+    def fail(self, job_id: int, lease: str, error: str, retry: bool = True) -> bool:
+        return self._post(f"/jobs/{job_id}/fail", {"lease": lease, "error": error, "retry": retry})["ok"]
+
+    def close(self):
+        self._session.close()
@@ -0,0 +1,72 @@
+"""
+HTTP API over the front end's job queue, for workers on other nodes.
+
+Workers on the same node open the SQLite file directly. Remote workers use
+job_queue.RemoteJobQueue, which calls the routes below; every request must
+carry the shared queue token as a bearer token. Queue calls block on SQLite,
+so handlers run them in a thread instead of on the front end's event loop.
+"""
+
+import asyncio
+import hmac
+import logging
+from aiohttp import web
+from job_queue import JobQueue, queue_token
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueServer:
+    """aiohttp server exposing claim/extend/complete/fail of a JobQueue."""
+
+    def __init__(self, queue: JobQueue, port: int, listen: str = '0.0.0.0', token: str | None = None):
+        self.queue = queue
+        self.port = port
+        self.listen = listen
+        self._expected = f"Bearer {token or queue_token()}"
+        self._runner = None
+
+        self.app = web.Application(middlewares=[self._auth])
+        self.app.router.add_post('/jobs/claim', self.handle_claim)
+        self.app.router.add_post('/jobs/{job_id:\\d+}/{action:extend|complete|fail}', self.handle_action)
+        self.app.router.add_get('/jobs/stats', self.handle_stats)
+
+    @web.middleware
+    async def _auth(self, request: web.Request, handler):
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), self._expected):
+            logger.warning(f"Rejected queue API request from {request.remote}")
+            return web.Response(status=403)
+        return await handler(request)
+
+    async def handle_claim(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        job = await asyncio.to_thread(self.queue.claim, str(body.get("worker") or request.remote))
+        return web.json_response(job) if job else web.Response(status=204)
+
+    async def handle_action(self, request: web.Request) -> web.Response:
+        job_id = int(request.match_info['job_id'])
+        action = request.match_info['action']
+        body = await request.json()
+        lease = body.get("lease", "")
+        if action == 'extend':
+            ok = await asyncio.to_thread(self.queue.extend, job_id, lease)
+        elif action == 'complete':
+            ok = await asyncio.to_thread(self.queue.complete, job_id, lease, body.get("result") or {})
+        else:
+            ok = await asyncio.to_thread(self.queue.fail, job_id, lease, str(body.get("error") or "worker_error"),
+                                         bool(body.get("retry", True)))
+        return web.json_response({"ok": ok})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(await asyncio.to_thread(self.queue.stats))
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Job queue API listening on {self.listen}:{self.port}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -6,12 +6,14 @@ with Kurdish language responses.
 
 import os
 import sys
+import asyncio
 import tempfile
 import logging
 import time
 from telegram.error import Conflict
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from config import BOT_TOKEN
+from config import (BOT_TOKEN, CONCURRENT_UPDATES, BOT_MODE, TELEGRAM_API_BASE_URL,
+                    JOB_QUEUE_MODE, JOB_QUEUE_PORT)
 
 # Configure logging before importing modules that may log during import
 logging.basicConfig(
@@ -33,12 +35,66 @@ def force_cleanup_bot_instance():
 # Force cleanup any existing instances
 force_cleanup_bot_instance()
 
+import bot_handlers
 from bot_handlers import start_command, handle_video_link, handle_youtube_callback
+from job_queue import JobQueue
+
+def build_application(webhook: bool = False, base_url: str = TELEGRAM_API_BASE_URL) -> Application:
+    """
+    Build the bot application with its handlers.
+    
+    Args:
+        webhook (bool): Updates arrive through webhook_server, so no Updater is built
+        base_url (str): Bot API endpoint; empty for api.telegram.org
+        
+    Returns:
+        Application: Ready to run, with the handlers from bot_handlers
+    """
+    # Concurrent updates let one slow download run while other chats are served
+    builder = Application.builder().token(BOT_TOKEN).concurrent_updates(CONCURRENT_UPDATES)
+    if base_url:
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    if webhook:
+        builder = builder.updater(None)
+    if JOB_QUEUE_MODE == "queue" and JOB_QUEUE_PORT:
+        builder = builder.post_init(start_queue_api).post_shutdown(stop_queue_api)
+    application = builder.build()
+
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_video_link))
+    application.add_handler(CallbackQueryHandler(handle_youtube_callback, pattern=r"^yt_(video|parts|audio)_"))
+    return application
+
+async def start_queue_api(application: Application):
+    """Serve the job queue to download workers on other nodes."""
+    # aiohttp is only needed when the queue API is enabled
+    from job_queue_api import JobQueueServer
+    bot_handlers.job_queue = bot_handlers.job_queue or JobQueue()
+    server = JobQueueServer(bot_handlers.job_queue, JOB_QUEUE_PORT)
+    await server.start()
+    application.bot_data["queue_api"] = server
+
+async def stop_queue_api(application: Application):
+    server = application.bot_data.pop("queue_api", None)
+    if server:
+        await server.stop()
+
+def run_webhook():
+    """Serve updates through the embedded webhook server until SIGTERM."""
+    # aiohttp is only needed in webhook mode
+    import webhook_server
+    asyncio.run(webhook_server.serve(build_application(webhook=True)))
 
 def main():
     """Main function to run the Telegram bot.
-    Aggressively takes over the bot token from any other instances.
+    In webhook mode updates are pushed to this process (one of possibly
+    several replicas); otherwise it polls, aggressively taking over the bot
+    token from any other instances.
     """
+    if BOT_MODE == "webhook":
+        run_webhook()
+        return
+
     attempt = 0
     max_attempts = 3
     
@@ -47,13 +103,8 @@ def main():
             attempt += 1
             logger.info(f"Bot startup attempt {attempt}/{max_attempts}")
             
-            # Build application with aggressive settings to take over
-            application = Application.builder().token(BOT_TOKEN).build()
-
-            # Add handlers once per application instance
-            application.add_handler(CommandHandler("start", start_command))
-            application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_video_link))
-            application.add_handler(CallbackQueryHandler(handle_youtube_callback, pattern=r"^yt_(video|audio)_"))
+            # Build application (with its handlers) with aggressive settings to take over
+            application = build_application()
 
             logger.info("Bot starting… (polling mode)")
 
@@ -0,0 +1,489 @@
+"""
+Media inspection and encoding with ffmpeg.
+
+Downloads are inspected with ffprobe before upload: media that Telegram can
+already play (H.264 video, AAC/MP3 audio) is only remuxed into a faststart
+MP4 with stream copy, and only other codecs are transcoded.
+
+For size limits, instead of guessing a bitrate from the input file size, the
+encoder probes the duration and streams, spends a fixed audio bitrate, and
+gives the rest of the byte budget to the video track. Two-pass encoding (or
+capped CRF with maxrate/bufsize) then lands the output just under the target.
+
+When re-encoding would take too long or starve the video of bitrate, the
+file can instead be split at keyframes into stream-copied parts that each fit.
+
+Long inputs are encoded in segments on all cores (see parallel_transcoder);
+shorter ones by a single ffmpeg process.
+
+Every ffmpeg call goes through the shared ffmpeg_runner, which bounds how
+many encodes run at once.
+"""
+
+import asyncio
+import json
+import os
+import glob
+import struct
+import logging
+from ffmpeg_runner import runner
+from parallel_transcoder import segment_count, segment_runner, transcode_video, transcode_audio
+from config import (COMPRESS_TWO_PASS, COMPRESS_PRESET, COMPRESS_AUDIO_KBPS,
+                    COMPRESS_SIZE_MARGIN, COMPRESS_TIMEOUT, TRANSCODE_CPU_ESTIMATE,
+                    SPLIT_MAX_ENCODE_SECONDS, SPLIT_MIN_VIDEO_KBPS, SPLIT_SIZE_MARGIN,
+                    PARALLEL_MIN_DURATION)
+
+logger = logging.getLogger(__name__)
+
+# Below these video bitrates a smaller frame looks better than a starved 1080p one
+_SCALE_STEPS = ((400, 480), (900, 720))
+_MIN_VIDEO_KBPS = 64
+_MIN_AUDIO_KBPS = 32
+
+# Codecs every Telegram client plays inline from an MP4
+COMPATIBLE_VIDEO_CODECS = ("h264",)
+COMPATIBLE_AUDIO_CODECS = ("aac", "mp3")
+_MP4_FORMATS = ("mov", "mp4", "m4a")
+
+# CPU seconds one media second costs to transcode, learned from real transcodes
+_transcode_rate = TRANSCODE_CPU_ESTIMATE
+
+
+async def probe_media(path: str) -> dict | None:
+    """Return ffprobe's format/streams JSON for a file, or None if it cannot be read."""
+    cmd = ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path]
+    try:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), 60)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise
+        if proc.returncode != 0:
+            logger.error(f"ffprobe failed for {path}: {stderr.decode(errors='replace').strip()}")
+            return None
+        return json.loads(stdout)
+    except (OSError, ValueError, asyncio.TimeoutError) as e:
+        logger.error(f"ffprobe failed for {path}: {e}")
+        return None
+
+
+def media_duration(info: dict) -> float | None:
+    """Duration in seconds from the container, falling back to the longest stream."""
+    durations = [(info.get('format') or {}).get('duration')]
+    durations += [s.get('duration') for s in info.get('streams', [])]
+    for value in durations:
+        try:
+            if value and float(value) > 0:
+                return float(value)
+        except ValueError:
+            continue
+    return None
+
+
+def first_stream(info: dict, codec_type: str) -> dict | None:
+    """First stream of a type ('video' or 'audio'), ignoring attached cover art."""
+    for stream in info.get('streams', []):
+        if stream.get('codec_type') != codec_type:
+            continue
+        if (stream.get('disposition') or {}).get('attached_pic'):
+            continue
+        return stream
+    return None
+
+
+def bitrate_budget(target_bytes: int, duration: float, audio_kbps: int,
+                   margin: float = COMPRESS_SIZE_MARGIN) -> int:
+    """
+    Video bitrate (kbps) that fills `target_bytes` over `duration` seconds.
+
+    `margin` is the share of the target reserved for container overhead and
+    encoder rate-control error.
+    """
+    total_kbps = target_bytes * 8 * (1 - margin) / duration / 1000
+    return int(total_kbps - audio_kbps)
+
+
+def _audio_kbps(audio: dict | None, total_kbps: float) -> int:
+    """Audio bitrate: the configured rate, capped by the source and by a tight budget."""
+    if not audio:
+        return 0
+    kbps = COMPRESS_AUDIO_KBPS
+    try:
+        kbps = min(kbps, max(_MIN_AUDIO_KBPS, int(audio.get('bit_rate', 0)) // 1000 or kbps))
+    except ValueError:
+        pass
+    # Never let audio take more than a fifth of a small budget
+    return max(_MIN_AUDIO_KBPS, min(kbps, int(total_kbps / 5)))
+
+
+def _scale_filter(video: dict, video_kbps: int) -> list[str]:
+    height = video.get('height') or 0
+    for max_kbps, max_height in _SCALE_STEPS:
+        if video_kbps < max_kbps and height > max_height:
+            return ['-vf', f'scale=-2:{max_height}']
+    return []
+
+
+async def _run(args: list[str], timeout: float) -> dict:
+    """Run ffmpeg through the shared runner; a timeout counts as a failed run."""
+    try:
+        return await runner.run(['-y', *args], timeout=timeout)
+    except TimeoutError:
+        return {'ok': False, 'cpu_seconds': 0.0, 'error': 'timeout'}
+
+
+def _segments(duration: float | None, parallel: bool | None) -> int:
+    """Segments to encode in: None decides by duration, True forces, False disables."""
+    if parallel is False:
+        return 1
+    return segment_count(duration, min_duration=0 if parallel else PARALLEL_MIN_DURATION)
+
+
+def _has_faststart(path: str) -> bool:
+    """True if the MP4's moov atom comes before mdat (playable while downloading)."""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return False
+                size, box = struct.unpack('>I4s', header)
+                if box == b'moov':
+                    return True
+                if box == b'mdat':
+                    return False
+                if size == 1:
+                    size = struct.unpack('>Q', f.read(8))[0] - 8
+                elif size == 0:
+                    return False
+                f.seek(size - 8, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return False
+
+
+async def prepare_for_telegram(path: str, timeout: float = COMPRESS_TIMEOUT,
+                               parallel: bool | None = None) -> tuple[str, dict]:
+    """
+    Make a downloaded video an MP4 that Telegram streams, copying streams when possible.
+
+    H.264 with AAC/MP3 (or no audio) is stream-copied into a faststart MP4, or
+    left alone if it already is one. H.264 with other audio only has its
+    audio re-encoded. Anything else gets a full H.264/AAC transcode, in
+    parallel segments when the input is long (`parallel` as in encode_to_size()).
+
+    Returns:
+        tuple: (path, report). `path` is the file to upload (the input on any
+        failure). The report has 'action' ('none', 'remux', 'audio_transcode',
+        'transcode', 'skipped' or 'failed'), 'cpu_seconds' and
+        'cpu_seconds_saved' (estimated against a full transcode).
+    """
+    global _transcode_rate
+    report = {'action': 'skipped', 'cpu_seconds': 0.0, 'cpu_seconds_saved': 0.0}
+    info = await probe_media(path)
+    video = first_stream(info, 'video') if info else None
+    if not video:
+        # Audio-only output (e.g. MP3 extraction) needs no container change
+        return path, report
+
+    duration = media_duration(info) or 0.0
+    audio = first_stream(info, 'audio')
+    video_ok = video.get('codec_name') in COMPATIBLE_VIDEO_CODECS
+    audio_ok = audio is None or audio.get('codec_name') in COMPATIBLE_AUDIO_CODECS
+    is_mp4 = any(name in _MP4_FORMATS for name in (info.get('format') or {}).get('format_name', '').split(','))
+
+    if video_ok and audio_ok and is_mp4 and path.endswith('.mp4') and _has_faststart(path):
+        report['action'] = 'none'
+    else:
+        video_args = ['-c:v', 'libx264', '-preset', COMPRESS_PRESET, '-crf', '23', '-pix_fmt', 'yuv420p']
+        audio_args = ['-c:a', 'copy'] if audio_ok else ['-c:a', 'aac', '-b:a', f'{COMPRESS_AUDIO_KBPS}k']
+        if video_ok:
+            report['action'] = 'remux' if audio_ok else 'audio_transcode'
+            video_args = ['-c:v', 'copy']
+        else:
+            report['action'] = 'transcode'
+
+        output_path = os.path.splitext(path)[0] + '.remux.mp4'
+        segments = _segments(duration, parallel) if report['action'] == 'transcode' else 1
+        if segments > 1:
+            result = await transcode_video(path, output_path, video_args, False,
+                                           audio_args if audio else None, duration, segments, timeout)
+        else:
+            result = await _run(['-i', path, '-map', '0:v:0', '-map', '0:a:0?', *video_args,
+                                 *audio_args, '-movflags', '+faststart', output_path], timeout)
+        report['cpu_seconds'] = result['cpu_seconds']
+        if not result['ok'] or not os.path.exists(output_path):
+            report['action'] = 'failed'
+            try:
+                os.remove(output_path)
+            except OSError:
+                pass
+            return path, report
+
+        final_path = os.path.splitext(path)[0] + '.mp4'
+        os.replace(output_path, final_path)
+        if final_path != path:
+            os.remove(path)
+        path = final_path
+
+    if report['action'] == 'transcode':
+        if duration:
+            # Moving average so estimates track this machine's real encode cost
+            _transcode_rate = 0.8 * _transcode_rate + 0.2 * (report['cpu_seconds'] / duration)
+    else:
+        report['cpu_seconds_saved'] = max(0.0, _transcode_rate * duration - report['cpu_seconds'])
+
+    logger.info(f"Prepared {os.path.basename(path)}: {report['action']}, "
+                f"{report['cpu_seconds']:.1f}s CPU, ~{report['cpu_seconds_saved']:.1f}s CPU saved")
+    return path, report
+
+
+async def encode_to_size(input_path: str, output_path: str, target_bytes: int,
+                   two_pass: bool = COMPRESS_TWO_PASS, preset: str = COMPRESS_PRESET,
+                   timeout: float = COMPRESS_TIMEOUT,
+                   parallel: bool | None = None) -> tuple[str | None, dict]:
+    """
+    Encode `input_path` so the result fits in `target_bytes`.
+
+    Video files are encoded to H.264/AAC MP4; audio-only files to MP3.
+
+    Args:
+        input_path (str): Source media
+        output_path (str): Destination (extension is replaced for audio-only input)
+        target_bytes (int): Size the output must not exceed
+        two_pass (bool): Two-pass ABR; otherwise capped CRF with maxrate/bufsize
+        preset (str): x264 preset
+        timeout (float): Seconds allowed per ffmpeg pass
+        parallel (bool): Encode in segments on all cores; None does so for
+            inputs longer than PARALLEL_MIN_DURATION
+
+    Returns:
+        tuple: (output_path, report) on success, (None, report) on failure.
+        The report holds target/achieved bytes, duration, chosen bitrates and
+        the number of segments encoded in parallel.
+    """
+    report = {'target_bytes': target_bytes, 'output_bytes': None}
+    info = await probe_media(input_path)
+    duration = media_duration(info) if info else None
+    if not duration:
+        report['error'] = 'unknown_duration'
+        return None, report
+
+    video = first_stream(info, 'video')
+    audio = first_stream(info, 'audio')
+    total_kbps = target_bytes * 8 * (1 - COMPRESS_SIZE_MARGIN) / duration / 1000
+    segments = _segments(duration, parallel)
+    report.update(duration=duration, segments=segments)
+
+    if video:
+        audio_kbps = _audio_kbps(audio, total_kbps)
+        video_kbps = bitrate_budget(target_bytes, duration, audio_kbps)
+        report.update(audio_kbps=audio_kbps, video_kbps=video_kbps)
+        if video_kbps < _MIN_VIDEO_KBPS:
+            report['error'] = 'budget_too_small'
+            logger.error(f"{duration:.0f}s video cannot fit {target_bytes} bytes "
+                         f"({video_kbps}k video budget)")
+            return None, report
+        result = await _encode_video(input_path, output_path, video, audio_kbps, video_kbps,
+                                     two_pass, preset, timeout, duration, segments)
+        report['passes'] = 2 if two_pass else 1
+    else:
+        output_path = os.path.splitext(output_path)[0] + '.mp3'
+        audio_kbps = max(_MIN_AUDIO_KBPS, min(320, int(total_kbps)))
+        report.update(audio_kbps=audio_kbps, passes=1)
+        result = await _encode_mp3(input_path, output_path, audio_kbps, timeout, duration, segments)
+    report.update(cpu_seconds=result['cpu_seconds'], speed=result.get('speed'))
+
+    if not result['ok'] or not os.path.exists(output_path):
+        report['error'] = result.get('error', 'ffmpeg_failed')
+        return None, report
+
+    report['output_bytes'] = os.path.getsize(output_path)
+    report['fill'] = round(report['output_bytes'] / target_bytes, 3)
+    logger.info(f"Encoded {os.path.basename(output_path)}: {report['output_bytes'] / 1048576:.1f}MB "
+                f"of {target_bytes / 1048576:.1f}MB target ({report['fill']:.1%})")
+    if report['output_bytes'] > target_bytes:
+        report['error'] = 'over_target'
+        try:
+            os.remove(output_path)
+        except OSError:
+            pass
+        return None, report
+    return output_path, report
+
+
+async def _encode_video(input_path: str, output_path: str, video: dict, audio_kbps: int,
+                        video_kbps: int, two_pass: bool, preset: str, timeout: float,
+                        duration: float, segments: int = 1) -> dict:
+    audio_args = ['-c:a', 'aac', '-b:a', f'{audio_kbps}k'] if audio_kbps else None
+    video_args = ['-c:v', 'libx264', '-preset', preset, '-pix_fmt', 'yuv420p',
+                  *_scale_filter(video, video_kbps)]
+    if two_pass:
+        rate = ['-b:v', f'{video_kbps}k', '-maxrate', f'{int(video_kbps * 1.5)}k',
+                '-bufsize', f'{video_kbps * 2}k']
+    else:
+        # Capped CRF: quality-driven, but the VBV cap bounds the total size
+        rate = ['-crf', '23', '-maxrate', f'{int(video_kbps * 0.95)}k', '-bufsize', f'{video_kbps}k']
+
+    if segments > 1:
+        # Every segment gets the same average bitrate, so the sizes still add up to the budget
+        return await transcode_video(input_path, output_path, [*video_args, *rate], two_pass,
+                                     audio_args, duration, segments, timeout)
+
+    common = ['-map', '0:v:0', '-map', '0:a:0?', *video_args, *rate]
+    audio_args = audio_args or ['-an']
+    if not two_pass:
+        return await _run(['-i', input_path, *common, *audio_args,
+                           '-movflags', '+faststart', output_path], timeout)
+
+    passlog = os.path.splitext(output_path)[0] + '_passlog'
+    try:
+        first = await _run(['-i', input_path, *common, '-pass', '1',
+                            '-passlogfile', passlog, '-an', '-f', 'mp4', os.devnull], timeout)
+        if not first['ok']:
+            return first
+        second = await _run(['-i', input_path, *common, '-pass', '2',
+                             '-passlogfile', passlog, *audio_args, '-movflags', '+faststart',
+                             output_path], timeout)
+        second['cpu_seconds'] += first['cpu_seconds']
+        return second
+    finally:
+        for path in glob.glob(glob.escape(passlog) + '*'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+async def _encode_mp3(input_path: str, output_path: str, kbps: int, timeout: float,
+                      duration: float | None, segments: int = 1) -> dict:
+    audio_args = ['-c:a', 'libmp3lame', '-b:a', f'{kbps}k']
+    if segments > 1:
+        return await transcode_audio(input_path, output_path, audio_args, duration, segments, timeout)
+    return await _run(['-i', input_path, '-map', '0:a:0', '-vn', *audio_args, output_path], timeout)
+
+
+async def encode_mp3(input_path: str, output_path: str, kbps: int = 192,
+                     timeout: float = COMPRESS_TIMEOUT,
+                     parallel: bool | None = None) -> tuple[str | None, dict]:
+    """
+    Convert the first audio track of `input_path` to a constant-bitrate MP3.
+
+    Returns:
+        tuple: (output_path, report) on success, (None, report) on failure.
+        The report holds duration, segments, cpu_seconds and speed.
+    """
+    info = await probe_media(input_path)
+    duration = media_duration(info) if info else None
+    segments = _segments(duration, parallel)
+    result = await _encode_mp3(input_path, output_path, kbps, timeout, duration, segments)
+    report = {'duration': duration, 'segments': segments, 'audio_kbps': kbps,
+              'cpu_seconds': result['cpu_seconds'], 'speed': result.get('speed')}
+    if not result['ok'] or not os.path.exists(output_path):
+        report['error'] = result.get('error', 'ffmpeg_failed')
+        return None, report
+    logger.info(f"Encoded {os.path.basename(output_path)} at {kbps}k in {segments} segment(s), "
+                f"{result['cpu_seconds']:.1f}s CPU")
+    return output_path, report
+
+
+def estimate_encode_seconds(duration: float, two_pass: bool = COMPRESS_TWO_PASS) -> float:
+    """Wall-clock estimate for re-encoding `duration` seconds of video on this machine."""
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    cores_per_job = max(1.0, cores / runner.max_concurrent)
+    if segment_count(duration) > 1:
+        # Long inputs are encoded in segments across the segment runner's processes
+        cores_per_job = max(cores_per_job, min(cores, segment_runner.max_concurrent))
+    return duration * _transcode_rate * (2 if two_pass else 1) / cores_per_job
+
+
+async def choose_shrink_mode(path: str, limit: int) -> str:
+    """
+    Decide between 'compress' and 'split' for a file over `limit` bytes.
+
+    Splitting wins when a re-encode is estimated to take longer than
+    SPLIT_MAX_ENCODE_SECONDS, or when fitting the whole file would leave the
+    video less than SPLIT_MIN_VIDEO_KBPS.
+    """
+    info = await probe_media(path)
+    duration = media_duration(info) if info else None
+    if not duration:
+        return 'compress'
+
+    video = first_stream(info, 'video')
+    total_kbps = limit * 8 * (1 - COMPRESS_SIZE_MARGIN) / duration / 1000
+    if not video:
+        mode = 'split' if total_kbps < 2 * _MIN_AUDIO_KBPS else 'compress'
+        logger.info(f"Shrink mode for {os.path.basename(path)}: {mode} ({total_kbps:.0f}k audio budget)")
+        return mode
+
+    video_kbps = bitrate_budget(limit, duration, _audio_kbps(first_stream(info, 'audio'), total_kbps))
+    encode_seconds = estimate_encode_seconds(duration)
+    mode = 'split' if video_kbps < SPLIT_MIN_VIDEO_KBPS or encode_seconds > SPLIT_MAX_ENCODE_SECONDS else 'compress'
+    logger.info(f"Shrink mode for {os.path.basename(path)}: {mode} "
+                f"({video_kbps}k video budget, ~{encode_seconds:.0f}s to re-encode)")
+    return mode
+
+
+async def split_to_parts(input_path: str, max_bytes: int,
+                         timeout: float = COMPRESS_TIMEOUT) -> tuple[list[str] | None, dict]:
+    """
+    Cut a file at keyframes into stream-copied parts of at most `max_bytes`.
+
+    The segment length comes from the average bitrate; if uneven bitrate or
+    sparse keyframes still produce an oversized part, the split is redone
+    with shorter segments.
+
+    Returns:
+        tuple: (part paths in playback order, report) on success,
+        (None, report) on failure. Parts are written next to the input.
+    """
+    report = {'max_bytes': max_bytes, 'parts': 0}
+    info = await probe_media(input_path)
+    duration = media_duration(info) if info else None
+    if not duration:
+        report['error'] = 'unknown_duration'
+        return None, report
+
+    base, ext = os.path.splitext(input_path)
+    maps = ['-map', '0:v:0', '-map', '0:a:0?'] if first_stream(info, 'video') else ['-map', '0:a:0']
+    segment_time = duration * max_bytes * (1 - SPLIT_SIZE_MARGIN) / os.path.getsize(input_path)
+
+    def existing_parts() -> list[str]:
+        return sorted(glob.glob(glob.escape(base) + '_part[0-9][0-9][0-9]' + glob.escape(ext)))
+
+    def remove(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    for attempt in range(3):
+        remove(existing_parts())
+        args = ['-i', input_path, *maps, '-c', 'copy', '-f', 'segment',
+                '-segment_time', f'{segment_time:.3f}', '-reset_timestamps', '1']
+        if ext == '.mp4':
+            args += ['-segment_format_options', 'movflags=+faststart']
+        result = await _run([*args, f'{base}_part%03d{ext}'], timeout)
+        parts = existing_parts()
+        if not result['ok'] or not parts:
+            remove(parts)
+            report['error'] = result.get('error', 'ffmpeg_failed')
+            return None, report
+
+        largest = max(os.path.getsize(part) for part in parts)
+        report.update(parts=len(parts), largest_bytes=largest, segment_time=round(segment_time, 1),
+                      attempts=attempt + 1)
+        if largest <= max_bytes:
+            logger.info(f"Split {os.path.basename(input_path)} into {len(parts)} parts, "
+                        f"largest {largest / 1048576:.1f}MB of {max_bytes / 1048576:.1f}MB")
+            return parts, report
+        # Shrink the segment length by how far the worst part overshot
+        segment_time *= 0.9 * max_bytes / largest
+
+    remove(existing_parts())
+    report['error'] = 'part_too_large'
+    return None, report
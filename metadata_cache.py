@@ -0,0 +1,169 @@
+"""
+TTL cache for yt-dlp extraction results.
+
+Extraction is the slow, rate-limited part of a yt-dlp job. Info dicts are kept
+in memory and on disk, keyed by canonical media key plus extractor profile,
+so popular links and retries do not hit the site again. Signed format URLs
+expire, so an entry never outlives the earliest expiry found in its URLs.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+import yt_dlp
+from config import (METADATA_CACHE_DIR, METADATA_CACHE_TTL, METADATA_CACHE_MAX_ENTRIES,
+                    METADATA_CACHE_MAX_DISK_ENTRIES, METADATA_CACHE_EXPIRY_MARGIN)
+
+logger = logging.getLogger(__name__)
+
+
+def _url_expiry(url: str) -> float | None:
+    """Unix time a signed media URL stops working, if the URL says so."""
+    try:
+        query = parse_qs(urlparse(url).query)
+    except Exception:
+        return None
+    for param in ("expire", "x-expires", "Expires"):
+        if param in query and query[param][0].isdigit():
+            return float(query[param][0])
+    if "oe" in query:  # Instagram/Facebook CDN: hex unix time
+        try:
+            return float(int(query["oe"][0], 16))
+        except ValueError:
+            pass
+    return None
+
+
+def _info_expiry(info: dict) -> float | None:
+    """Earliest expiry across every format URL in an info dict."""
+    expiries = []
+    stack = [info]
+    while stack:
+        item = stack.pop()
+        if not isinstance(item, dict):
+            continue
+        url = item.get("url")
+        if isinstance(url, str):
+            expiry = _url_expiry(url)
+            if expiry:
+                expiries.append(expiry)
+        for key in ("formats", "requested_formats", "entries"):
+            stack.extend(item.get(key) or [])
+    return min(expiries) if expiries else None
+
+
+class MetadataCache:
+    """Two-level (memory + disk) TTL cache of sanitized info dicts."""
+
+    def __init__(self, directory: str = METADATA_CACHE_DIR, ttl: float = METADATA_CACHE_TTL,
+                 max_entries: int = METADATA_CACHE_MAX_ENTRIES,
+                 max_disk_entries: int = METADATA_CACHE_MAX_DISK_ENTRIES,
+                 expiry_margin: float = METADATA_CACHE_EXPIRY_MARGIN):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.expiry_margin = expiry_margin
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        # key -> (expires_at, serialized info); stored as JSON so callers get a fresh copy
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key: str) -> dict | None:
+        """Return a fresh copy of the cached info dict, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1
+                return json.loads(entry[1])
+            if entry:
+                del self._memory[key]
+
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                expires_at, serialized = json.load(f)
+            if expires_at > now:
+                with self._lock:
+                    self._remember(key, expires_at, serialized)
+                    self.stats["disk_hits"] += 1
+                return json.loads(serialized)
+            os.remove(self._path(key))
+        except (OSError, ValueError):
+            pass
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, info: dict):
+        """Store a sanitized copy of an info dict until its URLs expire."""
+        now = time.time()
+        expires_at = now + self.ttl
+        url_expiry = _info_expiry(info)
+        if url_expiry:
+            expires_at = min(expires_at, url_expiry - self.expiry_margin)
+        if expires_at <= now:
+            return
+
+        try:
+            serialized = json.dumps(yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True))
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Could not serialize info for {key}: {e}")
+            return
+
+        with self._lock:
+            self._remember(key, expires_at, serialized)
+            self.stats["stores"] += 1
+            disk_due = self.stats["stores"] % 50 == 0
+
+        try:
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([expires_at, serialized], f)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not write metadata cache entry: {e}")
+
+        if disk_due:
+            self._trim_disk()
+
+    def invalidate(self, key: str):
+        """Drop an entry, e.g. after its format URLs were rejected."""
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _remember(self, key: str, expires_at: float, serialized: str):
+        self._memory[key] = (expires_at, serialized)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _trim_disk(self):
+        """Keep at most max_disk_entries files, dropping the oldest first."""
+        try:
+            paths = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(".json")]
+            overflow = len(paths) - self.max_disk_entries
+            if overflow <= 0:
+                return
+            for path in sorted(paths, key=os.path.getmtime)[:overflow]:
+                os.remove(path)
+            with self._lock:
+                self.stats["evictions"] += overflow
+        except OSError as e:
+            logger.warning(f"Could not trim metadata cache: {e}")
@@ -0,0 +1,189 @@
+"""
+Segment-parallel transcoding for long media.
+
+One x264 or LAME process stops scaling well before it uses every core, so on
+long inputs a single ffmpeg run sets the latency floor. Here the input is cut
+with stream copy (at keyframes for video, at time boundaries for audio), each
+segment is encoded by its own ffmpeg process, and the encoded segments are
+joined with the concat demuxer, again without re-encoding.
+
+For video the audio track is encoded once, next to the segments, and muxed in
+at the end: encoding it per segment would leave an AAC priming gap at every
+cut. MP3 segments do carry LAME's encoder delay, which is a few milliseconds
+of silence at each joint, so segments are kept long.
+
+Segment encodes run on their own FFmpegRunner limited to the usable cores,
+so concurrent parallel jobs share the cores instead of multiplying them.
+"""
+
+import asyncio
+import glob
+import os
+import shutil
+import time
+import logging
+from ffmpeg_runner import FFmpegRunner
+from config import (PARALLEL_TRANSCODE_PROCESSES, PARALLEL_MIN_DURATION,
+                    PARALLEL_MIN_SEGMENT_SECONDS, COMPRESS_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+# Pool of segment encoders, separate from the whole-file runner
+segment_runner = FFmpegRunner(max_concurrent=PARALLEL_TRANSCODE_PROCESSES)
+
+
+def segment_count(duration: float | None, min_duration: float = PARALLEL_MIN_DURATION) -> int:
+    """Number of segments to encode `duration` seconds in; 1 means a single process."""
+    if not duration or duration < min_duration or segment_runner.max_concurrent < 2:
+        return 1
+    return max(1, min(segment_runner.max_concurrent, int(duration // PARALLEL_MIN_SEGMENT_SECONDS)))
+
+
+async def _run(args: list[str], timeout: float) -> dict:
+    """Run ffmpeg on the segment runner; a timeout counts as a failed run."""
+    try:
+        return await segment_runner.run(['-y', *args], timeout=timeout)
+    except TimeoutError:
+        return {'ok': False, 'cpu_seconds': 0.0, 'error': 'timeout'}
+
+
+async def _cut(input_path: str, work_dir: str, stream: str, ext: str, duration: float,
+               segments: int, timeout: float) -> tuple[list[str], dict]:
+    """Stream-copy one stream of the input into about `segments` equal pieces."""
+    result = await _run(['-i', input_path, '-map', stream, '-c', 'copy', '-f', 'segment',
+                         '-segment_time', f'{duration / segments:.3f}', '-reset_timestamps', '1',
+                         os.path.join(work_dir, f'src%03d{ext}')], timeout)
+    if not result['ok']:
+        return [], result
+    return sorted(glob.glob(os.path.join(glob.escape(work_dir), f'src[0-9][0-9][0-9]{ext}'))), result
+
+
+def _concat_list(work_dir: str, paths: list[str]) -> str:
+    """Write a concat demuxer list; entries are relative to the list file."""
+    list_path = os.path.join(work_dir, 'concat.txt')
+    with open(list_path, 'w') as f:
+        for path in paths:
+            f.write(f"file '{os.path.basename(path)}'\n")
+    return list_path
+
+
+async def _encode_video_segment(source: str, output: str, video_args: list[str], two_pass: bool,
+                                threads: int, timeout: float) -> dict:
+    common = ['-i', source, '-map', '0:v:0', *video_args, '-threads', str(threads), '-an']
+    if not two_pass:
+        return await _run([*common, output], timeout)
+
+    # Pass logs live in the work directory, which is removed afterwards
+    passlog = os.path.splitext(output)[0] + '_passlog'
+    first = await _run([*common, '-pass', '1', '-passlogfile', passlog, '-f', 'mp4', os.devnull], timeout)
+    if not first['ok']:
+        return first
+    second = await _run([*common, '-pass', '2', '-passlogfile', passlog, output], timeout)
+    second['cpu_seconds'] += first['cpu_seconds']
+    return second
+
+
+def _summary(results: list[dict], started: float, duration: float, segments: int) -> dict:
+    """Combine the runs of one parallel transcode into a runner-style result."""
+    elapsed = time.monotonic() - started
+    failed = next((r for r in results if not r['ok']), None)
+    summary = {'ok': failed is None, 'segments': segments, 'elapsed': elapsed,
+               'cpu_seconds': sum(r['cpu_seconds'] for r in results),
+               'speed': round(duration / elapsed, 2) if elapsed else None}
+    if failed:
+        summary['error'] = failed.get('error', 'ffmpeg_failed')
+    return summary
+
+
+async def transcode_video(input_path: str, output_path: str, video_args: list[str], two_pass: bool,
+                          audio_args: list[str] | None, duration: float, segments: int,
+                          timeout: float = COMPRESS_TIMEOUT) -> dict:
+    """
+    Encode a video in `segments` keyframe-aligned pieces at once, into a faststart MP4.
+
+    Args:
+        input_path (str): Source media
+        output_path (str): Destination MP4
+        video_args (list): Video codec and rate-control arguments applied to
+            every segment, e.g. libx264 with -b:v or -crf
+        two_pass (bool): Run both passes for each segment
+        audio_args (list): Codec arguments for the first audio track, or None
+            to drop audio
+        duration (float): Input duration in seconds
+        segments (int): Number of pieces to cut
+        timeout (float): Seconds allowed per ffmpeg pass
+
+    Returns:
+        dict: 'ok', 'segments', 'elapsed', 'cpu_seconds', 'speed' and, on
+        failure, 'error'
+    """
+    started = time.monotonic()
+    work_dir = os.path.splitext(output_path)[0] + '_segments'
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        sources, cut = await _cut(input_path, work_dir, '0:v:0', '.mkv', duration, segments, timeout)
+        if not sources:
+            return _summary([cut, {'ok': False, 'cpu_seconds': 0.0}], started, duration, 0)
+
+        # Split the cores between the segments that actually came out of the cut
+        threads = max(1, segment_runner.max_concurrent // len(sources))
+        encoded = [os.path.join(work_dir, f'enc{i:03d}.mp4') for i in range(len(sources))]
+        jobs = [_encode_video_segment(source, output, video_args, two_pass, threads, timeout)
+                for source, output in zip(sources, encoded)]
+        audio_path = os.path.join(work_dir, 'audio.mka')
+        if audio_args:
+            jobs.append(_run(['-i', input_path, '-map', '0:a:0', '-vn', *audio_args, audio_path], timeout))
+        results = [cut, *await asyncio.gather(*jobs)]
+        if not all(r['ok'] for r in results):
+            return _summary(results, started, duration, len(sources))
+
+        args = ['-f', 'concat', '-i', _concat_list(work_dir, encoded)]
+        maps = ['-map', '0:v:0']
+        if audio_args:
+            args += ['-i', audio_path]
+            maps += ['-map', '1:a:0']
+        results.append(await _run([*args, *maps, '-c', 'copy', '-movflags', '+faststart', output_path], timeout))
+        summary = _summary(results, started, duration, len(sources))
+        logger.info(f"Parallel video transcode of {os.path.basename(input_path)}: {len(sources)} segments, "
+                    f"{summary['elapsed']:.1f}s, {summary['speed'] or 0:.2f}x, {summary['cpu_seconds']:.1f}s CPU")
+        return summary
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def transcode_audio(input_path: str, output_path: str, audio_args: list[str], duration: float,
+                          segments: int, timeout: float = COMPRESS_TIMEOUT) -> dict:
+    """
+    Encode the first audio track in `segments` pieces at once (e.g. to MP3).
+
+    The container of each encoded piece and of the joined result follows the
+    extension of `output_path`.
+
+    Returns:
+        dict: Same shape as transcode_video()
+    """
+    started = time.monotonic()
+    work_dir = os.path.splitext(output_path)[0] + '_segments'
+    ext = os.path.splitext(output_path)[1]
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        sources, cut = await _cut(input_path, work_dir, '0:a:0', '.mka', duration, segments, timeout)
+        if not sources:
+            return _summary([cut, {'ok': False, 'cpu_seconds': 0.0}], started, duration, 0)
+
+        encoded = [os.path.join(work_dir, f'enc{i:03d}{ext}') for i in range(len(sources))]
+        results = [cut, *await asyncio.gather(*(
+            _run(['-i', source, '-map', '0:a:0', *audio_args, output], timeout)
+            for source, output in zip(sources, encoded)
+        ))]
+        if not all(r['ok'] for r in results):
+            return _summary(results, started, duration, len(sources))
+
+        results.append(await _run(['-f', 'concat', '-i', _concat_list(work_dir, encoded),
+                                   '-map', '0:a:0', '-c', 'copy', output_path], timeout))
+        summary = _summary(results, started, duration, len(sources))
+        logger.info(f"Parallel audio transcode of {os.path.basename(input_path)}: {len(sources)} segments, "
+                    f"{summary['elapsed']:.1f}s, {summary['speed'] or 0:.2f}x, {summary['cpu_seconds']:.1f}s CPU")
+        return summary
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,235 @@
+"""
+Shared retry policy: error classification, jittered backoff and budgets.
+
+Every retry loop goes through a RetryPolicy instead of its own
+`for attempt in range(3)` with a fixed sleep:
+- is_retryable() sorts yt-dlp, requests and Telegram errors into transient
+  ones (network trouble, 5xx/429, flood control, rejected signed URLs) and
+  permanent ones (private/removed media, unsupported links, 4xx, bad
+  requests), so permanent errors fail at once instead of being retried,
+- delays grow exponentially with jitter, so requests that failed together
+  do not retry in lockstep; Telegram's retry_after is honoured,
+- a RetryBudget caps the retries one download job spends over all of its
+  steps, and stops retrying once the job's deadline would be passed.
+
+Sending to Telegram is not idempotent, so TELEGRAM_RETRY only repeats sends
+that certainly did not arrive (is_safe_to_resend): flood control and
+requests that never got a connection. A timeout while the file was being
+written or the answer read may mean the message was posted anyway.
+
+RetryPolicy.call() is for blocking code that already runs on the download
+pool; the event loop uses call_async(), which sleeps with asyncio.sleep.
+"""
+
+import asyncio
+import random
+import time
+import logging
+import httpx
+import requests
+import yt_dlp
+from telegram.error import BadRequest, Forbidden, InvalidToken, NetworkError, RetryAfter
+from ranged_downloader import FileTooLargeError
+from config import (RETRY_BASE_DELAY, RETRY_MAX_DELAY, DOWNLOAD_RETRY_BUDGET, DOWNLOAD_DEADLINE,
+                    TELEGRAM_SEND_ATTEMPTS)
+
+logger = logging.getLogger(__name__)
+
+# yt-dlp messages for media that no retry or player client will make available
+_PERMANENT_MESSAGES = (
+    'unsupported url', 'private video', 'video unavailable', 'this video is unavailable',
+    'has been removed', 'account associated with this video has been terminated', 'copyright',
+    'not available in your country', 'members-only', 'http error 404', 'http error 410',
+    'this live event will begin', 'premieres in',
+)
+_RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class TransientError(Exception):
+    """Raised for an attempt that produced nothing but may succeed if repeated."""
+
+
+def _cause(error: BaseException) -> BaseException:
+    """The innermost error yt-dlp wrapped (DownloadError/ExtractorError keep it in exc_info)."""
+    for _ in range(5):
+        exc_info = getattr(error, 'exc_info', None)
+        inner = exc_info[1] if isinstance(exc_info, tuple) and len(exc_info) > 1 else None
+        if inner is None or inner is error:
+            break
+        error = inner
+    return error
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Whether repeating the failed operation can succeed.
+
+    Unknown errors (ValueError, KeyError, disk errors, ...) are treated as
+    bugs or local problems and are not retried.
+    """
+    if isinstance(error, TransientError):
+        return True
+    if isinstance(error, (BadRequest, Forbidden, InvalidToken)):
+        return False
+    if isinstance(error, (RetryAfter, NetworkError)):
+        # Flood control, timeouts and connection problems
+        return True
+    if isinstance(error, FileTooLargeError):
+        return False
+
+    if isinstance(error, yt_dlp.utils.YoutubeDLError):
+        if isinstance(_cause(error), (yt_dlp.utils.UnsupportedError, yt_dlp.utils.GeoRestrictedError)):
+            return False
+        message = str(error).lower()
+        # Anything else (403 on signed URLs, bot checks, throttling) may pass on a fresh attempt
+        return not any(pattern in message for pattern in _PERMANENT_MESSAGES)
+
+    error = _cause(error)
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status is None or status in _RETRYABLE_STATUS or status >= 500
+    if isinstance(error, (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema,
+                          requests.exceptions.InvalidSchema)):
+        return False
+    if isinstance(error, requests.RequestException):
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError))
+
+
+def is_safe_to_resend(error: BaseException) -> bool:
+    """
+    Whether a failed Telegram send can be repeated without risking a
+    duplicate message: flood control, or the request never left this host.
+    """
+    if isinstance(error, RetryAfter):
+        return True
+    if isinstance(error, (BadRequest, Forbidden, InvalidToken)) or not isinstance(error, NetworkError):
+        return False
+    # python-telegram-bot raises TimedOut/NetworkError from the httpx error
+    return isinstance(error.__cause__, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+def retry_after(error: BaseException) -> float | None:
+    """Delay the server asked for before the next attempt, if any."""
+    if isinstance(error, RetryAfter):
+        return float(error.retry_after)
+    error = _cause(error)
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        try:
+            return float(error.response.headers.get('Retry-After', ''))
+        except ValueError:
+            return None
+    return None
+
+
+class RetryBudget:
+    """Retries and time one job may spend across all of its retry loops."""
+
+    def __init__(self, retries: int = DOWNLOAD_RETRY_BUDGET, deadline: float = DOWNLOAD_DEADLINE):
+        self.retries = retries
+        self.deadline = time.monotonic() + deadline
+
+    @property
+    def remaining(self) -> float:
+        """Seconds left before the deadline."""
+        return self.deadline - time.monotonic()
+
+    def spend(self, delay: float = 0.0) -> bool:
+        """Take one retry that starts after `delay`; False if none is left or time is up."""
+        if self.retries <= 0 or self.remaining < delay:
+            return False
+        self.retries -= 1
+        return True
+
+
+class RetryPolicy:
+    """Retry an operation on transient errors, with jittered exponential backoff."""
+
+    def __init__(self, attempts: int = 3, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY, classify=is_retryable):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.classify = classify
+
+    def backoff(self, attempt: int, error: BaseException | None = None) -> float:
+        """
+        Delay before retry number `attempt` (1-based).
+
+        Half of the exponential step is fixed and half random, so retries
+        spread out but still back off; a server's Retry-After wins.
+        """
+        requested = retry_after(error) if error is not None else None
+        if requested is not None:
+            return requested
+        step = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return step / 2 + random.uniform(0, step / 2)
+
+    def _next_delay(self, attempt: int, error: Exception, budget: RetryBudget | None,
+                    label: str) -> float | None:
+        """Delay before the next attempt, or None to give up and re-raise."""
+        if not self.classify(error):
+            logger.warning(f"{label} failed permanently: {error}")
+            return None
+        if attempt >= self.attempts:
+            logger.warning(f"{label} failed after {attempt} attempts: {error}")
+            return None
+        delay = self.backoff(attempt, error)
+        if budget is not None and not budget.spend(delay):
+            logger.warning(f"{label} failed and the job is out of retries or time: {error}")
+            return None
+        logger.warning(f"{label} attempt {attempt} failed, retrying in {delay:.1f}s: {error}")
+        return delay
+
+    def call(self, func, *args, budget: RetryBudget | None = None, label: str = "Operation",
+             on_retry=None, **kwargs):
+        """
+        Call `func(*args, **kwargs)` until it succeeds or must not be retried.
+
+        Blocking: only for code already running on a worker thread.
+
+        Args:
+            budget (RetryBudget): Shared per-job limit on retries and time
+            label (str): Name of the operation in log messages
+            on_retry: Called with the error before each retry, e.g. to
+                refresh state the failed attempt invalidated
+
+        Returns:
+            The result of the first successful call; the last error is
+            re-raised when giving up
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(attempt, e, budget, label)
+                if delay is None:
+                    raise
+                error = e
+            time.sleep(delay)
+            if on_retry:
+                on_retry(error)
+
+    async def call_async(self, func, *args, budget: RetryBudget | None = None, label: str = "Operation",
+                         on_retry=None, **kwargs):
+        """Like call() for a coroutine function; waits without blocking the event loop."""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(attempt, e, budget, label)
+                if delay is None:
+                    raise
+                error = e
+            await asyncio.sleep(delay)
+            if on_retry:
+                on_retry(error)
+
+
+# Shared policies
+DOWNLOAD_RETRY = RetryPolicy(attempts=3)
+TELEGRAM_RETRY = RetryPolicy(attempts=TELEGRAM_SEND_ATTEMPTS, classify=is_safe_to_resend)
@@ -0,0 +1,57 @@
+"""
+Single-flight request coalescing.
+
+When several updates ask for the same media at once, only the first one runs
+the download/upload; the rest await its outcome instead of starting their own.
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Deduplicate concurrent async calls that share a key."""
+
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: str, func) -> tuple[object, bool]:
+        """
+        Run `func()` for `key` unless a call for the same key is already running.
+
+        Args:
+            key (str): Coalescing key, e.g. canonical media key plus format
+            func: Zero-argument coroutine function doing the actual work
+
+        Returns:
+            tuple: (result, shared) where `shared` is True if this caller waited
+            on another caller's work instead of running `func` itself
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            logger.info(f"Joining in-flight job for {key}")
+            # shield() so a cancelled waiter does not cancel the leader's work
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await func()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Mark the exception as retrieved in case nobody was waiting
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._inflight.pop(key, None)
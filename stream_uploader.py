@@ -0,0 +1,181 @@
+"""
+Stream direct-URL downloads straight into a Telegram upload.
+
+python-telegram-bot reads a whole file into memory before uploading it, so the
+normal path is download to TEMP_DIR -> read back -> upload. For direct CDN
+links (the TikTok API path) this module instead pipes the CDN response into a
+hand-built multipart/form-data request to the Bot API through a bounded queue:
+bytes are uploaded while they are still being downloaded and never touch the
+disk. The CDN's Content-Length is needed up front; when it is missing or above
+the upload limit the caller falls back to the disk path.
+
+Falling back re-uploads the video, so it is only done when Telegram cannot
+have posted it: the streamed request was never completed, or Telegram
+answered with an error. Once the whole body was sent, a lost or unreadable
+answer is an unknown outcome and nothing is uploaded again.
+"""
+
+import asyncio
+import logging
+import threading
+import uuid
+import httpx
+from config import TELEGRAM_UPLOAD_LIMIT, STREAM_UPLOAD_CHUNK_SIZE, STREAM_UPLOAD_BUFFER_CHUNKS
+
+logger = logging.getLogger(__name__)
+
+_client: httpx.AsyncClient | None = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=300.0, write=300.0))
+    return _client
+
+
+def _form_field(boundary: str, name: str, value: str) -> bytes:
+    return (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+        f"{value}\r\n"
+    ).encode("utf-8")
+
+
+def _pump(response, queue: asyncio.Queue, loop, stop: threading.Event, chunk_size: int):
+    """Producer thread: copy CDN chunks into the queue, blocking when it is full."""
+    def put(item) -> bool:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while not stop.is_set():
+            try:
+                future.result(timeout=1)
+                return True
+            except TimeoutError:
+                continue
+        future.cancel()
+        return False
+
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if chunk and not put(chunk):
+                return
+        put(None)
+    except Exception as e:
+        put(e)
+    finally:
+        response.close()
+
+
+async def stream_video_to_chat(bot, session, executor, chat_id: int, source_url: str,
+                               caption: str, filename: str,
+                               max_size: int = TELEGRAM_UPLOAD_LIMIT) -> tuple[str | None, str]:
+    """
+    Upload the video at `source_url` to a chat without staging it on disk.
+
+    Args:
+        bot: telegram.Bot whose token/base_url is used for the upload
+        session: requests.Session used to fetch the source
+        executor: Thread pool that runs the blocking CDN reader
+        chat_id (int): Target chat
+        source_url (str): Direct media URL
+        caption (str): Message caption
+        filename (str): File name reported to Telegram
+
+    Returns:
+        tuple: (file_id, "sent") on success, or (None, reason) where reason is
+        "unknown_size", "too_large" or "stream_failed"; the caller should then
+        use the regular download-to-disk path. (None, "sent") means the video
+        was posted but Telegram returned no file_id, and (None,
+        "upload_unknown") that the body was sent but the answer was lost; in
+        both cases the caller must not upload again.
+    """
+    loop = asyncio.get_running_loop()
+
+    response = await loop.run_in_executor(
+        executor, lambda: session.get(source_url, stream=True, timeout=30)
+    )
+    try:
+        response.raise_for_status()
+        size = int(response.headers.get("Content-Length") or 0)
+    except Exception as e:
+        response.close()
+        logger.warning(f"Streaming source unavailable: {e}")
+        return None, "stream_failed"
+
+    if not size:
+        response.close()
+        return None, "unknown_size"
+    if size > max_size:
+        response.close()
+        return None, "too_large"
+
+    boundary = uuid.uuid4().hex
+    preamble = (
+        _form_field(boundary, "chat_id", str(chat_id))
+        + _form_field(boundary, "caption", caption)
+        + _form_field(boundary, "supports_streaming", "true")
+        + (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="video"; filename="{filename}"\r\n'
+            f"Content-Type: video/mp4\r\n\r\n"
+        ).encode("utf-8")
+    )
+    epilogue = f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_UPLOAD_BUFFER_CHUNKS)
+    stop = threading.Event()
+    loop.run_in_executor(executor, _pump, response, queue, loop, stop, STREAM_UPLOAD_CHUNK_SIZE)
+
+    body_sent = False
+
+    async def body():
+        nonlocal body_sent
+        yield preamble
+        sent = 0
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            sent += len(item)
+            if sent > size:
+                raise ValueError("Source sent more bytes than its Content-Length")
+            yield item
+        if sent != size:
+            raise ValueError(f"Source ended after {sent} of {size} bytes")
+        body_sent = True
+        yield epilogue
+
+    try:
+        try:
+            result = await _get_client().post(
+                f"{bot.base_url}/sendVideo",
+                content=body(),
+                headers={
+                    "Content-Type": f"multipart/form-data; boundary={boundary}",
+                    "Content-Length": str(len(preamble) + size + len(epilogue)),
+                },
+            )
+            payload = result.json()
+        except Exception as e:
+            if not body_sent:
+                # An incomplete request is never processed, so the disk path is safe
+                logger.warning(f"Streaming upload failed before the body was sent: {e}")
+                return None, "stream_failed"
+            logger.error(f"Streaming upload to chat {chat_id} has an unknown outcome: {e}")
+            return None, "upload_unknown"
+        if not payload.get("ok"):
+            logger.warning(f"Streaming upload rejected: {payload.get('description')}")
+            return None, "stream_failed"
+        message = payload.get("result") or {}
+        media = message.get("video") or message.get("document") or {}
+        if not media.get("file_id"):
+            logger.warning(f"Streamed video was posted to chat {chat_id} without a file_id")
+        else:
+            logger.info(f"Streamed {size} bytes to chat {chat_id} without touching disk")
+        return media.get("file_id"), "sent"
+    finally:
+        # The producer notices within a second and closes the CDN response;
+        # no need to hold the handler until it does.
+        stop.set()
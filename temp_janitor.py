@@ -0,0 +1,166 @@
+"""
+Background janitor for TEMP_DIR.
+
+Downloads used to trigger a full scan of TEMP_DIR at the start of every
+request. The janitor does that work on a daemon thread instead: it keeps the
+directory under a byte quota and the disk above a free-space floor by evicting
+the least recently used artifacts first, and drops anything past a maximum
+age. Job directories claimed by in-flight jobs and pinned state files (session
+and cookie files kept in TEMP_DIR) are never touched.
+"""
+
+import os
+import shutil
+import threading
+import time
+import logging
+from config import (TEMP_DIR, TEMP_QUOTA_BYTES, TEMP_MIN_FREE_BYTES, TEMP_MAX_AGE,
+                    TEMP_JANITOR_INTERVAL, TEMP_CLAIM_TTL)
+
+logger = logging.getLogger(__name__)
+
+
+def _usage(path: str) -> tuple[int, float]:
+    """Total bytes and most recent access/modification time of a file or tree."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0, 0.0
+    if not os.path.isdir(path):
+        return st.st_size, max(st.st_atime, st.st_mtime)
+
+    size, last_used = 0, st.st_mtime
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            size += st.st_size
+            last_used = max(last_used, st.st_atime, st.st_mtime)
+    return size, last_used
+
+
+class TempJanitor:
+    """Enforce a byte quota and free-space floor on a directory, LRU first."""
+
+    def __init__(self, directory: str = TEMP_DIR, quota_bytes: int = TEMP_QUOTA_BYTES,
+                 min_free_bytes: int = TEMP_MIN_FREE_BYTES, max_age: float = TEMP_MAX_AGE,
+                 interval: float = TEMP_JANITOR_INTERVAL, claim_ttl: float = TEMP_CLAIM_TTL):
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.claim_ttl = claim_ttl
+        self.stats = {"sweeps": 0, "evicted": 0, "bytes_freed": 0}
+        # path -> time claimed; claimed paths belong to in-flight jobs
+        self._claims: dict[str, float] = {}
+        self._pinned: set[str] = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def claim(self, path: str):
+        """Protect `path` from eviction until it is released."""
+        with self._lock:
+            self._claims[os.path.abspath(path)] = time.time()
+        self.start()
+
+    def pin(self, path: str):
+        """Never evict `path` (long-lived state rather than a job artifact)."""
+        with self._lock:
+            self._pinned.add(os.path.abspath(path))
+
+    def release(self, path: str):
+        with self._lock:
+            self._claims.pop(os.path.abspath(path), None)
+
+    def start(self):
+        """Start the sweep thread if it is not already running."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._loop, name="temp-janitor", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Temp janitor sweep failed: {e}")
+
+    def _claimed(self, path: str, now: float) -> bool:
+        with self._lock:
+            if path in self._pinned:
+                return True
+            claimed_at = self._claims.get(path)
+            if claimed_at is None:
+                return False
+            if now - claimed_at > self.claim_ttl:
+                # The job never released its directory (e.g. the handler crashed)
+                del self._claims[path]
+                logger.warning(f"Dropping stale claim on {path}")
+                return False
+            return True
+
+    def sweep(self) -> dict:
+        """
+        Run one eviction pass.
+
+        Returns:
+            dict: {"evicted": int, "bytes_freed": int, "total_bytes": int}
+        """
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return {"evicted": 0, "bytes_freed": 0, "total_bytes": 0}
+
+        total = 0
+        candidates = []
+        for name in names:
+            path = os.path.abspath(os.path.join(self.directory, name))
+            size, last_used = _usage(path)
+            total += size
+            if not self._claimed(path, now):
+                candidates.append((last_used, size, path))
+        candidates.sort()
+
+        def free_bytes() -> int:
+            try:
+                return shutil.disk_usage(self.directory).free
+            except OSError:
+                return self.min_free_bytes
+
+        evicted = freed = 0
+        for last_used, size, path in candidates:
+            expired = now - last_used > self.max_age
+            over_quota = total - freed > self.quota_bytes
+            if not (expired or over_quota or free_bytes() < self.min_free_bytes):
+                # Candidates are oldest first, so nothing later is expired either
+                break
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+            evicted += 1
+            freed += size
+            reason = "expired" if expired else "over quota" if over_quota else "low disk"
+            logger.info(f"Evicted {os.path.basename(path)} ({size} bytes, {reason})")
+
+        with self._lock:
+            self.stats["sweeps"] += 1
+            self.stats["evicted"] += evicted
+            self.stats["bytes_freed"] += freed
+        return {"evicted": evicted, "bytes_freed": freed, "total_bytes": total - freed}
+
+    def stop(self):
+        self._stop.set()
+
+
+# Shared janitor for the download directory
+janitor = TempJanitor()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Check that downloads from an extracted info dict use the format chosen to fit
+the upload limit. No network: the formats are made up and yt-dlp's
+process_info, the step that downloads, only records what it was given.
+
+Run with: python -m unittest test_format_fitting
+"""
+import json
+import unittest
+import yt_dlp
+from video_downloader import VideoDownloader, DownloadJob
+from youtube_strategy import strategy as youtube_strategy
+
+MB = 1024 * 1024
+
+
+def _format(format_id, vcodec, acodec, height=None, tbr=None):
+    return {'format_id': format_id, 'url': f'https://media.invalid/{format_id}', 'ext': 'mp4',
+            'protocol': 'https', 'vcodec': vcodec, 'acodec': acodec, 'height': height, 'tbr': tbr}
+
+
+# 10 minutes: 137+140 is ~300MB, the progressive 18 is ~37MB
+RAW_INFO = {
+    'id': 'abcdefghijk', 'title': 'test', 'duration': 600,
+    'extractor': 'youtube', 'extractor_key': 'Youtube', 'webpage_url': 'https://www.youtube.com/watch?v=abcdefghijk',
+    'formats': [
+        _format('18', 'avc1.42001E', 'mp4a.40.2', 360, 500),
+        _format('137', 'avc1.640028', 'none', 1080, 4000),
+        _format('140', 'none', 'mp4a.40.2', None, 128),
+    ],
+}
+
+
+class FormatFittingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.downloader = VideoDownloader()
+
+    def setUp(self):
+        self.job = DownloadJob()
+        self.addCleanup(self.job.discard)
+        # Extraction resolved to the merged best pair, as the YouTube profile's selector does
+        self.ydl = yt_dlp.YoutubeDL({'quiet': True, 'format': 'bestvideo+bestaudio'})
+        self.downloaded = []
+        self.ydl.process_info = lambda info: self.downloaded.append(
+            (info['format_id'], [f['format_id'] for f in info.get('requested_formats') or []])
+        )
+
+    def extract(self) -> dict:
+        return self.ydl.process_ie_result(dict(RAW_INFO), download=False)
+
+    def test_fresh_extraction_downloads_fitted_format(self):
+        info = self.extract()
+        self.assertEqual(info['format_id'], '137+140')
+        self.downloader._download_info(self.ydl, info, self.job, size_limit=50 * MB)
+        self.assertEqual(self.downloaded, [('18', [])])
+
+    def test_cached_info_downloads_fitted_format(self):
+        # What the metadata cache hands back: sanitized and JSON round-tripped
+        info = json.loads(json.dumps(self.ydl.sanitize_info(self.extract(), remove_private_keys=True)))
+        self.downloader._download_info(self.ydl, info, self.job, size_limit=50 * MB)
+        self.assertEqual(self.downloaded, [('18', [])])
+
+    def test_rung_format_spec_is_kept(self):
+        # The ios rung forces a progressive format; with 400MB the budget alone would pick 137+140
+        info = self.extract()
+        extractor_args, format_spec = youtube_strategy.options('ios', 'video', {})
+        pool = self.downloader.ydl_pool
+        with pool.checkout('youtube_video', self.job, format_spec=format_spec,
+                           extractor_args=extractor_args) as ydl:
+            ydl.process_info = self.ydl.process_info
+            try:
+                self.downloader._download_info(ydl, info, self.job, size_limit=400 * MB,
+                                               format_spec=format_spec)
+            finally:
+                del ydl.process_info
+        self.assertEqual(self.downloaded, [('18', [])])
+
+
+if __name__ == '__main__':
+    unittest.main()
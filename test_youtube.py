@@ -4,6 +4,7 @@ Test YouTube download functionality directly
 """
 import os
 import sys
+import asyncio
 from video_downloader import VideoDownloader
 
 # Test the specific URL that's failing
@@ -30,6 +31,9 @@ except Exception as e:
 print("\n=== Testing Audio Download ===")
 try:
     audio_file, audio_result = downloader.download_youtube(test_url, 'audio')
+    if audio_file:
+        # The sync download keeps the source container; the bot converts it like this
+        audio_file = asyncio.run(downloader.convert_to_mp3(audio_file))
     print(f"Audio result: {audio_result}")
     if audio_file:
         print(f"Audio file: {audio_file}")
@@ -0,0 +1,149 @@
+"""
+Hedged resolver for TikTok no-watermark APIs.
+
+Instead of walking the API list one by one (each with its own long timeout),
+the endpoints are queried concurrently, staggered by a short hedge delay, and
+the first valid direct link wins. Outcomes are reported to the shared
+endpoint registry, which orders endpoints by health and skips the ones whose
+circuit breaker is open.
+"""
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from http_session import build_session
+from config import TIKTOK_HEDGE_DELAY, TIKTOK_API_TIMEOUT
+from endpoint_registry import registry as default_registry
+
+logger = logging.getLogger(__name__)
+
+# Answers showing the API will not serve us even though it is up
+_UNHEALTHY_STATUS = {401, 403, 429}
+
+
+def parse_tiktok_api_response(api_url: str, json_data: dict) -> tuple[str | None, str]:
+    """Pull (video_url, title) out of a TikTok API JSON response."""
+    if "tikwm.com" in api_url:
+        data = json_data.get("data") or {}
+        return data.get("hdplay") or data.get("url"), data.get("title") or "tiktok_video"
+    return json_data.get("url") or json_data.get("nwm_url"), json_data.get("title") or "tiktok_video"
+
+
+class HedgedTikTokResolver:
+    """Race TikTok API endpoints and return the first valid no-watermark link."""
+
+    GROUP = "tiktok"
+
+    def __init__(self, endpoints: list[str], hedge_delay: float = TIKTOK_HEDGE_DELAY,
+                 timeout: float = TIKTOK_API_TIMEOUT, session: requests.Session | None = None,
+                 registry=None):
+        self.endpoints = list(endpoints)
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self.session = session or build_session()
+        self.registry = registry or default_registry
+        for endpoint in self.endpoints:
+            self.registry.register(self.GROUP, endpoint, probe=lambda endpoint=endpoint: self._probe(endpoint))
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(4, len(self.endpoints) * 8), thread_name_prefix="tiktok-api"
+        )
+
+    def ranked_endpoints(self) -> list[str]:
+        """Healthy endpoints ordered best-first by observed latency and success."""
+        return self.registry.healthy(self.GROUP)
+
+    def stats(self) -> dict[str, dict]:
+        return self.registry.scores(self.GROUP)
+
+    def _probe(self, api_url: str) -> bool:
+        """
+        Cheap reachability check used to close an open circuit.
+
+        Without a video URL most APIs answer 400/404, which still shows they
+        serve requests; 5xx, auth errors (401/403), rate limiting (429) and
+        connection errors do not.
+        """
+        try:
+            response = self.session.get(api_url, timeout=5)
+        except requests.RequestException as e:
+            logger.info(f"Probe of {api_url} failed: {e}")
+            return False
+        return response.status_code < 500 and response.status_code not in _UNHEALTHY_STATUS
+
+    def _query(self, api_url: str, url: str) -> tuple[str | None, str]:
+        """
+        Query one endpoint and record its latency/success.
+
+        Only the endpoint's own trouble counts as a failure: transport
+        errors, timeouts, 5xx, 429/401/403 and replies that cannot be parsed.
+        A parsed reply without a link (deleted or private video, bad link
+        from the user) is a success, or a few bad links would open every
+        circuit.
+        """
+        params = {"url": url, "hd": 1} if "tikwm.com" in api_url else {"url": url}
+        start = time.monotonic()
+        video_url, title = None, "tiktok_video"
+        ok = False
+        try:
+            response = self.session.get(api_url, params=params, timeout=self.timeout)
+            if response.status_code >= 500 or response.status_code in _UNHEALTHY_STATUS:
+                logger.warning(f"TikTok API {api_url} answered {response.status_code}")
+                return None, title
+            json_data = response.json() if response.ok else {}
+            video_url, title = parse_tiktok_api_response(api_url, json_data)
+            ok = True
+            return video_url, title
+        except Exception as api_error:
+            logger.warning(f"TikTok API {api_url} failed: {api_error}")
+            return None, title
+        finally:
+            self.registry.record(api_url, ok, time.monotonic() - start)
+
+    def resolve(self, url: str) -> tuple[str, str] | None:
+        """
+        Resolve a TikTok page URL to a direct no-watermark video link.
+
+        The best-ranked endpoint is queried first; every `hedge_delay` seconds
+        without a valid answer (or immediately after a failure) the next one is
+        launched as well.
+
+        Returns:
+            tuple: (video_url, title), or None if every endpoint failed
+        """
+        order = self.ranked_endpoints()
+        if not order:
+            logger.warning("No healthy TikTok API endpoints, skipping straight to yt-dlp")
+            return None
+        pending = {}
+        launched = 0
+        deadline = time.monotonic() + self.timeout
+
+        try:
+            while True:
+                if launched < len(order):
+                    api_url = order[launched]
+                    pending[self._executor.submit(self._query, api_url, url)] = api_url
+                    launched += 1
+
+                if not pending:
+                    return None
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"TikTok API race timed out for {url}")
+                    return None
+                wait_for = min(self.hedge_delay, remaining) if launched < len(order) else remaining
+                done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    api_url = pending.pop(future)
+                    video_url, title = future.result()
+                    if video_url:
+                        logger.info(f"TikTok API {api_url} won the race for {url}")
+                        return video_url, title
+        finally:
+            # Drop the losers; calls already on the wire finish in the background
+            # and still feed the endpoint registry.
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,208 @@
+"""
+URL canonicalization for supported platforms.
+
+Turns every spelling of a supported link (mobile hosts, share parameters,
+short links) into a (platform, media_id) pair. The pair is used as the key for
+every cache and deduplication feature so the same media is never fetched twice
+just because it was shared under a different URL.
+"""
+
+import re
+import threading
+import time
+import logging
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs, urlencode
+import requests
+from http_session import build_session
+from config import SHORT_LINK_CACHE_TTL, SHORT_LINK_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+# Host suffix -> platform name
+PLATFORM_HOSTS = {
+    "youtube.com": "youtube",
+    "youtu.be": "youtube",
+    "tiktok.com": "tiktok",
+    "instagram.com": "instagram",
+    "facebook.com": "facebook",
+    "fb.com": "facebook",
+    "fb.watch": "facebook",
+}
+
+# Hosts that only ever serve redirects to the real media page
+SHORT_LINK_HOSTS = ("vm.tiktok.com", "vt.tiktok.com", "fb.watch")
+
+# Query parameters that only carry share/tracking information
+TRACKING_PARAMS = ("si", "feature", "igsh", "igshid", "fbclid", "is_from_webapp",
+                   "sender_device", "_r", "_t", "mibextid", "rdid", "share_url")
+
+YOUTUBE_ID = r"[A-Za-z0-9_-]{11}"
+_YOUTUBE_PATH = re.compile(rf"^/(?:shorts|embed|live|v|e)/({YOUTUBE_ID})")
+_TIKTOK_PATH = re.compile(r"/(?:video|photo|v)/(\d+)")
+_INSTAGRAM_PATH = re.compile(r"^/(?:[\w.]+/)?(?:p|reels?|tv)/([A-Za-z0-9_-]+)")
+_FACEBOOK_PATH = re.compile(r"/(?:videos|reel|watch)/(?:[^/]+/)?(\d+)")
+
+
+def _host(url: str) -> str:
+    host = urlparse(url.strip()).netloc.lower().split(":")[0]
+    return host[4:] if host.startswith("www.") else host
+
+
+def detect_platform(url: str) -> str | None:
+    """Return the platform name for a URL, or None if it is not supported."""
+    try:
+        host = _host(url)
+    except Exception:
+        return None
+    for suffix, platform in PLATFORM_HOSTS.items():
+        if host == suffix or host.endswith("." + suffix):
+            return platform
+    return None
+
+
+def needs_resolution(url: str) -> bool:
+    """True if the URL is a short link that must be followed to find the media."""
+    try:
+        host = _host(url)
+        path = urlparse(url.strip()).path
+    except Exception:
+        return False
+    if host in SHORT_LINK_HOSTS:
+        return True
+    if host.endswith("tiktok.com") and path.startswith("/t/"):
+        return True
+    if host.endswith("facebook.com") and path.startswith("/share/"):
+        return True
+    if host.endswith("instagram.com") and path.startswith("/share/"):
+        return True
+    return False
+
+
+def _extract_media_id(platform: str, url: str) -> str | None:
+    """Pull the platform media ID out of a (non-short) URL."""
+    parsed = urlparse(url.strip())
+    host = _host(url)
+    path = parsed.path
+    query = parse_qs(parsed.query)
+
+    if platform == "youtube":
+        if host == "youtu.be":
+            candidate = path.lstrip("/").split("/")[0]
+            return candidate if re.fullmatch(YOUTUBE_ID, candidate) else None
+        if "v" in query and re.fullmatch(YOUTUBE_ID, query["v"][0]):
+            return query["v"][0]
+        match = _YOUTUBE_PATH.match(path)
+        return match.group(1) if match else None
+
+    if platform == "tiktok":
+        match = _TIKTOK_PATH.search(path)
+        return match.group(1) if match else None
+
+    if platform == "instagram":
+        match = _INSTAGRAM_PATH.match(path)
+        return match.group(1) if match else None
+
+    if platform == "facebook":
+        for param in ("v", "video_id", "story_fbid"):
+            if param in query and query[param][0].isdigit():
+                return query[param][0]
+        match = _FACEBOOK_PATH.search(path)
+        return match.group(1) if match else None
+
+    return None
+
+
+def _normalized_url(url: str) -> str:
+    """Fallback key: host + path + non-tracking query, without scheme or 'www.'."""
+    parsed = urlparse(url.strip())
+    params = [(k, v) for k, v in sorted(parse_qs(parsed.query).items())
+              if k not in TRACKING_PARAMS and not k.startswith("utm_")]
+    query = urlencode(params, doseq=True)
+    path = parsed.path.rstrip("/") or "/"
+    return f"{_host(url)}{path}" + (f"?{query}" if query else "")
+
+
+class ShortLinkResolver:
+    """Follow short-link redirects, remembering results for a TTL."""
+
+    def __init__(self, ttl: float = SHORT_LINK_CACHE_TTL, max_entries: int = SHORT_LINK_CACHE_MAX_ENTRIES,
+                 session: requests.Session | None = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.session = session or build_session()
+        self._cache: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, url: str) -> str:
+        """Return the final URL a short link redirects to (or the input on failure)."""
+        key = url.strip()
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and now - cached[1] < self.ttl:
+                self._cache.move_to_end(key)
+                return cached[0]
+
+        resolved = self._follow(key)
+        if resolved is None:
+            # Network trouble is not an answer; the next request tries again
+            return key
+
+        with self._lock:
+            self._cache[key] = (resolved, now)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return resolved
+
+    def _follow(self, url: str) -> str | None:
+        """The redirect target of `url`, or None if it could not be fetched."""
+        try:
+            response = self.session.head(url, allow_redirects=True, timeout=10)
+            if response.url and response.url != url:
+                return response.url
+            # Some hosts do not redirect HEAD requests; fall back to a streamed GET
+            with self.session.get(url, allow_redirects=True, timeout=10, stream=True) as response:
+                return response.url or url
+        except Exception as e:
+            logger.warning(f"Could not resolve short link {url}: {e}")
+            return None
+
+
+_resolver = ShortLinkResolver()
+
+
+def canonicalize(url: str, resolve: bool = True) -> tuple[str, str] | None:
+    """
+    Turn a supported URL into (platform, media_id).
+
+    Short links are followed (with cached redirects) when `resolve` is true.
+    If no media ID can be extracted, a normalized form of the URL stands in for
+    it so the result is still stable across tracking-parameter variations.
+
+    Returns:
+        tuple: (platform, media_id), or None for unsupported URLs
+    """
+    platform = detect_platform(url)
+    if not platform:
+        return None
+
+    target = url.strip()
+    if resolve and needs_resolution(target):
+        target = _resolver.resolve(target)
+        platform = detect_platform(target) or platform
+
+    media_id = _extract_media_id(platform, target)
+    if not media_id:
+        media_id = _normalized_url(target)
+    return platform, media_id
+
+
+def media_key(url: str, resolve: bool = True) -> str:
+    """Stable string key for a media URL, e.g. 'youtube:dQw4w9WgXcQ'."""
+    canonical = canonicalize(url, resolve=resolve)
+    if not canonical:
+        return _normalized_url(url)
+    platform, media_id = canonical
+    return f"{platform}:{media_id}"
@@ -11,14 +11,26 @@ import pathlib
 import tempfile
 import json
 from urllib.parse import urlparse
-from config import SUPPORTED_PLATFORMS, MAX_FILE_SIZE, TEMP_DIR
-import requests
+from config import SUPPORTED_PLATFORMS, MAX_FILE_SIZE, TEMP_DIR, TELEGRAM_UPLOAD_LIMIT
+from tiktok_resolver import HedgedTikTokResolver
+from http_session import build_session
+from ranged_downloader import RangedDownloader, FileTooLargeError
+from metadata_cache import MetadataCache
+from url_canonicalizer import media_key
+from ydl_pool import YdlPool
+from temp_janitor import janitor
+from media_encoder import encode_to_size, encode_mp3, prepare_for_telegram, choose_shrink_mode, split_to_parts
+from format_budget import select_format_within
+from retry_policy import RetryBudget, RetryPolicy, TransientError, is_retryable, DOWNLOAD_RETRY
+from youtube_strategy import strategy as youtube_strategy
 import time
-import subprocess
 import re
 
 logger = logging.getLogger(__name__)
 
+# Bitrate of the MP3s audio downloads are converted to
+MP3_KBPS = 192
+
 # ---- Decode cookie env vars into temp files (Railway safe method) ----
 for env_var, out_name in (('IG_COOKIES_B64', 'instagram.txt'), ('FB_COOKIES_B64', 'facebook.txt')):
     b64_data = os.getenv(env_var)
@@ -34,14 +46,74 @@ for env_var, out_name in (('IG_COOKIES_B64', 'instagram.txt'), ('FB_COOKIES_B64'
             logger.error(f"Failed to decode {env_var}: {e}")
 # --------------------------------------------------------------------
 import re  # used for sanitising filenames
+import shutil
+import threading
+from types import SimpleNamespace
+
+class DownloadJob:
+    """
+    Private working directory for one download.
+
+    Every job writes into its own directory under TEMP_DIR, and the final
+    output path is taken from yt-dlp's post-processor hooks, so concurrent
+    jobs can never pick up each other's files.
+    """
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix='job_', dir=TEMP_DIR)
+        # Keep the janitor away from this directory until the job is done with it
+        janitor.claim(self.dir)
+        self.output_path = None
+        # Extractor runs avoided by downloading from an already extracted info dict
+        self.extractions_saved = 0
+        # Metadata cache key the current info dict was served from, if any
+        self.cached_info_key = None
+        # Retries and time shared by every retry loop of this job
+        self.retry_budget = RetryBudget()
+
+    def hook(self, d):
+        """yt-dlp post-processor hook: remember where the final file ended up."""
+        if d.get('status') == 'finished':
+            filepath = (d.get('info_dict') or {}).get('filepath')
+            if filepath:
+                self.output_path = filepath
+
+    def outtmpl(self) -> str:
+        """Default yt-dlp output template inside this job's directory."""
+        return os.path.join(self.dir, '%(title).80B.%(ext)s')
+
+    def output(self) -> str | None:
+        """Path of the finished download, or None if nothing was produced."""
+        if self.output_path and os.path.exists(self.output_path):
+            return self.output_path
+        # The directory only ever holds this job's files, so the largest
+        # finished file is the output even if the hook did not fire.
+        try:
+            files = [os.path.join(self.dir, f) for f in os.listdir(self.dir)
+                     if not f.endswith(('.part', '.ytdl', '.temp'))]
+        except OSError:
+            return None
+        return max(files, key=os.path.getsize) if files else None
+
+    def discard(self):
+        """Remove the job directory and everything in it."""
+        shutil.rmtree(self.dir, ignore_errors=True)
+        janitor.release(self.dir)
 
 class VideoDownloader:
     def __init__(self):
         """Initialize with persistent session support."""
         os.makedirs(TEMP_DIR, exist_ok=True)
         
+        # Keep-alive connection pool shared by every direct HTTP fetch
+        self.session = build_session()
+        self.ranged_downloader = RangedDownloader(self.session)
+        
         # Persistent session file
         self.session_file = os.path.join(TEMP_DIR, 'instagram_session.json')
+        janitor.pin(self.session_file)
+        # Temp cleanup runs in the background, never on the request path
+        janitor.start()
         
         # Enhanced Instagram cookie handling
         self.cookies_instagram = self._validate_cookies(
@@ -64,11 +136,7 @@ class VideoDownloader:
             'http_headers': {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
                 'Referer': 'https://www.instagram.com/'
-            },
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4'
-            }]
+            }
         }
         
         # Instagram specific options
@@ -91,11 +159,7 @@ class VideoDownloader:
                 'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
                 'Accept-Language': 'en-US,en;q=0.5',
                 'Accept-Encoding': 'gzip, deflate, br'
-            },
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4'
-            }]
+            }
         }
         
         # TikTok watermark-removal APIs (tried in order – these all return **non-watermarked** links)
@@ -105,6 +169,91 @@ class VideoDownloader:
             "https://api.dd01.ru/api/tiktok"   # GET ?url=<video_url>        → json.url
         ]
         
+        # YouTube 1080p video options, with age-restriction bypass
+        self.youtube_video_opts = {
+            'format': '(bestvideo[height<=1080]+bestaudio/best[height<=1080])[filesize<45M]/best[height<=720][filesize<45M]/best[filesize<45M]/best',
+            'merge_output_format': 'mp4',
+            'prefer_ffmpeg': True,
+            'writeinfojson': False,
+            'writethumbnail': False,
+            'extractor_retries': 5,
+            'fragment_retries': 5,
+            'retry_sleep_functions': {'http': lambda n: min(4 ** n, 100)},
+            'age_limit': 99,  # Bypass age restrictions
+            'geo_bypass': True,  # Bypass geo-restrictions
+            'geo_bypass_country': 'US',  # Use US geo-bypass
+            'http_headers': {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+                'Accept-Language': 'en-us,en;q=0.5',
+                'Accept-Encoding': 'gzip,deflate',
+                'DNT': '1',
+                'Connection': 'keep-alive',
+                'Upgrade-Insecure-Requests': '1'
+            },
+            'extractor_args': {
+                'youtube': {
+                    'skip': ['dash', 'hls'],
+                    'player_client': ['android', 'web'],
+                    'player_skip': ['configs']
+                }
+            }
+        }
+        
+        # YouTube audio options, with age-restriction bypass. The MP3 conversion
+        # runs after the download (convert_to_mp3) so long tracks use every core.
+        self.youtube_audio_opts = {
+            'format': 'bestaudio/best',
+            'writeinfojson': False,
+            'writethumbnail': False,
+            'prefer_ffmpeg': True,
+            'extractor_retries': 5,
+            'fragment_retries': 5,
+            'retry_sleep_functions': {'http': lambda n: min(4 ** n, 100)},
+            'age_limit': 99,  # Bypass age restrictions
+            'geo_bypass': True,  # Bypass geo-restrictions
+            'geo_bypass_country': 'US',  # Use US geo-bypass
+            'ignoreerrors': False,
+            'http_headers': {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+                'Accept-Language': 'en-us,en;q=0.5',
+                'Accept-Encoding': 'gzip,deflate',
+                'DNT': '1',
+                'Connection': 'keep-alive',
+                'Upgrade-Insecure-Requests': '1'
+            },
+            'extractor_args': {
+                'youtube': {
+                    'skip': ['dash', 'hls'],
+                    'player_client': ['android', 'web'],
+                    'player_skip': ['configs']
+                }
+            }
+        }
+        
+        # Warm, reusable YoutubeDL instances per platform profile
+        self.ydl_pool = YdlPool({
+            'generic': self.ydl_opts,
+            'facebook': {**self.ydl_opts, 'cookiefile': self.cookies_facebook} if self.cookies_facebook else self.ydl_opts,
+            'instagram': {**self.ydl_opts, **self.instagram_opts},
+            'tiktok': {**self.ydl_opts, **self.tiktok_opts, 'extractor_args': {}},
+            'youtube_video': self.youtube_video_opts,
+            'youtube_audio': self.youtube_audio_opts,
+        })
+        
+        # Extraction results shared across jobs until their signed URLs expire
+        self.metadata_cache = MetadataCache()
+        
+        # Jobs finished, extractor runs saved by downloading from extracted info,
+        # and ffmpeg work saved by stream-copying compatible media
+        self.stats = {'jobs': 0, 'extractions_saved': 0,
+                      'transcodes': 0, 'transcodes_avoided': 0, 'cpu_seconds_saved': 0.0}
+        self._stats_lock = threading.Lock()
+        
+        # Races the APIs above and learns which one answers fastest
+        self.tiktok_resolver = HedgedTikTokResolver(self.tiktok_apis, session=self.session)
+        
     def _validate_cookies(self, *cookie_paths):
         """Validate and return first working cookie file with all required fields."""
         required_fields = ['sessionid', 'ds_user_id', 'csrftoken']
@@ -203,6 +352,7 @@ class VideoDownloader:
         """Setup Instagram authentication using browser cookie extraction."""
         try:
             cookies_path = os.path.join(TEMP_DIR, 'instagram_cookies.txt')
+            janitor.pin(cookies_path)
             
             # Try to extract Instagram cookies from browser
             if self._try_extract_instagram_cookies(cookies_path):
@@ -271,166 +421,213 @@ class VideoDownloader:
             logger.error(f"Error parsing URL {url}: {e}")
             return False
     
-    def _download_instagram_video(self, url: str) -> tuple[str | None, str]:
+    def _download_with_profile(self, url: str, profile: str, job: DownloadJob,
+                               default_title: str) -> tuple[str, str]:
+        """
+        One extract-and-download attempt with a pooled YoutubeDL profile.
+
+        Returns:
+            tuple: (file_path, title); raises TransientError if nothing was produced
+        """
+        with self.ydl_pool.checkout(profile, job) as ydl:
+            info = self._extract_info(ydl, url, profile, job)
+            if not info:
+                raise TransientError("no video information extracted")
+            self._download_info(ydl, info, job)
+            downloaded_file = job.output()
+            if not downloaded_file:
+                raise TransientError("downloaded file not found")
+            return downloaded_file, info.get('title', default_title)
+
+    def _download_instagram_video(self, url: str, job: DownloadJob) -> tuple[str | None, str]:
         """Enhanced Instagram downloader with better cookie handling."""
         try:
             if not self.cookies_instagram:
                 return None, "instagram_auth_required"
-                
-            ydl_opts = {**self.ydl_opts, **self.instagram_opts}
             
-            # Try with cookies first
-            for attempt in range(3):
-                try:
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        info = ydl.extract_info(url, download=False)
-                        if not info:
-                            continue
-                            
-                        ydl.download([url])
-                        title = info.get('title', 'instagram_video')
-                        downloaded_file = self._find_downloaded_file(title)
-                        
-                        if downloaded_file and os.path.exists(downloaded_file):
-                            return downloaded_file, title
-                except Exception as e:
-                    logger.warning(f"Instagram download attempt {attempt + 1} failed: {e}")
-                    if attempt == 2:
-                        raise
-                    time.sleep(1)
-                    
-            return None, "instagram_download_failed"
+            return DOWNLOAD_RETRY.call(self._download_with_profile, url, 'instagram', job, 'instagram_video',
+                                       budget=job.retry_budget, label="Instagram download")
             
         except Exception as e:
             logger.error(f"Instagram download error: {e}")
             return None, "instagram_download_failed"
             
-    def _download_tiktok_video(self, url: str) -> tuple[str | None, str]:
-        """TikTok downloader with multiple watermark removal options."""
+    def _download_tiktok_video(self, url: str, job: DownloadJob,
+                               resolve_direct: bool = True) -> tuple[str | None, str]:
+        """
+        TikTok downloader with multiple watermark removal options.
+
+        `resolve_direct` False skips the no-watermark APIs, for callers
+        that already asked them in vain (resolve_direct_url).
+        """
         try:
             # --------------------------------------------------
-            # 1. Try public API services that return NO-WATERMARK links
+            # 1. Race public API services that return NO-WATERMARK links
             # --------------------------------------------------
-            for api_url in self.tiktok_apis:
-                try:
-                    if "tikwm.com" in api_url:
-                        # tikwm expects GET params, not payload
-                        response = requests.get(f"{api_url}?url={url}&hd=1", timeout=20)
-                        data = response.json().get("data", {}) if response.ok else {}
-                        video_url = data.get("hdplay") or data.get("url")
-                        title = data.get("title") or "tiktok_video"
-                    else:
-                        response = requests.get(f"{api_url}?url={url}", timeout=20)
-                        json_data = response.json() if response.ok else {}
-                        video_url = json_data.get("url") or json_data.get("nwm_url")
-                        title = json_data.get("title") or "tiktok_video"
-                        
-                    if video_url:
-                        return self._download_from_url(video_url, title)
-                except Exception as api_error:
-                    logger.warning(f"TikTok API {api_url} failed: {api_error}")
+            resolved = self.tiktok_resolver.resolve(url) if resolve_direct else None
+            if resolved:
+                video_url, title = resolved
+                return self._download_from_url(video_url, title, job)
             
             # Fallback to yt-dlp with enhanced options
-            ydl_opts = {
-                **self.ydl_opts,
-                **self.tiktok_opts,
-                'extractor_args': {}
-            }
-            
-            for attempt in range(3):
-                try:
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        info = ydl.extract_info(url, download=False)
-                        if not info:
-                            continue
-                            
-                        ydl.download([url])
-                        title = info.get('title', 'tiktok_video')
-                        downloaded_file = self._find_downloaded_file(title)
-                        
-                        if downloaded_file and os.path.exists(downloaded_file):
-                            return downloaded_file, title
-                except Exception as e:
-                    logger.warning(f"TikTok download attempt {attempt + 1} failed: {e}")
-                    if attempt == 2:
-                        raise
-                    time.sleep(1)
-                    
-            return None, "tiktok_download_failed"
+            return DOWNLOAD_RETRY.call(self._download_with_profile, url, 'tiktok', job, 'tiktok_video',
+                                       budget=job.retry_budget, label="TikTok download")
             
         except Exception as e:
             logger.error(f"TikTok download error: {e}")
             return None, "tiktok_download_failed"
     
-    def _try_download(self, url: str, opts: dict) -> tuple[str | None, str]:
-        """Try downloading video with given options."""
+    def resolve_direct_url(self, url: str) -> tuple[str, str] | None:
+        """
+        Resolve a link to a direct media URL without downloading it.
+
+        Only TikTok links are resolvable (through the no-watermark APIs).
+
+        Returns:
+            tuple: (video_url, title), or None if no direct link is available
+        """
+        if 'tiktok.com' not in url:
+            return None
+        return self.tiktok_resolver.resolve(url)
+
+    def download_direct_url(self, video_url: str, title: str) -> tuple[str | None, str]:
+        """Download an already resolved direct media URL to TEMP_DIR."""
+        job = DownloadJob()
+        file_path, result = self._download_from_url(video_url, title, job)
+        return self._finish_job(job, file_path, result)
+    
+    def _extract_info(self, ydl, url: str, profile: str, job: DownloadJob) -> dict | None:
+        """
+        extract_info(download=False) through the metadata cache.
+
+        Args:
+            profile (str): Extractor configuration name; entries are only
+                shared between jobs that would extract the same formats
+        """
+        job.cached_info_key = None
+        # Cookie-authenticated results are account specific; never persist them
+        if ydl.params.get('cookiefile'):
+            return ydl.extract_info(url, download=False)
+        
+        cache_key = f"{media_key(url)}|{profile}"
+        info = self.metadata_cache.get(cache_key)
+        if info is not None:
+            logger.info(f"Metadata cache hit for {cache_key} ({self.metadata_cache.stats})")
+            job.cached_info_key = cache_key
+            return info
+        
+        info = ydl.extract_info(url, download=False)
+        # Playlists lose their entries when sanitized, so only single videos are cached
+        if info and info.get('_type', 'video') == 'video':
+            self.metadata_cache.put(cache_key, info)
+        return info
+    
+    def _download_info(self, ydl, info: dict, job: DownloadJob, audio_only: bool = False,
+                       size_limit: int | None = TELEGRAM_UPLOAD_LIMIT, format_spec: str | None = None):
+        """
+        Download from an info dict returned by extract_info(download=False).
+
+        ydl.download([url]) would run the whole extractor (page and API
+        requests) a second time; processing the existing result with
+        download=True reuses it, the same way yt-dlp's --load-info-json does.
+        The profile's default selector is replaced by formats that fit
+        `size_limit`; None keeps it (e.g. full quality to be split). An
+        explicit `format_spec` the instance was checked out with is kept too.
+        Audio is converted to MP3 afterwards, so it is sized at MP3_KBPS.
+        """
+        spec = None
+        if size_limit and not format_spec:
+            spec = select_format_within(info, size_limit, audio_only=audio_only,
+                                        audio_kbps=MP3_KBPS if audio_only else None)
+        if spec:
+            # The pool restores the profile's own selector when the instance is returned
+            ydl.format_selector = ydl.build_format_selector(spec)
+        if info.get('_type', 'video') == 'video':
+            # A fresh result still carries the first selection at its top level, and a
+            # merged pair's requested_formats would survive selecting a single file.
+            # Playlists would lose their entries.
+            info = ydl.sanitize_info(info, remove_private_keys=True)
         try:
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                if not info:
-                    return None, "extract_failed"
-                
-                title = info.get('title', 'video')
-                
-                # Check if file size is available and within limits
-                filesize = info.get('filesize') or info.get('filesize_approx')
-                if filesize and filesize > MAX_FILE_SIZE:
-                    return None, "file_too_large"
-                
-                # Download the video
-                ydl.download([url])
-                
-                # Find the downloaded file
-                downloaded_file = self._find_downloaded_file(title)
-                
-                if downloaded_file and os.path.exists(downloaded_file):
-                    # Check actual file size
-                    if os.path.getsize(downloaded_file) > MAX_FILE_SIZE:
-                        os.remove(downloaded_file)
-                        return None, "file_too_large"
-                    
-                    return downloaded_file, title
-                else:
-                    return None, "download_failed"
-                    
-        except yt_dlp.DownloadError as e:
-            logger.error(f"yt-dlp download error: {e}")
-            return None, "download_failed"
-        except Exception as e:
-            logger.error(f"Unexpected error downloading {url}: {e}")
-            return None, "download_failed"
+            ydl.process_ie_result(info, download=True)
+        except Exception:
+            # A cached entry whose URLs stopped working must not be served again
+            if job.cached_info_key:
+                self.metadata_cache.invalidate(job.cached_info_key)
+                job.cached_info_key = None
+            raise
+        job.extractions_saved += 1
+    
+    def _finish_job(self, job: DownloadJob, file_path: str | None, result: str) -> tuple[str | None, str]:
+        """Drop the job directory of a failed job and record extraction savings."""
+        if not file_path:
+            job.discard()
+        with self._stats_lock:
+            self.stats['jobs'] += 1
+            self.stats['extractions_saved'] += job.extractions_saved
+        if job.extractions_saved:
+            logger.info(f"Job saved {job.extractions_saved} extractor request(s) "
+                        f"({self.stats['extractions_saved']} over {self.stats['jobs']} jobs)")
+        return file_path, result
+    
+    async def prepare_output(self, file_path: str) -> str:
+        """
+        Turn a finished download into a faststart MP4, stream-copying when the
+        codecs are already Telegram-compatible.
+        
+        Returns:
+            str: Path of the file to upload
+        """
+        file_path, report = await prepare_for_telegram(file_path)
+        if report['action'] in ('skipped', 'failed'):
+            return file_path
+        with self._stats_lock:
+            if report['action'] == 'transcode':
+                self.stats['transcodes'] += 1
+            else:
+                self.stats['transcodes_avoided'] += 1
+                self.stats['cpu_seconds_saved'] += report['cpu_seconds_saved']
+            logger.info(f"Transcodes avoided: {self.stats['transcodes_avoided']} "
+                        f"(~{self.stats['cpu_seconds_saved']:.0f}s CPU saved), "
+                        f"transcodes run: {self.stats['transcodes']}")
+        return file_path
     
-    def download_video(self, url: str) -> tuple[str | None, str]:
+    def download_video(self, url: str, resolve_direct: bool = True) -> tuple[str | None, str]:
         """
         Download video from the given URL.
         
+        Args:
+            resolve_direct (bool): False skips the TikTok no-watermark APIs
+                and goes straight to yt-dlp
+        
         Returns:
             tuple: (file_path, title) if successful, (None, error_message) if failed
         """
+        if not self.is_supported_platform(url):
+            return None, "unsupported_platform"
+        
+        # Each download gets a private directory; drop it if nothing usable came out
+        job = DownloadJob()
+        file_path, result = self._download_video_job(url, job, resolve_direct)
+        return self._finish_job(job, file_path, result)
+    
+    def _download_video_job(self, url: str, job: DownloadJob,
+                            resolve_direct: bool = True) -> tuple[str | None, str]:
+        """Download a video into the job's directory."""
         try:
-            if not self.is_supported_platform(url):
-                return None, "unsupported_platform"
-            
-            # Clean up any existing files in temp directory
-            self._cleanup_temp_files()
-            
             # Try Instagram-specific approach if it's an Instagram URL
             if 'instagram.com' in url:
-                return self._download_instagram_video(url)
+                return self._download_instagram_video(url, job)
             
             # Try TikTok-specific approach if it's a TikTok URL
             if 'tiktok.com' in url:
-                return self._download_tiktok_video(url)
-            
-            # Clone options so we don't mutate the shared dict
-            ydl_opts = self.ydl_opts.copy()
+                return self._download_tiktok_video(url, job, resolve_direct)
             
-            if any(site in url for site in ("facebook.com", "fb.com")) and self.cookies_facebook:
-                ydl_opts["cookiefile"] = self.cookies_facebook
+            # Facebook links get the profile that carries the Facebook cookies
+            profile = 'facebook' if any(site in url for site in ("facebook.com", "fb.com")) else 'generic'
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with self.ydl_pool.checkout(profile, job) as ydl:
                 # Extract info first to get title and check file size
-                info = ydl.extract_info(url, download=False)
+                info = self._extract_info(ydl, url, profile, job)
                 
                 if not info:
                     return None, "extract_failed"
@@ -442,21 +639,27 @@ class VideoDownloader:
                 if filesize and filesize > MAX_FILE_SIZE:
                     return None, "file_too_large"
                 
-                # Download the video with retries
-                for attempt in range(3):
-                    try:
-                        ydl.download([url])
-                        break
-                    except Exception as e:
-                        if attempt == 2:
-                            raise
-                        logger.warning(f"Attempt {attempt + 1} failed: {e}")
-                        time.sleep(1)
+                # Download the video from the extracted info, with retries
+                from_cache = False
+                
+                def download_once():
+                    nonlocal from_cache
+                    from_cache = job.cached_info_key is not None
+                    self._download_info(ydl, info, job)
+                
+                def refresh(error):
+                    nonlocal info
+                    if from_cache:
+                        # The cached URLs were rejected; retry with a fresh extraction
+                        info = self._extract_info(ydl, url, profile, job) or info
+                
+                DOWNLOAD_RETRY.call(download_once, budget=job.retry_budget, label="Download",
+                                    on_retry=refresh)
                 
                 # Find the downloaded file
-                downloaded_file = self._find_downloaded_file(title)
+                downloaded_file = job.output()
                 
-                if downloaded_file and os.path.exists(downloaded_file):
+                if downloaded_file:
                     # Check actual file size
                     if os.path.getsize(downloaded_file) > MAX_FILE_SIZE:
                         os.remove(downloaded_file)
@@ -473,28 +676,25 @@ class VideoDownloader:
             logger.error(f"Unexpected error downloading {url}: {e}")
             return None, "download_failed"
     
-    def _download_from_url(self, video_url: str, title: str) -> tuple[str | None, str]:
-        """Download the file at `video_url` directly to TEMP_DIR.
+    def _download_from_url(self, video_url: str, title: str, job: DownloadJob) -> tuple[str | None, str]:
+        """Download the file at `video_url` directly into the job directory.
 
         This helper is primarily used for TikTok APIs that already expose a
-        non-watermarked direct link. It streams the content to disk so that
-        even large files do not exhaust memory.
+        non-watermarked direct link. Large files are fetched over several
+        ranged connections; the content always streams to disk so that even
+        large files do not exhaust memory.
         """
         try:
             # Sanitise title for filesystem
             safe_title = re.sub(r"[^\w\- ]", "", title)[:50] or "tiktok_video"
-            dst = os.path.join(TEMP_DIR, f"{safe_title}_{int(time.time())}.mp4")
-            with requests.get(video_url, stream=True, timeout=30) as r:
-                r.raise_for_status()
-                with open(dst, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-            # Enforce file-size limit
-            if os.path.getsize(dst) > MAX_FILE_SIZE:
-                os.remove(dst)
-                return None, "file_too_large"
+            dst = os.path.join(job.dir, f"{safe_title}.mp4")
+            self.ranged_downloader.download(video_url, dst, max_size=MAX_FILE_SIZE)
             return dst, safe_title
+        except FileTooLargeError as e:
+            logger.warning(f"Direct download too large: {e}")
+            if os.path.exists(dst):
+                os.remove(dst)
+            return None, "file_too_large"
         except Exception as e:
             logger.error(f"Direct download failed: {e}")
             # Clean up partial file
@@ -505,299 +705,243 @@ class VideoDownloader:
                 pass
             return None, "download_failed"
 
-    def _find_downloaded_file(self, title: str) -> str | None:
-        """Find the downloaded file in the temp directory."""
+    async def convert_to_mp3(self, file_path: str, kbps: int = MP3_KBPS) -> str | None:
+        """
+        Convert a downloaded audio track to MP3, in parallel segments when it is long.
+        
+        Returns:
+            str: Path of the MP3 (the input is removed), or None if conversion failed
+        """
+        if file_path.endswith('.mp3'):
+            return file_path
         try:
-            for file in os.listdir(TEMP_DIR):
-                if file.startswith(title[:20]):  # Match first 20 chars of title
-                    return os.path.join(TEMP_DIR, file)
-            
-            # If title-based search fails, get the newest file
-            files = [os.path.join(TEMP_DIR, f) for f in os.listdir(TEMP_DIR) if os.path.isfile(os.path.join(TEMP_DIR, f))]
-            if files:
-                return max(files, key=os.path.getctime)
-            
-            return None
+            output_path, report = await encode_mp3(file_path, os.path.splitext(file_path)[0] + '.mp3', kbps)
+            if not output_path:
+                logger.error(f"MP3 conversion failed: {report}")
+                return None
+            os.remove(file_path)
+            return output_path
         except Exception as e:
-            logger.error(f"Error finding downloaded file: {e}")
+            logger.error(f"Error converting to MP3: {e}")
             return None
     
-    def download_youtube(self, url: str, format_type: str) -> tuple[str | None, str]:
+    def download_youtube(self, url: str, format_type: str,
+                         size_limit: int | None = TELEGRAM_UPLOAD_LIMIT) -> tuple[str | None, str]:
         """
         Download YouTube video or audio with specific quality options.
         
         Args:
             url (str): YouTube URL
-            format_type (str): 'video' for 1080p video, 'audio' for MP3
+            format_type (str): 'video' for 1080p video, 'audio' for the best
+                audio stream in its own container (m4a/webm); convert_to_mp3
+                turns it into MP3, as AsyncVideoDownloader.download_youtube does
+            size_limit (int): Pick the best format estimated to fit this many
+                bytes; None downloads the profile's full quality (split mode)
             
         Returns:
             tuple[str, str]: (file_path, result_message)
         """
+        job = DownloadJob()
+        file_path, result = self._download_youtube_job(url, format_type, job, size_limit)
+        return self._finish_job(job, file_path, result)
+    
+    def _extract_youtube(self, url: str, format_type: str, profile: str, rung: str,
+                         job: DownloadJob) -> tuple[dict, str | None, float]:
+        """
+        Extract a video's info with one player client rung.
+        
+        Safe to run for several rungs of the same job at once (hedging).
+        
+        Returns:
+            tuple: (info, metadata cache key it came from or None, seconds taken);
+            raises TransientError if nothing was extracted
+        """
+        base_opts = self.youtube_video_opts if format_type == 'video' else self.youtube_audio_opts
+        extractor_args, format_spec = youtube_strategy.options(rung, format_type, base_opts['extractor_args'])
+        # Player clients change the formats returned, so they are part of the cache key
+        clients = ','.join(extractor_args['youtube']['player_client'])
+        # Hedged extractions must not overwrite each other's cache key on the shared job
+        extraction = SimpleNamespace(cached_info_key=None)
+        start = time.monotonic()
+        try:
+            with self.ydl_pool.checkout(profile, job, format_spec=format_spec,
+                                        extractor_args=extractor_args) as ydl:
+                info = self._extract_info(ydl, url, f"youtube:{clients}", extraction)
+            if not info:
+                raise TransientError("failed to extract video information")
+        except Exception as e:
+            # Private or removed videos fail with every client; only count client failures
+            if is_retryable(e):
+                youtube_strategy.record(format_type, rung, False, time.monotonic() - start)
+            raise
+        return info, extraction.cached_info_key, time.monotonic() - start
+    
+    def _youtube_attempt(self, url: str, format_type: str, profile: str, rung: str, job: DownloadJob,
+                         extracted: tuple[dict, str | None, float] | None = None,
+                         size_limit: int | None = TELEGRAM_UPLOAD_LIMIT) -> tuple[str | None, str]:
+        """
+        One YouTube download with the player clients of `rung`.
+        
+        Args:
+            extracted: Result of _extract_youtube for this rung if it already ran
+        
+        Returns:
+            tuple: (file_path, "Success"), or (None, message) for a file that
+            is too large; raises TransientError if nothing was produced
+        """
+        info, job.cached_info_key, extract_seconds = (
+            extracted or self._extract_youtube(url, format_type, profile, rung, job)
+        )
+        base_opts = self.youtube_video_opts if format_type == 'video' else self.youtube_audio_opts
+        extractor_args, format_spec = youtube_strategy.options(rung, format_type, base_opts['extractor_args'])
+        
+        try:
+            # Writes into the job directory; the post-processor hook reports the final path
+            with self.ydl_pool.checkout(profile, job, format_spec=format_spec,
+                                        extractor_args=extractor_args) as ydl:
+                # Sanitize title for filename
+                title = re.sub(r'[^\w\s-]', '', info.get('title', 'youtube_video')).strip().replace(' ', '_')[:50]
+                
+                # Name the output after the sanitized title, then download
+                # from the info we already have instead of a second YoutubeDL
+                ydl.params['outtmpl']['default'] = os.path.join(job.dir, f"{title}.%(ext)s")
+                self._download_info(ydl, info, job, audio_only=format_type == 'audio', size_limit=size_limit,
+                                    format_spec=format_spec)
+                
+                actual_file = job.output()
+                if not actual_file:
+                    raise TransientError(f"downloaded file not found for {format_type}")
+        except Exception as e:
+            if is_retryable(e):
+                youtube_strategy.record(format_type, rung, False, extract_seconds)
+            raise
+        youtube_strategy.record(format_type, rung, True, extract_seconds)
+        
+        # Check file size
+        file_size = os.path.getsize(actual_file)
+        if file_size > MAX_FILE_SIZE:
+            self.cleanup_file(actual_file)
+            return None, f"File too large: {file_size / (1024*1024):.1f}MB (max: {MAX_FILE_SIZE / (1024*1024):.1f}MB)"
+        
+        logger.info(f"YouTube {format_type} downloaded successfully with client '{rung}': "
+                    f"{actual_file} ({file_size} bytes)")
+        return actual_file, "Success"
+    
+    def _download_youtube_job(self, url: str, format_type: str, job: DownloadJob,
+                              size_limit: int | None = TELEGRAM_UPLOAD_LIMIT) -> tuple[str | None, str]:
+        """
+        Try player client rungs inside the job's directory, best-scoring first,
+        until one works.
+        """
         try:
             logger.info(f"Starting YouTube {format_type} download for URL: {url}")
             
-            # Configure options based on format type
-            if format_type == 'video':
-                # Enhanced format selection with age-restriction bypass
-                ydl_opts = {
-                    'format': '(bestvideo[height<=1080]+bestaudio/best[height<=1080])[filesize<45M]/best[height<=720][filesize<45M]/best[filesize<45M]/best',
-                    'outtmpl': os.path.join(TEMP_DIR, '%(title)s.%(ext)s'),
-                    'merge_output_format': 'mp4',
-                    'postprocessors': [{
-                        'key': 'FFmpegVideoConvertor',
-                        'preferedformat': 'mp4'
-                    }],
-                    'prefer_ffmpeg': True,
-                    'writeinfojson': False,
-                    'writethumbnail': False,
-                    'extractor_retries': 5,
-                    'fragment_retries': 5,
-                    'retry_sleep_functions': {'http': lambda n: min(4 ** n, 100)},
-                    'age_limit': 99,  # Bypass age restrictions
-                    'geo_bypass': True,  # Bypass geo-restrictions
-                    'geo_bypass_country': 'US',  # Use US geo-bypass
-                    'http_headers': {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                        'Accept-Language': 'en-us,en;q=0.5',
-                        'Accept-Encoding': 'gzip,deflate',
-                        'DNT': '1',
-                        'Connection': 'keep-alive',
-                        'Upgrade-Insecure-Requests': '1'
-                    },
-                    'extractor_args': {
-                        'youtube': {
-                            'skip': ['dash', 'hls'],
-                            'player_client': ['android', 'web'],
-                            'player_skip': ['configs']
-                        }
-                    }
-                }
-            else:  # audio format
-                # Enhanced audio extraction with age-restriction bypass
-                ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'outtmpl': os.path.join(TEMP_DIR, '%(title)s.%(ext)s'),
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                    'writeinfojson': False,
-                    'writethumbnail': False,
-                    'prefer_ffmpeg': True,
-                    'extractor_retries': 5,
-                    'fragment_retries': 5,
-                    'retry_sleep_functions': {'http': lambda n: min(4 ** n, 100)},
-                    'age_limit': 99,  # Bypass age restrictions
-                    'geo_bypass': True,  # Bypass geo-restrictions
-                    'geo_bypass_country': 'US',  # Use US geo-bypass
-                    'ignoreerrors': False,
-                    'http_headers': {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                        'Accept-Language': 'en-us,en;q=0.5',
-                        'Accept-Encoding': 'gzip,deflate',
-                        'DNT': '1',
-                        'Connection': 'keep-alive',
-                        'Upgrade-Insecure-Requests': '1'
-                    },
-                    'extractor_args': {
-                        'youtube': {
-                            'skip': ['dash', 'hls'],
-                            'player_client': ['android', 'web'],
-                            'player_skip': ['configs']
-                        }
-                    }
-                }
+            # Options come from the pooled 'youtube_video'/'youtube_audio' profiles
+            profile = 'youtube_video' if format_type == 'video' else 'youtube_audio'
+            order = youtube_strategy.ranked(format_type)
+            extracted = {}
             
-            # Try multiple approaches for age-restricted content
-            for attempt in range(1, 4):
+            if youtube_strategy.hedge and len(order) > 1:
                 try:
-                    logger.info(f"YouTube download attempt {attempt}/3")
-                    
-                    # Modify options for each attempt
-                    current_opts = ydl_opts.copy()
-                    
-                    if attempt == 2:
-                        # Second attempt: Use different player client
-                        current_opts['extractor_args'] = {
-                            'youtube': {
-                                'player_client': ['android_music', 'android'],
-                                'player_skip': ['webpage', 'configs']
-                            }
-                        }
-                    elif attempt == 3:
-                        # Third attempt: Use iOS client and different format
-                        current_opts['extractor_args'] = {
-                            'youtube': {
-                                'player_client': ['ios', 'android_creator'],
-                                'player_skip': ['webpage', 'configs', 'js']
-                            }
-                        }
-                        # More flexible format selection for difficult videos
-                        if format_type == 'video':
-                            current_opts['format'] = 'best[height<=720]/best[height<=480]/best'
-                        else:
-                            current_opts['format'] = 'bestaudio/worst'
-                    
-                    with yt_dlp.YoutubeDL(current_opts) as ydl:
-                        # Get video info first
-                        info = ydl.extract_info(url, download=False)
-                        if not info:
-                            if attempt == 3:
-                                return None, "Failed to extract video information after all attempts"
-                            continue
-                        
-                        # Sanitize title for filename
-                        title = re.sub(r'[^\w\s-]', '', info.get('title', 'youtube_video')).strip().replace(' ', '_')[:50]
-                        
-                        # Update output template with sanitized title
-                        if format_type == 'audio':
-                            filename = f"{title}.mp3"
-                        else:
-                            filename = f"{title}.mp4"
-                        
-                        file_path = os.path.join(TEMP_DIR, filename)
-                        current_opts['outtmpl'] = file_path.replace(f".{filename.split('.')[-1]}", ".%(ext)s")
-                        
-                        # Download the video/audio
-                        with yt_dlp.YoutubeDL(current_opts) as ydl_download:
-                            ydl_download.download([url])
-                        
-                        # Find the actual downloaded file with better search
-                        actual_file = None
-                        
-                        # First, look for files with the exact title
-                        for ext in ['mp4', 'mp3', 'webm', 'm4a', 'mkv']:
-                            test_path = file_path.replace(f".{filename.split('.')[-1]}", f".{ext}")
-                            if os.path.exists(test_path):
-                                actual_file = test_path
-                                break
-                        
-                        # If not found, search for any recent file in temp directory
-                        if not actual_file:
-                            try:
-                                temp_files = [f for f in os.listdir(TEMP_DIR) if f.lower().endswith(('.mp4', '.mp3', '.webm', '.m4a', '.mkv'))]
-                                if temp_files:
-                                    # Get the most recent file
-                                    temp_files.sort(key=lambda x: os.path.getctime(os.path.join(TEMP_DIR, x)), reverse=True)
-                                    actual_file = os.path.join(TEMP_DIR, temp_files[0])
-                                    logger.info(f"Found downloaded file by timestamp: {actual_file}")
-                            except Exception as e:
-                                logger.error(f"Error searching for downloaded file: {e}")
-                        
-                        if actual_file and os.path.exists(actual_file):
-                            # Check file size
-                            file_size = os.path.getsize(actual_file)
-                            if file_size > MAX_FILE_SIZE:
-                                self.cleanup_file(actual_file)
-                                return None, f"File too large: {file_size / (1024*1024):.1f}MB (max: {MAX_FILE_SIZE / (1024*1024):.1f}MB)"
-                            
-                            logger.info(f"YouTube {format_type} downloaded successfully: {actual_file} ({file_size} bytes)")
-                            return actual_file, "Success"
-                        
-                        # If this attempt failed, try the next one
-                        if attempt == 3:
-                            return None, f"Downloaded file not found for {format_type} after all attempts"
-                        else:
-                            logger.warning(f"Attempt {attempt} failed, trying next approach...")
-                            continue
-                            
+                    rung, result = youtube_strategy.race(
+                        order[:2], lambda rung: self._extract_youtube(url, format_type, profile, rung, job)
+                    )
+                    extracted[rung] = result
+                    order = [rung] + [other for other in order if other != rung]
                 except Exception as e:
-                    logger.error(f"YouTube download attempt {attempt} failed: {e}")
-                    if attempt == 3:
-                        return None, f"Download failed after all attempts: {str(e)}"
-                    continue
+                    # Permanent errors (private, removed, unsupported) stop the ladder at once
+                    if not is_retryable(e) or len(order) == 2 or not job.retry_budget.spend():
+                        raise
+                    logger.warning(f"Both hedged YouTube clients failed, trying the rest: {e}")
+                    order = order[2:]
             
-            # If we reach here, all attempts failed
-            return None, "All download attempts failed"
+            rungs = iter(order)
+            
+            def next_rung():
+                rung = next(rungs)
+                return self._youtube_attempt(url, format_type, profile, rung, job, extracted.pop(rung, None),
+                                             size_limit)
+            
+            # Each rung uses other player clients, so there is nothing to wait for between them
+            ladder = RetryPolicy(attempts=len(order), base_delay=0)
+            return ladder.call(next_rung, budget=job.retry_budget, label=f"YouTube {format_type} download")
                 
         except Exception as e:
             logger.error(f"Error downloading YouTube {format_type}: {e}")
             return None, f"Download failed: {str(e)}"
     
-    def _cleanup_temp_files(self):
-        """Clean up temporary files older than 1 hour."""
-        try:
-            import time
-            current_time = time.time()
-            
-            for filename in os.listdir(TEMP_DIR):
-                file_path = os.path.join(TEMP_DIR, filename)
-                if os.path.isfile(file_path):
-                    file_age = current_time - os.path.getctime(file_path)
-                    if file_age > 3600:  # 1 hour
-                        os.remove(file_path)
-                        logger.info(f"Cleaned up old file: {filename}")
-        except Exception as e:
-            logger.error(f"Error cleaning up temp files: {e}")
-    
     def cleanup_file(self, file_path: str):
-        """Remove a specific file after use."""
+        """Remove a specific file after use, and its job directory once empty."""
         try:
             if file_path and os.path.exists(file_path):
                 os.remove(file_path)
                 logger.info(f"Cleaned up file: {file_path}")
+            if file_path:
+                job_dir = os.path.dirname(file_path)
+                if os.path.basename(job_dir).startswith('job_') and not os.listdir(job_dir):
+                    os.rmdir(job_dir)
+                    janitor.release(job_dir)
         except Exception as e:
             logger.error(f"Error cleaning up file {file_path}: {e}")
     
-    def compress_video(self, input_path, target_size_mb=45):
-        """Compress video to fit within Telegram's file size limit."""
+    async def choose_shrink_mode(self, input_path: str, limit: int = TELEGRAM_UPLOAD_LIMIT) -> str:
+        """Return 'compress' or 'split' for a file that is over `limit` bytes."""
+        try:
+            return await choose_shrink_mode(input_path, limit)
+        except Exception as e:
+            logger.error(f"Error choosing shrink mode: {e}")
+            return 'compress'
+    
+    async def split_video(self, input_path: str, max_bytes: int = TELEGRAM_UPLOAD_LIMIT) -> list[str] | None:
+        """
+        Split a file into stream-copied parts that each fit in `max_bytes`.
+        
+        Returns:
+            list: Part paths in playback order, or None if splitting failed
+        """
+        try:
+            parts, report = await split_to_parts(input_path, max_bytes)
+            if not parts:
+                logger.error(f"Splitting failed: {report}")
+            return parts
+        except Exception as e:
+            logger.error(f"Error splitting video: {e}")
+            return None
+    
+    async def compress_video(self, input_path, target_size_mb=TELEGRAM_UPLOAD_LIMIT / (1024 * 1024)):
+        """
+        Re-encode a file so it fits within `target_size_mb`.
+        
+        The bitrate is derived from the probed duration, see media_encoder.
+        
+        Returns:
+            str: Path of the compressed file, or None if it could not be made to fit
+        """
         try:
             if not os.path.exists(input_path):
                 logger.error(f"Input file not found: {input_path}")
                 return None
                 
-            # Get input file info
             input_size = os.path.getsize(input_path) / (1024 * 1024)  # MB
             logger.info(f"Compressing video: {input_size:.1f}MB -> {target_size_mb}MB")
             
-            # Create output path
             base_name = os.path.splitext(input_path)[0]
-            output_path = f"{base_name}_compressed.mp4"
-            
-            # Calculate compression ratio and bitrate
-            compression_ratio = target_size_mb / input_size
-            target_bitrate = max(100, int(500 * compression_ratio))  # Min 100k, scale based on compression
-            
-            # FFmpeg compression command
-            cmd = [
-                'ffmpeg', '-i', input_path,
-                '-c:v', 'libx264',
-                '-preset', 'fast',
-                '-crf', '28',
-                '-b:v', f'{target_bitrate}k',
-                '-c:a', 'aac',
-                '-b:a', '64k',
-                '-movflags', '+faststart',
-                '-y',  # Overwrite output file
-                output_path
-            ]
-            
-            logger.info(f"Running compression: {' '.join(cmd)}")
-            
-            # Run compression
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            output_path, report = await encode_to_size(input_path, f"{base_name}_compressed.mp4",
+                                                 int(target_size_mb * 1024 * 1024))
+            if not output_path:
+                logger.error(f"Compression failed: {report}")
+                return None
+                
+            logger.info(f"Compression successful: {report}")
             
-            if result.returncode == 0 and os.path.exists(output_path):
-                output_size = os.path.getsize(output_path) / (1024 * 1024)
-                logger.info(f"Compression successful: {output_size:.1f}MB")
+            # Clean up original file
+            try:
+                os.remove(input_path)
+            except OSError:
+                pass
                 
-                # Clean up original file
-                try:
-                    os.remove(input_path)
-                except:
-                    pass
-                    
-                return output_path
-            else:
-                logger.error(f"Compression failed: {result.stderr}")
-                return None
+            return output_path
                 
-        except subprocess.TimeoutExpired:
-            logger.error("Video compression timed out")
-            return None
         except Exception as e:
             logger.error(f"Error compressing video: {e}")
             return None
@@ -0,0 +1,155 @@
+"""
+Webhook ingestion with an embedded aiohttp server.
+
+Telegram POSTs every update to WEBHOOK_URL + WEBHOOK_PATH. The server checks
+the X-Telegram-Bot-Api-Secret-Token header, puts the update on the
+Application's update queue and answers 200 right away; the handlers from
+bot_handlers.py then run exactly as in polling mode, up to
+CONCURRENT_UPDATES at a time.
+
+The YouTube format buttons carry their link in the callback data, so a
+button press needs no memory of the message that showed it. The file_id
+cache and the job queue, however, are SQLite files under CACHE_DIR, local to
+the process's host: run one replica, or several on one host sharing CACHE_DIR
+(SQLite's WAL mode does not work over network file systems). Replicas with
+their own CACHE_DIR each keep a separate cache and queue, so leases and job
+dedup do not span them. Request coalescing (SingleFlight) is always per
+replica.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import signal
+import logging
+from aiohttp import web
+from telegram import Update
+from config import (BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT,
+                    WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_SET_ON_START)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+
+def secret_token_for(bot_token: str) -> str:
+    """
+    Webhook secret derived from the bot token.
+
+    Every replica computes the same value without sharing extra config, and
+    it only uses the characters Telegram allows (A-Z, a-z, 0-9, _ and -).
+    """
+    return hashlib.sha256(f"webhook:{bot_token}".encode()).hexdigest()
+
+
+class WebhookServer:
+    """aiohttp server that feeds verified Telegram updates into an Application."""
+
+    def __init__(self, application, secret_token: str, path: str = WEBHOOK_PATH,
+                 listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT):
+        self.application = application
+        self.secret_token = secret_token
+        self.path = path
+        self.listen = listen
+        self.port = port
+        self.stats = {"received": 0, "rejected": 0, "invalid": 0}
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        # For load balancer health checks
+        self.app.router.add_get('/healthz', self.handle_health)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        # Constant-time comparison, so the secret cannot be guessed byte by byte
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret_token):
+            self.stats["rejected"] += 1
+            logger.warning(f"Rejected webhook request from {request.remote}: bad secret token")
+            return web.Response(status=403)
+
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+            if update is None:
+                raise ValueError("empty update")
+        except (json.JSONDecodeError, AttributeError, TypeError, KeyError, ValueError) as e:
+            self.stats["invalid"] += 1
+            logger.warning(f"Invalid webhook payload: {e}")
+            return web.Response(status=400)
+
+        # Answer at once; Telegram re-delivers updates that are not acknowledged quickly
+        self.stats["received"] += 1
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"ok": True, **self.stats,
+                                  "queued": self.application.update_queue.qsize()})
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Webhook server listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def serve(application, webhook_url: str = WEBHOOK_URL, set_webhook: bool = WEBHOOK_SET_ON_START,
+                secret_token: str | None = None, stop_event: asyncio.Event | None = None,
+                **server_kwargs):
+    """
+    Run `application` behind the webhook server until SIGINT/SIGTERM or `stop_event`.
+
+    Args:
+        application: telegram.ext.Application built with updater(None)
+        webhook_url (str): Public base URL; WEBHOOK_PATH is appended
+        set_webhook (bool): Register the webhook with Telegram on startup.
+            Replicas share one URL, so re-registering from each is harmless.
+        secret_token (str): Expected secret header; defaults to
+            WEBHOOK_SECRET_TOKEN or one derived from the bot token
+        stop_event (asyncio.Event): Set to shut down (used by the stand-in)
+        **server_kwargs: Passed to WebhookServer (path, listen, port)
+    """
+    secret_token = secret_token or WEBHOOK_SECRET_TOKEN or secret_token_for(BOT_TOKEN or '')
+    server = WebhookServer(application, secret_token, **server_kwargs)
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    if set_webhook and not webhook_url:
+        raise RuntimeError("WEBHOOK_URL must be set to register the webhook")
+
+    await application.initialize()
+    try:
+        # run_polling/run_webhook would call these hooks; this server runs the app itself
+        if application.post_init:
+            await application.post_init(application)
+        # Listen before registering, so the first delivery finds the server up
+        await application.start()
+        await server.start()
+        if set_webhook:
+            # Pending updates are kept: replicas restart one at a time during deploys
+            await application.bot.set_webhook(
+                url=f"{webhook_url}{server.path}", secret_token=secret_token,
+                allowed_updates=ALLOWED_UPDATES, max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+            logger.info(f"Webhook registered at {webhook_url}{server.path}")
+        logger.info("Bot started (webhook mode)")
+        await stop_event.wait()
+    finally:
+        logger.info("Shutting down webhook server")
+        await server.stop()
+        if application.running:
+            await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for Telegram, to exercise webhook mode locally.
+
+Usage: python webhook_standin.py [message ...]   (default: /start)
+
+Starts a fake Bot API that records every call and answers with plausible
+results, runs the real bot (main.build_application + webhook_server) against
+it, then delivers each argument as a text message the way Telegram would,
+with the secret token header. A request with a wrong secret is sent too and
+must be rejected. Download links passed as messages still hit the real
+sites; only Telegram is replaced.
+"""
+import asyncio
+import itertools
+import os
+import sys
+import time
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:offline-stand-in")
+
+from aiohttp import ClientSession, web
+from main import build_application
+import webhook_server
+
+API_PORT = int(os.getenv("STANDIN_API_PORT", "8081"))
+WEBHOOK_PORT = int(os.getenv("STANDIN_WEBHOOK_PORT", "8443"))
+SETTLE_SECONDS = 3  # no API calls for this long means the handlers are done
+TIMEOUT = int(os.getenv("STANDIN_TIMEOUT", "300"))
+CHAT_ID = 1000
+SECRET = "stand-in-secret"
+
+
+class FakeBotApi:
+    """Minimal Bot API: records calls and returns messages/files for send methods."""
+
+    MEDIA = {"sendVideo": "video", "sendAudio": "audio", "sendDocument": "document"}
+
+    def __init__(self):
+        self.calls = []
+        self.last_call = time.monotonic()
+        self._ids = itertools.count(1)
+        self.app = web.Application(client_max_size=2 * 1024 ** 3)
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+
+    def _message(self, params: dict, **extra) -> dict:
+        return {"message_id": next(self._ids), "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id") or CHAT_ID), "type": "private"}, **extra}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = {key: (f"<{len(value.file.read())} bytes>" if isinstance(value, web.FileField) else value)
+                      for key, value in (await request.post()).items()}
+        self.calls.append((method, params))
+        self.last_call = time.monotonic()
+
+        if method == 'getMe':
+            result = {"id": 123456, "is_bot": True, "first_name": "Stand-in", "username": "standin_bot"}
+        elif method in ('sendMessage', 'editMessageText'):
+            result = self._message(params, text=params.get("text", ""))
+        elif method in self.MEDIA:
+            n = next(self._ids)
+            result = self._message(params, **{self.MEDIA[method]: {
+                "file_id": f"standin-{self.MEDIA[method]}-{n}", "file_unique_id": f"u{n}",
+                "width": 1280, "height": 720, "duration": 0}})
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+def text_update(update_id: int, text: str) -> dict:
+    message = {"message_id": update_id, "date": int(time.time()), "text": text,
+               "chat": {"id": CHAT_ID, "type": "private"},
+               "from": {"id": CHAT_ID, "is_bot": False, "first_name": "Tester"}}
+    if text.startswith('/'):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+async def main(messages: list[str]):
+    api = FakeBotApi()
+    api_runner = web.AppRunner(api.app, access_log=None)
+    await api_runner.setup()
+    await web.TCPSite(api_runner, '127.0.0.1', API_PORT).start()
+
+    stop = asyncio.Event()
+    application = build_application(webhook=True, base_url=f"http://127.0.0.1:{API_PORT}")
+    bot_task = asyncio.create_task(webhook_server.serve(
+        application, webhook_url=f"http://127.0.0.1:{WEBHOOK_PORT}", secret_token=SECRET,
+        stop_event=stop, listen='127.0.0.1', port=WEBHOOK_PORT,
+    ))
+    base = f"http://127.0.0.1:{WEBHOOK_PORT}"
+    url = f"{base}{webhook_server.WEBHOOK_PATH}"
+    async with ClientSession() as session:
+        # Wait until the webhook server answers health checks
+        while True:
+            if bot_task.done():
+                await bot_task  # startup failed; raise its error
+            try:
+                async with session.get(f"{base}/healthz") as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                pass
+            await asyncio.sleep(0.1)
+
+        async with session.post(url, json=text_update(1, "/start"),
+                                headers={webhook_server.SECRET_HEADER: "wrong"}) as response:
+            print(f"Wrong secret -> HTTP {response.status} (expected 403)")
+        for update_id, text in enumerate(messages, start=2):
+            async with session.post(url, json=text_update(update_id, text),
+                                    headers={webhook_server.SECRET_HEADER: SECRET}) as response:
+                print(f"Delivered {text!r} -> HTTP {response.status}")
+
+        deadline = time.monotonic() + TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+            if application.update_queue.empty() and time.monotonic() - api.last_call > SETTLE_SECONDS:
+                break
+        async with session.get(f"{base}/healthz") as response:
+            print(f"Health: {await response.json()}")
+
+    print("\nBot API calls:")
+    for method, params in api.calls:
+        details = {k: v for k, v in params.items() if k in ('text', 'caption', 'video', 'audio', 'url')}
+        print(f"  {method} {details}")
+
+    stop.set()
+    await bot_task
+    await api_runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1:] or ["/start"]))
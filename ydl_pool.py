@@ -0,0 +1,189 @@
+"""
+Pool of reusable, pre-configured YoutubeDL instances.
+
+Building a YoutubeDL initializes extractors, cookie jars, the HTTP request
+director and postprocessor chains. Instead of doing that for every attempt of
+every job, one pool per platform profile hands out warmed instances and takes
+them back. Per-job settings (output template, format, extractor args) are
+applied to the checked-out instance and restored on return, so the instance
+itself is never rebuilt.
+
+Instances of a profile share its cookie file. They save their jar one at a
+time per file, through a temporary file, so concurrent jobs never interleave
+writes and never leave a half-written jar behind.
+"""
+
+import copy
+import os
+import queue
+import threading
+import time
+import logging
+from contextlib import contextmanager
+import yt_dlp
+from config import DOWNLOAD_WORKERS, YDL_POOL_PREWARM, YDL_POOL_CHECKOUT_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+_cookie_locks: dict[str, threading.Lock] = {}
+_cookie_locks_guard = threading.Lock()
+
+
+def cookie_lock(path: str) -> threading.Lock:
+    """The lock serializing writes to one cookie file in this process."""
+    with _cookie_locks_guard:
+        return _cookie_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class _PooledYdl:
+    """A YoutubeDL plus the state needed to lend it to one job at a time."""
+
+    def __init__(self, opts: dict):
+        self.job = None
+        # The instance's only post-processor hook forwards to whichever job holds it
+        self.ydl = yt_dlp.YoutubeDL({**opts, 'postprocessor_hooks': [self._hook]})
+        self.base_outtmpl = copy.deepcopy(self.ydl.params['outtmpl'])
+        self.base_format = self.ydl.params.get('format')
+        self.base_format_selector = self.ydl.format_selector
+        self.base_extractor_args = copy.deepcopy(self.ydl.params.get('extractor_args'))
+
+    def _hook(self, d):
+        if self.job:
+            self.job.hook(d)
+
+    def lend(self, job, outtmpl: str | None, format_spec: str | None, extractor_args: dict | None):
+        self.job = job
+        params = self.ydl.params
+        if outtmpl:
+            params['outtmpl']['default'] = outtmpl
+        if format_spec and format_spec != self.base_format:
+            params['format'] = format_spec
+            # The selector is compiled once in __init__, so recompile just the selector
+            self.ydl.format_selector = self.ydl.build_format_selector(format_spec)
+        if extractor_args is not None:
+            params['extractor_args'] = extractor_args
+
+    def reset(self):
+        params = self.ydl.params
+        params['outtmpl'] = copy.deepcopy(self.base_outtmpl)
+        params['format'] = self.base_format
+        self.ydl.format_selector = self.base_format_selector
+        params['extractor_args'] = copy.deepcopy(self.base_extractor_args)
+        # Matches what leaving a `with YoutubeDL(...)` block used to do
+        self.save_cookies()
+        self.job = None
+
+    def save_cookies(self):
+        path = self.ydl.params.get('cookiefile')
+        if not path:
+            return
+        with cookie_lock(path):
+            # Other worker processes read and write the file too; replace it in one step
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            self.ydl.cookiejar.save(temp_path)
+            os.replace(temp_path, path)
+
+    def close(self):
+        self.save_cookies()
+        # YoutubeDL.close() would save the jar again, straight into the shared file
+        self.ydl.params['cookiefile'] = None
+        self.ydl.close()
+
+
+class YdlPool:
+    """Per-profile pools of YoutubeDL instances sized to the download workers."""
+
+    def __init__(self, profiles: dict[str, dict], size: int = DOWNLOAD_WORKERS,
+                 prewarm: int = YDL_POOL_PREWARM, checkout_timeout: float = YDL_POOL_CHECKOUT_TIMEOUT):
+        self.profiles = profiles
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self._idle = {name: queue.LifoQueue() for name in profiles}
+        self._created = {name: 0 for name in profiles}
+        self._lock = threading.Lock()
+        for name in profiles:
+            for _ in range(min(prewarm, size)):
+                self._created[name] += 1
+                self._idle[name].put(self._create(name))
+
+    def _create(self, profile: str) -> _PooledYdl:
+        """Build an instance for a slot already counted in _created; the slot is freed if that fails."""
+        logger.info(f"Creating YoutubeDL instance for profile '{profile}'")
+        try:
+            return _PooledYdl(self.profiles[profile])
+        except Exception:
+            with self._lock:
+                self._created[profile] -= 1
+            raise
+
+    def _acquire(self, profile: str) -> _PooledYdl:
+        """An idle instance, a new one if the pool is not full, else the next one returned."""
+        idle = self._idle[profile]
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            try:
+                return idle.get_nowait()
+            except queue.Empty:
+                pass
+            # Check and reserve together, so concurrent checkouts cannot overfill the pool
+            with self._lock:
+                reserved = self._created[profile] < self.size
+                if reserved:
+                    self._created[profile] += 1
+            if reserved:
+                return self._create(profile)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"No YoutubeDL instance for '{profile}' freed up "
+                                   f"within {self.checkout_timeout}s")
+            try:
+                # Wake up now and then: a discarded instance frees a slot without being put back
+                return idle.get(timeout=min(remaining, 1.0))
+            except queue.Empty:
+                continue
+
+    @contextmanager
+    def checkout(self, profile: str, job, outtmpl: str | None = None,
+                 format_spec: str | None = None, extractor_args: dict | None = None):
+        """
+        Borrow an instance of `profile` for one job.
+
+        Args:
+            profile (str): Profile name, e.g. 'youtube_video' or 'instagram'
+            job: DownloadJob that receives post-processor hook events
+            outtmpl (str): Output template; defaults to the job's directory
+            format_spec (str): Format selector overriding the profile's
+            extractor_args (dict): Extractor args overriding the profile's
+
+        Yields:
+            yt_dlp.YoutubeDL; TimeoutError if none is free within the
+            checkout timeout
+        """
+        idle = self._idle[profile]
+        pooled = self._acquire(profile)
+        pooled.lend(job, outtmpl or job.outtmpl(), format_spec, extractor_args)
+        try:
+            yield pooled.ydl
+        finally:
+            try:
+                pooled.reset()
+                idle.put(pooled)
+            except Exception as e:
+                # Never hand a half-reset instance to the next job
+                logger.error(f"Discarding YoutubeDL instance for '{profile}': {e}")
+                with self._lock:
+                    self._created[profile] -= 1
+
+    def stats(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: {"created": self._created[name], "idle": self._idle[name].qsize()}
+                    for name in self.profiles}
+
+    def close(self):
+        """Close every idle instance (saves cookies, closes HTTP handlers)."""
+        for idle in self._idle.values():
+            while True:
+                try:
+                    idle.get_nowait().close()
+                except queue.Empty:
+                    break
@@ -0,0 +1,121 @@
+"""
+Player client selection for YouTube downloads, learned from recent outcomes.
+
+yt-dlp's YouTube extractor behaves differently per player client: one gets
+past age gates or bot checks, another returns formats that download without
+403s. Which one works changes over time, and every client tried in vain
+costs a full extraction. Instead of always walking the same ladder, each
+rung (player clients plus format fallback) is tracked in an
+EndpointRegistry: new jobs start with the rung that succeeded most reliably
+and extracted fastest recently, and rungs that keep failing are skipped
+until their circuit closes again.
+
+With YOUTUBE_HEDGE_CLIENTS the extractions of the two best rungs can also
+be raced, the second starting YOUTUBE_HEDGE_DELAY seconds after the first.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from endpoint_registry import EndpointRegistry
+from config import (YOUTUBE_CLIENT_FAILURE_PENALTY, YOUTUBE_HEDGE_CLIENTS, YOUTUBE_HEDGE_DELAY,
+                    DOWNLOAD_WORKERS)
+
+logger = logging.getLogger(__name__)
+
+# name -> (extractor args for 'youtube', format selector per format type); None keeps the profile's own.
+# Listed in the order tried before any outcomes are known.
+RUNGS = {
+    'default': (None, None),
+    'android_music': ({'player_client': ['android_music', 'android'], 'player_skip': ['webpage', 'configs']},
+                      None),
+    # Also accepts lower formats for videos no other client can get
+    'ios': ({'player_client': ['ios', 'android_creator'], 'player_skip': ['webpage', 'configs', 'js']},
+            {'video': 'best[height<=720]/best[height<=480]/best', 'audio': 'bestaudio/worst'}),
+}
+
+
+class YouTubeClientStrategy:
+    """Rank YouTube player client rungs by recent outcomes and race the best two."""
+
+    def __init__(self, hedge: bool = YOUTUBE_HEDGE_CLIENTS, hedge_delay: float = YOUTUBE_HEDGE_DELAY,
+                 registry: EndpointRegistry | None = None):
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.registry = registry or EndpointRegistry(failure_penalty=YOUTUBE_CLIENT_FAILURE_PENALTY)
+        # Video and audio select different formats, so they are scored separately
+        for format_type in ('video', 'audio'):
+            for rung in RUNGS:
+                self.registry.register(self._group(format_type), self._name(format_type, rung))
+        self._executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="youtube-hedge")
+
+    @staticmethod
+    def _group(format_type: str) -> str:
+        return f"youtube_{format_type}"
+
+    @staticmethod
+    def _name(format_type: str, rung: str) -> str:
+        return f"{format_type}:{rung}"
+
+    def options(self, rung: str, format_type: str, base_extractor_args: dict) -> tuple[dict, str | None]:
+        """(extractor_args, format_spec) of a rung; the profile's own where the rung has none."""
+        client_args, formats = RUNGS[rung]
+        extractor_args = {'youtube': client_args} if client_args else base_extractor_args
+        return extractor_args, formats[format_type] if formats else None
+
+    def ranked(self, format_type: str) -> list[str]:
+        """Rungs to try, best first; the whole ladder if every circuit is open."""
+        prefix = f"{format_type}:"
+        healthy = [name[len(prefix):] for name in self.registry.healthy(self._group(format_type))]
+        if not healthy:
+            logger.warning(f"Every YouTube {format_type} client is failing; trying all of them")
+            return list(RUNGS)
+        return healthy
+
+    def record(self, format_type: str, rung: str, ok: bool, seconds: float):
+        """Report how a rung did: `seconds` is its extraction time."""
+        self.registry.record(self._name(format_type, rung), ok, seconds)
+
+    def stats(self) -> dict[str, dict]:
+        return self.registry.scores()
+
+    def race(self, rungs: list[str], extract) -> tuple[str, object]:
+        """
+        Run `extract(rung)` for the given rungs, staggered by the hedge delay,
+        and return the first one that succeeds.
+
+        The next rung is launched early when a running one fails. Extractions
+        that lose keep running in the background and are dropped.
+
+        Returns:
+            tuple: (rung, extract's result); the last error is raised if
+            every rung failed
+        """
+        pending = {}
+        launched = 0
+        last_error = None
+        try:
+            while True:
+                if launched < len(rungs):
+                    pending[self._executor.submit(extract, rungs[launched])] = rungs[launched]
+                    launched += 1
+                if not pending:
+                    raise last_error
+                wait_for = self.hedge_delay if launched < len(rungs) else None
+                done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rung = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    if launched > 1:
+                        logger.info(f"YouTube client '{rung}' won the extraction race")
+                    return rung, result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+# Shared by every YouTube download in this process
+strategy = YouTubeClientStrategy()